@@ -0,0 +1,266 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import time
+import traceback
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from ai_marketer import config
+from ai_marketer.rate_limiter import PRIORITY_BULK
+from ai_marketer.tracing import span
+from ai_marketer.user_db import iter_users, mark_inactive, subscription_days_left
+
+BROADCASTS_DIR = Path(os.getenv("BROADCASTS_DIR", "data/broadcasts"))
+PROGRESS_INTERVAL = 10.0
+
+BROADCAST_USAGE = (
+    "Рассылка: ответь командой на сообщение, которое нужно разослать, или напиши текст со следующей строки.\n"
+    "/broadcast [tariff=<код>] [expires=<дней>] [expired]\n"
+    "/broadcast_stop — остановить, /broadcast_resume [id] — продолжить с чекпоинта"
+)
+
+
+@dataclass
+class BroadcastFilter:
+    tariff: Optional[str] = None
+    # подписка активна и закончится не позже чем через N дней
+    expires_within: Optional[int] = None
+    # подписка была, но уже закончилась
+    expired: bool = False
+
+    @classmethod
+    def parse(cls, tokens: List[str]) -> "BroadcastFilter":
+        result = cls()
+        for token in tokens:
+            name, _, value = token.partition("=")
+            if name == "tariff" and value:
+                result.tariff = value
+            elif name == "expires" and value.isdigit():
+                result.expires_within = int(value)
+            elif name == "expired" and not value:
+                result.expired = True
+            else:
+                raise ValueError(f"Непонятный фильтр: {token}")
+        return result
+
+    def matches(self, user: Dict) -> bool:
+        if user.get("inactive"):
+            return False
+        if self.tariff and user.get("tariff") != self.tariff:
+            return False
+        days = subscription_days_left(user)
+        if self.expired and (days > 0 or not user.get("subscription_expires_at")):
+            return False
+        if self.expires_within is not None and not 0 < days <= self.expires_within:
+            return False
+        return True
+
+    def describe(self) -> str:
+        parts = []
+        if self.tariff:
+            parts.append(f"тариф {self.tariff}")
+        if self.expires_within is not None:
+            parts.append(f"истекает в ближайшие {self.expires_within} дн.")
+        if self.expired:
+            parts.append("подписка истекла")
+        return ", ".join(parts) or "все пользователи"
+
+
+@dataclass
+class BroadcastJob:
+    """Рассылка и её чекпоинт: пользователи обходятся по возрастанию id, last_user_id — докуда дошли."""
+
+    job_id: str
+    admin_chat_id: int
+    filters: Dict = field(default_factory=dict)
+    # либо текст, либо копия сообщения админа (сохраняет форматирование и медиа)
+    text: Optional[str] = None
+    from_chat_id: Optional[int] = None
+    message_id: Optional[int] = None
+    total: int = 0
+    last_user_id: int = 0
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    # running | stopped | done
+    status: str = "running"
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def path(self) -> Path:
+        return BROADCASTS_DIR / f"{self.job_id}.json"
+
+    def save(self):
+        BROADCASTS_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    @classmethod
+    def load(cls, job_id: str) -> Optional["BroadcastJob"]:
+        try:
+            with (BROADCASTS_DIR / f"{job_id}.json").open("r", encoding="utf-8") as f:
+                return cls(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    @classmethod
+    def latest_unfinished(cls) -> Optional["BroadcastJob"]:
+        if not BROADCASTS_DIR.exists():
+            return None
+        for path in sorted(BROADCASTS_DIR.glob("*.json"), reverse=True):
+            job = cls.load(path.stem)
+            if job is not None and job.status != "done":
+                return job
+        return None
+
+    def progress_text(self) -> str:
+        done = self.sent + self.blocked + self.failed
+        status = {"running": "идёт", "stopped": "остановлена", "done": "завершена"}[self.status]
+        return (
+            f"📣 Рассылка {self.job_id} ({BroadcastFilter(**self.filters).describe()}) — {status}\n"
+            f"Обработано: {done} из {self.total}\n"
+            f"✅ доставлено: {self.sent}\n"
+            f"🚫 заблокировали бота: {self.blocked}\n"
+            f"⚠️ ошибок: {self.failed}"
+        )
+
+
+def new_job(admin_chat_id: int, filters: BroadcastFilter, **message) -> BroadcastJob:
+    job = BroadcastJob(
+        job_id=time.strftime("%Y%m%d-%H%M%S"),
+        admin_chat_id=admin_chat_id,
+        filters=asdict(filters),
+        total=sum(1 for user in iter_users() if filters.matches(user)),
+        **message,
+    )
+    job.save()
+    return job
+
+
+class Broadcaster:
+    """Одна рассылка за раз: получатели идут пачками по BROADCAST_CONCURRENCY.
+
+    Темп задаёт SendScheduler (общий бакет, полоса PRIORITY_BULK — ответы пользователям идут
+    раньше рассылки). После каждой пачки пишется чекпоинт, так что при рестарте повторится
+    не больше одной пачки; /broadcast_stop останавливает рассылку между пачками. Заблокировавшие
+    бота копятся и пишутся в базу пользователей раз в PROGRESS_INTERVAL и в конце: users.json
+    перезаписывается целиком, и делать это на каждую пачку слишком дорого.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.job: Optional[BroadcastJob] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, bot, job: BroadcastJob) -> bool:
+        if self.running:
+            return False
+        self.job = job
+        job.status = "running"
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run(bot, job), context=contextvars.Context())
+        return True
+
+    async def stop(self) -> Optional[BroadcastJob]:
+        if not self.running:
+            return None
+        self._stop.set()
+        await self._task
+        return self.job
+
+    async def _send_one(self, bot, job: BroadcastJob, user_id: int) -> str:
+        try:
+            if job.message_id is not None:
+                await bot.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=job.from_chat_id,
+                    message_id=job.message_id,
+                    rate_limit_args=PRIORITY_BULK,
+                )
+            else:
+                await bot.send_message(user_id, job.text, rate_limit_args=PRIORITY_BULK)
+        except Forbidden:
+            return "blocked"
+        except BadRequest as exc:
+            return "blocked" if "chat not found" in str(exc).lower() else "failed"
+        except TelegramError:
+            return "failed"
+        return "sent"
+
+    async def _send_batch(self, bot, job: BroadcastJob, user_ids: List[int], blocked: List[int]):
+        results = await asyncio.gather(*(self._send_one(bot, job, user_id) for user_id in user_ids))
+        for result in results:
+            setattr(job, result, getattr(job, result) + 1)
+        blocked.extend(user_id for user_id, result in zip(user_ids, results) if result == "blocked")
+
+    @staticmethod
+    def _flush_blocked(blocked: List[int]):
+        mark_inactive(blocked)
+        blocked.clear()
+
+    async def _report(self, bot, job: BroadcastJob, message_id: Optional[int]):
+        with contextlib.suppress(TelegramError):
+            if message_id is None:
+                return (await bot.send_message(job.admin_chat_id, job.progress_text())).message_id
+            await bot.edit_message_text(job.progress_text(), chat_id=job.admin_chat_id, message_id=message_id)
+        return message_id
+
+    async def _run(self, bot, job: BroadcastJob):
+        filters = BroadcastFilter(**job.filters)
+        status_id = await self._report(bot, job, None)
+        last_report = time.monotonic()
+        batch: List[int] = []
+        blocked: List[int] = []
+        cursor = job.last_user_id
+        with span("broadcast", job_id=job.job_id):
+            try:
+                for user in iter_users(job.last_user_id):
+                    # Стоп проверяется на каждом пользователе: при узком фильтре пачка может
+                    # не набираться долго. Неотправленный хвост пачки останется за чекпоинтом.
+                    if self._stop.is_set():
+                        job.status = "stopped"
+                        break
+                    cursor = user["id"]
+                    if filters.matches(user):
+                        batch.append(user["id"])
+                    if len(batch) < self.concurrency:
+                        continue
+                    await self._send_batch(bot, job, batch, blocked)
+                    batch = []
+                    # Чекпоинт только на границе пачки: всё до cursor включительно обработано
+                    job.last_user_id = cursor
+                    job.save()
+                    if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                        self._flush_blocked(blocked)
+                        status_id = await self._report(bot, job, status_id)
+                        last_report = time.monotonic()
+                else:
+                    if batch:
+                        await self._send_batch(bot, job, batch, blocked)
+                    job.last_user_id = cursor
+                    job.status = "done"
+                    job.finished_at = time.time()
+            except Exception:  # noqa: BLE001
+                traceback.print_exc()
+                job.status = "stopped"
+            finally:
+                job.save()
+                self._flush_blocked(blocked)
+        await self._report(bot, job, status_id)
+
+
+BROADCASTER = Broadcaster(config.BROADCAST_CONCURRENCY)
@@ -18,8 +18,94 @@ SORA_MODEL = os.getenv("SORA_MODEL", OPENAI_MODEL)
 PRESENTATION_MODEL = os.getenv("PRESENTATION_MODEL", OPENAI_MODEL)
 TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.7"))
 OPENAI_RETRIES = 3
+# max_tokens генераций — бюджет видимого ответа; reasoning-модель тратит токены ещё и на
+# рассуждения, поэтому в max_completion_tokens к нему добавляется этот запас
+OPENAI_REASONING_HEADROOM = int(os.getenv("OPENAI_REASONING_HEADROOM", "4000"))
+# Сколько раз дописывать ответ, оборванный по лимиту (finish_reason="length")
+OPENAI_LENGTH_CONTINUATIONS = int(os.getenv("OPENAI_LENGTH_CONTINUATIONS", "1"))
 LOG_FILE = "logs.jsonl"
 
+# Трассировка апдейтов: jsonl | otlp | off
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "jsonl").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "5000"))
+
+# Профилирование апдейтов: включается и на лету (/profile on); апдейты медленнее порога
+# сохраняются с cProfile-профилем, хранится последних PROFILE_KEEP
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "2000"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+
+# Исходящие сообщения: лимиты Telegram на чат и на бота целиком
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1.0"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# Режим получения апдейтов: polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный https-адрес; пусто — setWebhook не вызывается
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # обязателен в webhook-режиме
+# В polling-режиме HTTP-сервер (/healthz, уведомления ЮKassa) поднимается только по флагу
+HTTP_SERVER_IN_POLLING = os.getenv("HTTP_SERVER_IN_POLLING", "0") == "1"
+ALLOWED_UPDATES = [
+    item.strip() for item in os.getenv("ALLOWED_UPDATES", "message,callback_query").split(",") if item.strip()
+]
+# Апдейты разных пользователей обрабатываются параллельно, одного — по порядку
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+
+# Сколько секунд повторное нажатие отдаёт готовый результат без новой генерации
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "600"))
+
+# Спекулятивная генерация экспресс-разбора (и обзора конкурентов) сразу после диагностики
+SPECULATIVE_PREFETCH = os.getenv("SPECULATIVE_PREFETCH", "0") == "1"
+SPECULATIVE_COMPETITORS = os.getenv("SPECULATIVE_COMPETITORS", "0") == "1"
+SPECULATIVE_MAX_CONCURRENCY = int(os.getenv("SPECULATIVE_MAX_CONCURRENCY", "4"))
+SPECULATIVE_DAILY_BUDGET = int(os.getenv("SPECULATIVE_DAILY_BUDGET", "200"))
+SPECULATIVE_TTL = float(os.getenv("SPECULATIVE_TTL", "1800"))
+
+# PDF-отчёты рендерятся в пуле процессов; готовые файлы кешируются по содержимому
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_RENDER_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT", "30"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Файлы продаж: лимит размера (Bot API отдаёт до 20 МБ), строк и размер чанка при чтении
+SALES_MAX_FILE_BYTES = int(os.getenv("SALES_MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+SALES_MAX_ROWS = int(os.getenv("SALES_MAX_ROWS", "2000000"))
+SALES_CHUNK_ROWS = int(os.getenv("SALES_CHUNK_ROWS", "50000"))
+# Разбор идёт в отдельном процессе: таймаут (сек) и сколько МБ памяти сверх старта ему можно
+SALES_PARSE_WORKERS = int(os.getenv("SALES_PARSE_WORKERS", "1"))
+SALES_PARSE_TIMEOUT = float(os.getenv("SALES_PARSE_TIMEOUT", "120"))
+SALES_PARSE_MEMORY_MB = int(os.getenv("SALES_PARSE_MEMORY_MB", "1024"))
+# Разобранные файлы хранятся в колоночном виде для повторного анализа; квота на пользователя
+SALES_DATASET_QUOTA_MB = int(os.getenv("SALES_DATASET_QUOTA_MB", "200"))
+# ЮKassa: таймаут (сек) и число попыток на запрос; после N неудач подряд запросы не шлём reset сек
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL", "https://api.yookassa.ru/v3")
+YOOKASSA_TIMEOUT = float(os.getenv("YOOKASSA_TIMEOUT", "10"))
+YOOKASSA_RETRIES = int(os.getenv("YOOKASSA_RETRIES", "3"))
+YOOKASSA_BREAKER_FAILURES = int(os.getenv("YOOKASSA_BREAKER_FAILURES", "5"))
+YOOKASSA_BREAKER_RESET = float(os.getenv("YOOKASSA_BREAKER_RESET", "30"))
+# Уведомления ЮKassa (payment.succeeded) принимает тот же HTTP-сервер, что и webhook Telegram;
+# платежи проверяются и активируются пачками до PAYMENT_BATCH_SIZE за PAYMENT_BATCH_WINDOW сек
+YOOKASSA_WEBHOOK_PATH = os.getenv("YOOKASSA_WEBHOOK_PATH", "/yookassa")
+PAYMENT_BATCH_SIZE = int(os.getenv("PAYMENT_BATCH_SIZE", "20"))
+PAYMENT_BATCH_WINDOW = float(os.getenv("PAYMENT_BATCH_WINDOW", "1.0"))
+# Неоплаченная ссылка переиспользуется PENDING_PAYMENT_TTL сек; сверка статусов раз в N сек
+PENDING_PAYMENT_TTL = float(os.getenv("PENDING_PAYMENT_TTL", "1800"))
+PENDING_RECONCILE_INTERVAL = float(os.getenv("PENDING_RECONCILE_INTERVAL", "60"))
+
+# Telegram id администраторов через запятую (/broadcast и другие служебные команды)
+ADMIN_IDS = {int(item) for item in os.getenv("ADMIN_IDS", "").split(",") if item.strip().isdigit()}
+# Сколько сообщений рассылки отправляется параллельно; темп всё равно задаёт SEND_GLOBAL_RATE
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "30"))
+
+# TTF-шрифты с кириллицей; если не заданы — ищем DejaVuSans в системных каталогах
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH", "")
+PDF_FONT_BOLD_PATH = os.getenv("PDF_FONT_BOLD_PATH", "")
+
 TARIFFS = {
     "start": {
         "name": "Старт",
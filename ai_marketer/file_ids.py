@@ -0,0 +1,86 @@
+import io
+import json
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+
+from telegram import InputFile
+from telegram.error import BadRequest
+
+from ai_marketer.tracing import span
+
+FILE_IDS_PATH = Path(os.getenv("FILE_IDS_PATH", "data/file_ids.json"))
+
+
+class FileIdCache:
+    """file_id документов, уже загруженных в Telegram: логическое имя → хеш содержимого и file_id.
+
+    На одно имя хранится одна запись, поэтому новое содержимое вытесняет старый file_id.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._data: Optional[Dict[str, Dict[str, str]]] = None
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        if self._data is None:
+            self._data = {}
+            if self.path.exists():
+                try:
+                    with self.path.open("r", encoding="utf-8") as f:
+                        self._data = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    self._data = {}
+        return self._data
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(self._load(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def get(self, name: str, digest: str) -> Optional[str]:
+        entry = self._load().get(name)
+        if entry and entry.get("sha256") == digest:
+            return entry.get("file_id")
+        return None
+
+    def set(self, name: str, digest: str, file_id: str):
+        self._load()[name] = {"sha256": digest, "file_id": file_id}
+        self._save()
+
+    def drop(self, name: str):
+        if self._load().pop(name, None) is not None:
+            self._save()
+
+
+FILE_IDS = FileIdCache(FILE_IDS_PATH)
+
+
+async def reply_document_cached(
+    message_obj,
+    name: str,
+    digest: str,
+    render: Callable[[], Awaitable[bytes]],
+    filename: str,
+    **kwargs,
+):
+    """Отправляет документ по file_id, если это содержимое уже загружалось; иначе рендерит и загружает.
+
+    digest — хеш содержимого (или входных данных рендера), render вызывается только при промахе.
+    """
+    file_id = FILE_IDS.get(name, digest)
+    if file_id:
+        try:
+            with span("send_document", cached=True):
+                return await message_obj.reply_document(document=file_id, **kwargs)
+        except BadRequest:
+            # file_id протух или бот сменил токен — загружаем заново.
+            FILE_IDS.drop(name)
+    data = await render()
+    with span("send_document", cached=False, bytes=len(data)):
+        message = await message_obj.reply_document(document=InputFile(io.BytesIO(data), filename=filename), **kwargs)
+    if message and message.document:
+        FILE_IDS.set(name, digest, message.document.file_id)
+    return message
@@ -0,0 +1,219 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from ai_marketer.user_db import DEFAULT_USAGE
+
+
+@dataclass(frozen=True)
+class Flow:
+    """Описание генерации: кнопка → (вопрос) → промпт → ответ GPT.
+
+    Если intro не задан, генерация запускается сразу по нажатию кнопки.
+    """
+
+    key: str
+    trigger: str
+    prompt: str
+    intro: Optional[str] = None
+    category: str = "text"
+    model_type: str = "default"
+    cache_ttl: float = 0.0
+    max_input_chars: int = 1500
+    max_tokens: Optional[int] = None
+    stream: bool = False
+    # Долгие генерации уходят в JobManager: хендлер не держит очередь пользователя.
+    background: bool = False
+
+    @property
+    def one_shot(self) -> bool:
+        return self.intro is None
+
+    @property
+    def metered(self) -> bool:
+        return self.category in DEFAULT_USAGE
+
+    def input_truncated(self, user_input: str) -> bool:
+        return len((user_input or "").strip()) > self.max_input_chars
+
+    def render(self, user_input: str) -> str:
+        """Промпт с вводом пользователя; ввод длиннее max_input_chars обрезается (см. input_truncated)."""
+        text = (user_input or "").strip()
+        if len(text) > self.max_input_chars:
+            text = text[: self.max_input_chars] + "…"
+        return self.prompt.format(input=text)
+
+
+FLOWS: Dict[str, Flow] = {}
+
+
+def register_flow(flow: Flow) -> Flow:
+    if flow.key in FLOWS:
+        raise ValueError(f"Flow уже зарегистрирован: {flow.key!r}")
+    FLOWS[flow.key] = flow
+    return flow
+
+
+# --- AI-Маркетолог ---
+register_flow(Flow(
+    key="quick_analyze",
+    trigger="📊 Провести анализ компании",
+    intro="Напиши в одной фразе: что продаёте, кому и через какие каналы сейчас?",
+    prompt=(
+        "Сделай экспресс-анализ компании и 5 точек роста."
+        " Формат: 1) Краткое резюме 2) Точки роста 3) Быстрые действия на 7 дней 4) Метрики.\n"
+        "Ввод: {input}"
+    ),
+    max_tokens=2500,
+))
+register_flow(Flow(
+    key="quick_strategy",
+    trigger="💡 Составить стратегию",
+    intro="Опиши цель на 30–90 дней и бюджет (диапазон).",
+    prompt=(
+        "Составь конспект стратегии на 90 дней: цели, каналы, гипотезы, вехи по неделям, риски, метрики."
+        " Дано: {input}"
+    ),
+    max_tokens=3000,
+    stream=True,
+))
+register_flow(Flow(
+    key="quick_cplan",
+    trigger="🧩 Создать контент-план",
+    intro="Ниша и ключевой продукт? Укажи площадку (TG/IG/ВК/YouTube).",
+    prompt=(
+        "Составь контент-план на 2 недели: 14 постов/роликов с идеей, тезисами, CTA и метрикой."
+        " Дано: {input}"
+    ),
+    max_tokens=3000,
+    stream=True,
+))
+register_flow(Flow(
+    key="quick_channels",
+    trigger="📈 Подобрать каналы трафика",
+    intro="Кто ЦА и какой средний чек?",
+    prompt=(
+        "Подбери 5 каналов трафика с обоснованием, старт-бюджетом, первыми шагами и основными рисками."
+        " Дано: {input}"
+    ),
+    max_tokens=2500,
+))
+register_flow(Flow(
+    key="ai_automation",
+    trigger="⚙️ Внедрить AI для автоматизации",
+    prompt=(
+        "Дай дорожную карту внедрения AI в SMB: контент, продажи, поддержка, аналитика, алерты, интеграции."
+        " Формат: этапы (2 недели, 30 дней, 60 дней), инструменты, метрики, риски."
+    ),
+    # Промпт не зависит от пользователя — ответ можно раздавать всем.
+    cache_ttl=6 * 3600,
+    max_tokens=2500,
+))
+
+# --- Генерация контента ---
+register_flow(Flow(
+    key="gen_image",
+    trigger="Создать изображение 🖼️",
+    intro="Опиши задачу: продукт/услуга, ЦА, эмоция и стиль. Сгенерирую готовые описания для нейросетей изображений и подписи.",
+    prompt=(
+        "Сгенерируй 4 подробных описания для генерации изображений (Midjourney/DALL·E):"
+        " каждая сцена должна включать ключевые объекты, настроение и композицию, а также подпись с CTA."
+        " Ввод: {input}"
+    ),
+    category="images",
+    max_tokens=2000,
+))
+register_flow(Flow(
+    key="gen_reels",
+    trigger="Создать Reels/Shorts 🎬",
+    intro="Укажи нишу/продукт и площадку. Дам 5 сценариев Reels/Shorts с хук-строкой и раскадровкой.",
+    prompt=(
+        "Сгенерируй 5 сценариев Reels/Shorts: хук, 3-4 шага сюжета, финальный CTA, длительность до 35 сек."
+        " Дано: {input}"
+    ),
+    category="video",
+    model_type="video",
+    max_tokens=2500,
+))
+register_flow(Flow(
+    key="gen_video",
+    trigger="Создать видео до 3 минут 🎥",
+    intro="Что за продукт и цель ролика? Сценарий будет до 3 минут с репликами и планом съёмок.",
+    prompt=(
+        "Напиши сценарий видео до 3 минут: интро, основной блок в 4-5 сценах, финальный оффер."
+        " Добавь таймкоды, визуальные подсказки и текст ведущего."
+        " Дано: {input}"
+    ),
+    category="video",
+    model_type="video",
+    max_tokens=3000,
+    stream=True,
+    background=True,
+))
+register_flow(Flow(
+    key="gen_presentation",
+    trigger="Создать презентацию 📑",
+    intro="Про что презентация и кто аудитория? Дам структуру до 20 слайдов с тезисами.",
+    prompt=(
+        "Сделай план презентации до 20 слайдов: заголовок, цель, тезисы, CTA."
+        " Укажи ключевые цифры/офер, предложи визуальные подсказки и спикер-ноты."
+        " Ввод: {input}"
+    ),
+    category="presentations",
+    model_type="presentations",
+    max_tokens=3500,
+    stream=True,
+    background=True,
+))
+register_flow(Flow(
+    key="reels",
+    trigger="Идеи Reels 🎬",
+    intro="Опиши продукт/услугу и площадку. Дам 10 идей с хук-строками.",
+    prompt=(
+        "Сгенерируй 10 идей Reels/Shorts: хук, сюжет в 3 шага, финальный CTA, хронометраж до 30 сек."
+        " Ввод: {input}"
+    ),
+    category="video",
+    model_type="video",
+    max_tokens=2500,
+))
+register_flow(Flow(
+    key="titles",
+    trigger="Заголовки 🔥",
+    intro="Какая тема? Дам 20 заголовков в 4 стилях.",
+    prompt=(
+        "Сгенерируй 20 заголовков: 5 инфо, 5 выгода, 5 триггер, 5 проблематика."
+        " Тема: {input}"
+    ),
+    max_tokens=1500,
+))
+register_flow(Flow(
+    key="posts",
+    trigger="Посты/описания ✍️",
+    intro="Тема/оффер и площадка (TG/IG/ВК/маркетплейс)?",
+    prompt=(
+        "Напиши 3 варианта поста/описания: краткий, подробный, продающий. Добавь CTA и эмодзи."
+        " Тема: {input}"
+    ),
+    max_tokens=2000,
+))
+register_flow(Flow(
+    key="cplan14",
+    trigger="Контент-план на 14 дней 🗓️",
+    intro="Ниша, задача (продажи/охваты/экспертность) и платформа?",
+    prompt=(
+        "Сформируй таблицей план на 14 дней: формат, идея, тезисы, CTA, цель метрики."
+        " Ввод: {input}"
+    ),
+    max_tokens=3000,
+    stream=True,
+))
+register_flow(Flow(
+    key="banners",
+    trigger="Тексты для баннеров 📣",
+    intro="Продукт + спецпредложение + ЦА. Дам 8 вариантов УТП в 4 форматах.",
+    prompt=(
+        "Сгенерируй 8 баннерных текстов: короткие (до 6 слов), оффер+боль, срочность, соц.доказательства."
+        " Дано: {input}"
+    ),
+    max_tokens=1500,
+))
@@ -1,13 +1,21 @@
 import asyncio
-from typing import Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from openai import AsyncOpenAI
 
 from ai_marketer import config
 from ai_marketer.logging_utils import log_event
+from ai_marketer.tracing import span
 
 client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
 
+DEFAULT_SYSTEM = (
+    "Ты — AI-маркетолог 360° в России в 2025 году, эксперт по стратегиям роста бизнеса, аналитике и автоматизации. "
+    "Отвечай чётко, по делу. Анализируй существующую информацию на данный момент по законам РФ и стратегиям, используемых "
+    "в РФ и отвечай с их пониманием. Укладывай свой ответ в 4096 символов (русских символов, кириллица)"
+)
+CONTINUE_PROMPT = "Ответ оборвался. Продолжи ровно с места обрыва, без повторов и вступлений."
+
 
 def _model_for_type(model_type: str) -> str:
     if model_type == "video":
@@ -17,44 +25,125 @@ def _model_for_type(model_type: str) -> str:
     return config.OPENAI_MODEL
 
 
+def _request_kwargs(prompt: str, system: Optional[str], temperature: float, model: str, max_tokens: Optional[int]) -> Dict:
+    messages: List[Dict[str, str]] = [
+        {"role": "system", "content": system or DEFAULT_SYSTEM},
+        {"role": "user", "content": prompt},
+    ]
+    kwargs: Dict = {"model": model, "messages": messages, "temperature": temperature}
+    if max_tokens:
+        kwargs["max_completion_tokens"] = max_tokens + config.OPENAI_REASONING_HEADROOM
+    return kwargs
+
+
+def _continuation_kwargs(base: Dict, current: Dict, partial: str) -> Dict:
+    """Запрос после finish_reason="length": пустой ответ (всё ушло на рассуждения) — повтор с
+    удвоенным лимитом, оборванный — продолжение с того же места."""
+    if not partial:
+        cap = current.get("max_completion_tokens")
+        return {**current, "max_completion_tokens": cap * 2} if cap else current
+    messages = base["messages"] + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+    return {**current, "messages": messages}
+
+
 async def chatgpt_answer(
     prompt: str,
     system: Optional[str] = None,
     temperature: float = config.TEMPERATURE,
     *,
     model_type: str = "default",
+    max_tokens: Optional[int] = None,
 ) -> str:
-    sys_msg = system or (
-        "Ты — AI-маркетолог 360° в России в 2025 году, эксперт по стратегиям роста бизнеса, аналитике и автоматизации. "
-        "Отвечай чётко, по делу. Анализируй существующую информацию на данный момент по законам РФ и стратегиям, используемых "
-        "в РФ и отвечай с их пониманием. Укладывай свой ответ в 4096 символов (русских символов, кириллица)"
-    )
     model = _model_for_type(model_type)
+    base = kwargs = _request_kwargs(prompt, system, temperature, model, max_tokens)
+    answer = ""
+    for continuation in range(config.OPENAI_LENGTH_CONTINUATIONS + 1):
+        text, finish_reason = await _complete(kwargs, model, len(prompt))
+        answer += text
+        if finish_reason != "length" or continuation == config.OPENAI_LENGTH_CONTINUATIONS:
+            break
+        kwargs = _continuation_kwargs(base, kwargs, answer)
+    answer = answer.strip()
+    log_event(
+        user_id=0,  # потом заменим на реальный ID в текстовом роутере
+        user_message=prompt,
+        bot_answer=answer,
+        stage="chatgpt_core",
+    )
+    return answer
+
+
+async def _complete(kwargs: Dict, model: str, prompt_chars: int) -> Tuple[str, Optional[str]]:
+    """Один запрос с ретраями: текст ответа и finish_reason."""
     last_err = None
     for attempt in range(config.OPENAI_RETRIES):
         try:
-            resp = await client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": sys_msg},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=temperature,
-            )
-            answer = (resp.choices[0].message.content or "").strip()
-            log_event(
-                user_id=0,  # потом заменим на реальный ID в текстовом роутере
-                user_message=prompt,
-                bot_answer=answer,
-                stage="chatgpt_core",
-            )
-            return answer
+            with span("chatgpt_answer", attempt=attempt + 1, model=model, prompt_chars=prompt_chars) as sp:
+                resp = await client.chat.completions.create(**kwargs)
+                choice = resp.choices[0]
+                if sp is not None:
+                    sp.attrs["finish_reason"] = choice.finish_reason or ""
+            return choice.message.content or "", choice.finish_reason
         except Exception as exc:  # noqa: BLE001
             last_err = exc
             await asyncio.sleep(0.8 * (attempt + 1))
     if last_err:
         raise last_err
-    return ""
+    return "", None
+
+
+async def chatgpt_stream(
+    prompt: str,
+    system: Optional[str] = None,
+    temperature: float = config.TEMPERATURE,
+    *,
+    model_type: str = "default",
+    max_tokens: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """Стриминговый вариант chatgpt_answer: отдаёт куски текста по мере генерации.
+
+    Ретраи возможны только до первого полученного куска. Оборванный по лимиту ответ
+    дописывается продолжением, его куски идут в тот же поток.
+    """
+    model = _model_for_type(model_type)
+    base = kwargs = _request_kwargs(prompt, system, temperature, model, max_tokens)
+    parts: List[str] = []
+    for continuation in range(config.OPENAI_LENGTH_CONTINUATIONS + 1):
+        finish_reason = None
+        for attempt in range(config.OPENAI_RETRIES):
+            received = len(parts)
+            try:
+                with span(
+                    "chatgpt_answer", attempt=attempt + 1, model=model, prompt_chars=len(prompt), stream=True
+                ) as sp:
+                    stream = await client.chat.completions.create(stream=True, **kwargs)
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        delta = chunk.choices[0].delta.content or ""
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+                    if sp is not None:
+                        sp.attrs["finish_reason"] = finish_reason or ""
+                break
+            except Exception:  # noqa: BLE001
+                if len(parts) > received or attempt == config.OPENAI_RETRIES - 1:
+                    raise
+                await asyncio.sleep(0.8 * (attempt + 1))
+        if finish_reason != "length" or continuation == config.OPENAI_LENGTH_CONTINUATIONS:
+            break
+        kwargs = _continuation_kwargs(base, kwargs, "".join(parts))
+    log_event(
+        user_id=0,
+        user_message=prompt,
+        bot_answer="".join(parts).strip(),
+        stage="chatgpt_core",
+    )
 
 
 async def ask_gpt_with_typing(
@@ -65,6 +154,7 @@ async def ask_gpt_with_typing(
     temperature: float = config.TEMPERATURE,
     *,
     model_type: str = "default",
+    max_tokens: Optional[int] = None,
 ):
     """Показывает статус typing и вызывает chatGPT с ретраями."""
     try:
@@ -72,4 +162,6 @@ async def ask_gpt_with_typing(
             await bot.send_chat_action(chat_id=chat_id, action="typing")
     except Exception:
         pass
-    return await chatgpt_answer(prompt, system=system, temperature=temperature, model_type=model_type)
+    return await chatgpt_answer(
+        prompt, system=system, temperature=temperature, model_type=model_type, max_tokens=max_tokens
+    )
@@ -0,0 +1,72 @@
+import hmac
+import json
+
+from aiohttp import web
+from telegram import Update
+
+from ai_marketer import config
+from ai_marketer.payment_events import PAYMENT_EVENTS, payment_id_from_notification
+from ai_marketer.sales_parser import PARSE_METRICS
+
+TELEGRAM_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def _telegram_update(request: web.Request) -> web.Response:
+    application = request.app["application"]
+    # Без секрета маршрут не монтируется (см. build_web_app), так что проверка есть всегда
+    token = request.headers.get(TELEGRAM_SECRET_HEADER, "")
+    if not hmac.compare_digest(token.encode(), config.WEBHOOK_SECRET.encode()):
+        return web.Response(status=403)
+    try:
+        data = await request.json(loads=json.loads)
+    except ValueError:
+        return web.Response(status=400)
+    update = Update.de_json(data, application.bot)
+    if update is None:
+        return web.Response(status=400)
+    # Отвечаем Telegram сразу, обработка идёт через очередь приложения.
+    await application.update_queue.put(update)
+    return web.Response()
+
+
+async def _yookassa_notification(request: web.Request) -> web.Response:
+    try:
+        data = await request.json(loads=json.loads)
+    except ValueError:
+        return web.Response(status=400)
+    # Телу уведомления не доверяем: платёж перепроверяется через API в PAYMENT_EVENTS.
+    payment_id = payment_id_from_notification(data)
+    if payment_id:
+        PAYMENT_EVENTS.submit(payment_id)
+    return web.Response()
+
+
+async def _health(request: web.Request) -> web.Response:
+    application = request.app["application"]
+    return web.json_response({
+        "ok": True,
+        "update_queue": application.update_queue.qsize(),
+        "sales_parse": PARSE_METRICS.snapshot(),
+        "payment_queue": PAYMENT_EVENTS.queue.qsize(),
+    })
+
+
+def build_web_app(application, *, telegram_updates: bool) -> web.Application:
+    """telegram_updates=False (polling) — без маршрута апдейтов: их приносит getUpdates."""
+    web_app = web.Application(client_max_size=2 * 1024 * 1024)
+    web_app["application"] = application
+    if telegram_updates:
+        if not config.WEBHOOK_SECRET:
+            raise RuntimeError("Webhook без WEBHOOK_SECRET принимал бы поддельные апдейты")
+        web_app.router.add_post(config.WEBHOOK_PATH, _telegram_update)
+    web_app.router.add_post(config.YOOKASSA_WEBHOOK_PATH, _yookassa_notification)
+    web_app.router.add_get("/healthz", _health)
+    return web_app
+
+
+async def start_http_server(application, *, telegram_updates: bool) -> web.AppRunner:
+    runner = web.AppRunner(build_web_app(application, telegram_updates=telegram_updates), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_LISTEN, config.WEBHOOK_PORT)
+    await site.start()
+    return runner
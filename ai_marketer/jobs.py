@@ -0,0 +1,125 @@
+import asyncio
+import contextlib
+import contextvars
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from ai_marketer.tracing import start_trace
+
+HEARTBEAT_INTERVAL = 4.0
+JOB_ERROR_TEXT = "Не получилось сгенерировать ответ. Попробуй ещё раз чуть позже 🙌"
+
+
+@dataclass
+class Job:
+    user_id: int
+    action: str
+    task: asyncio.Task
+    started_at: float
+
+
+class JobManager:
+    """Долгие генерации как фоновые задачи, привязанные к сессии пользователя.
+
+    Пока задача идёт, в чат уходит статус typing. При выходе пользователя в меню
+    задача отменяется (вместе с запросом к OpenAI), а on_cancel возвращает резерв лимита.
+    on_result выполняется вне очереди апдейтов пользователя: если is_current говорит, что
+    пользователь уже в другом сценарии, результат отбрасывается и лимит возвращается.
+    """
+
+    def __init__(self, heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        self.heartbeat_interval = heartbeat_interval
+        self._jobs: Dict[int, Dict[str, Job]] = {}
+
+    def is_running(self, user_id: int, action: str) -> bool:
+        job = self._jobs.get(user_id, {}).get(action)
+        return job is not None and not job.task.done()
+
+    def get(self, user_id: int, action: str) -> Optional[Job]:
+        return self._jobs.get(user_id, {}).get(action)
+
+    def running_for(self, user_id: int) -> int:
+        """Сколько фоновых задач пользователя ещё выполняется."""
+        return sum(1 for job in self._jobs.get(user_id, {}).values() if not job.task.done())
+
+    def start(
+        self,
+        user_id: int,
+        action: str,
+        generate: Callable[[], Awaitable[Any]],
+        *,
+        on_result: Callable[[Any], Awaitable[Any]],
+        bot=None,
+        chat_id: Optional[int] = None,
+        on_cancel: Optional[Callable[[], Any]] = None,
+        is_current: Optional[Callable[[], bool]] = None,
+    ) -> Optional[Job]:
+        """Запускает задачу; если такая же уже идёт у пользователя — возвращает None."""
+        if self.is_running(user_id, action):
+            return None
+        coro = self._run(user_id, action, generate, on_result, bot, chat_id, on_cancel, is_current)
+        # Чистый контекст: у фоновой задачи своя трасса, а не хвост трассы апдейта.
+        task = asyncio.create_task(coro, context=contextvars.Context())
+        job = Job(user_id=user_id, action=action, task=task, started_at=time.monotonic())
+        self._jobs.setdefault(user_id, {})[action] = job
+        task.add_done_callback(lambda _t: self._forget(job))
+        return job
+
+    def cancel_user(self, user_id: int) -> int:
+        jobs = self._jobs.get(user_id, {})
+        cancelled = 0
+        for job in list(jobs.values()):
+            if not job.task.done():
+                job.task.cancel()
+                cancelled += 1
+        return cancelled
+
+    def _forget(self, job: Job):
+        jobs = self._jobs.get(job.user_id)
+        if jobs and jobs.get(job.action) is job:
+            del jobs[job.action]
+            if not jobs:
+                del self._jobs[job.user_id]
+
+    async def _heartbeat(self, bot, chat_id: int):
+        while True:
+            with contextlib.suppress(Exception):
+                await bot.send_chat_action(chat_id=chat_id, action="typing")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _run(self, user_id, action, generate, on_result, bot, chat_id, on_cancel, is_current):
+        heartbeat = None
+        if bot and chat_id:
+            heartbeat = asyncio.create_task(self._heartbeat(bot, chat_id))
+        with start_trace(f"job.{action}", user_id=user_id):
+            try:
+                result = await generate()
+            except asyncio.CancelledError:
+                if on_cancel:
+                    on_cancel()
+                raise
+            except Exception:  # noqa: BLE001
+                traceback.print_exc()
+                if on_cancel:
+                    on_cancel()
+                if bot and chat_id:
+                    with contextlib.suppress(Exception):
+                        await bot.send_message(chat_id=chat_id, text=JOB_ERROR_TEXT)
+                return
+            finally:
+                if heartbeat:
+                    heartbeat.cancel()
+            if is_current is not None and not is_current():
+                # Пользователь ушёл в другой сценарий: ответ уже никто не ждёт.
+                if on_cancel:
+                    on_cancel()
+                return
+            try:
+                await on_result(result)
+            except Exception:  # noqa: BLE001
+                traceback.print_exc()
+
+
+JOBS = JobManager()
@@ -1,6 +1,7 @@
 import datetime
 import json
 from ai_marketer import config
+from ai_marketer.tracing import current_trace_id
 
 
 def log_event(user_id: int, user_message: str, bot_answer: str, stage: str = ""):
@@ -12,6 +13,7 @@ def log_event(user_id: int, user_message: str, bot_answer: str, stage: str = "")
             "stage": stage,
             "user_message": user_message,
             "bot_answer": bot_answer,
+            "trace_id": current_trace_id(),
         }
         with open(config.LOG_FILE, "a", encoding="utf-8") as f:
             f.write(json.dumps(record, ensure_ascii=False) + "\n")
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ai_marketer import config
+from ai_marketer.logging_utils import log_event
+from ai_marketer.payments import YOOKASSA, PaymentsError
+from ai_marketer.tracing import span
+from ai_marketer.user_db import activate_tariffs
+
+PROCESSED_PAYMENTS_PATH = Path(os.getenv("PROCESSED_PAYMENTS_PATH", "data/payments_processed.json"))
+PROCESSED_KEEP = 50000
+FETCH_RETRIES = 5
+
+
+@dataclass
+class PaymentOutcome:
+    payment_id: str
+    user_id: int
+    service_code: str
+    profile: Dict
+
+
+class ProcessedPayments:
+    """Id уже обработанных платежей: повторное уведомление ЮKassa ничего не активирует второй раз."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._data: Optional[Dict[str, Dict]] = None
+
+    def _load(self) -> Dict[str, Dict]:
+        if self._data is None:
+            self._data = {}
+            if self.path.exists():
+                try:
+                    with self.path.open("r", encoding="utf-8") as f:
+                        self._data = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    self._data = {}
+        return self._data
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(self._load(), f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def get(self, payment_id: str) -> Optional[Dict]:
+        return self._load().get(payment_id)
+
+    def add_many(self, records: Dict[str, Dict]):
+        if not records:
+            return
+        data = self._load()
+        data.update(records)
+        # dict хранит порядок вставки — старые записи срезаем с начала
+        for payment_id in list(data)[: max(len(data) - PROCESSED_KEEP, 0)]:
+            del data[payment_id]
+        self._save()
+
+
+def payment_id_from_notification(body: Dict) -> Optional[str]:
+    """Id платежа из уведомления ЮKassa, если это payment.succeeded; остальные события не нужны."""
+    if not isinstance(body, dict) or body.get("event") != "payment.succeeded":
+        return None
+    payment = body.get("object")
+    if not isinstance(payment, dict) or not isinstance(payment.get("id"), str):
+        return None
+    return payment["id"] or None
+
+
+def payment_owner(payment: Dict) -> Optional[int]:
+    """user_id из metadata платежа (ответа API), для которого бот создавал счёт."""
+    user_id = str((payment.get("metadata") or {}).get("user_id", ""))
+    return int(user_id) if user_id.isdigit() else None
+
+
+def _activation(payment: Dict) -> Optional[Tuple[int, str]]:
+    """(user_id, тариф) для оплаченного платежа; данные берём только из ответа API, не из уведомления."""
+    if payment.get("status") != "succeeded" or not payment.get("paid"):
+        return None
+    service_code = (payment.get("metadata") or {}).get("service_code")
+    user_id = payment_owner(payment)
+    if service_code not in config.TARIFFS or user_id is None:
+        return None
+    return user_id, service_code
+
+
+ActivatedCallback = Callable[[PaymentOutcome], Awaitable[None]]
+
+
+class PaymentEventProcessor:
+    """Очередь подтверждённых платежей: уведомления копятся и обрабатываются пачками.
+
+    Каждый платёж перепроверяется запросом GET /payments/{id}, тарифы активируются одной записью
+    в базу, id фиксируются в ProcessedPayments. Обработка пачек идёт строго по одной, поэтому
+    уведомление и кнопка «Я оплатил» не активируют один платёж дважды.
+    """
+
+    def __init__(self, processed: ProcessedPayments, *, batch_size: int, batch_window: float):
+        self.processed = processed
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._lock = asyncio.Lock()
+        self._attempts: Dict[str, int] = {}
+        self._on_activated: Optional[ActivatedCallback] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, on_activated: Optional[ActivatedCallback] = None):
+        self._on_activated = on_activated
+        if self._task is None:
+            self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def submit(self, payment_id: str):
+        self.queue.put_nowait(payment_id)
+
+    async def _next_batch(self) -> List[str]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), left))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.process(batch)
+            except Exception:  # noqa: BLE001
+                traceback.print_exc()
+
+    def _retry_later(self, payment_id: str):
+        attempts = self._attempts.get(payment_id, 0) + 1
+        if attempts > FETCH_RETRIES:
+            self._attempts.pop(payment_id, None)
+            log_event(0, payment_id, "payment check gave up", stage="payment_webhook")
+            return
+        self._attempts[payment_id] = attempts
+        asyncio.get_running_loop().call_later(2 ** attempts, self.submit, payment_id)
+
+    async def _fetch(self, payment_id: str, known: Dict[str, Dict]) -> Dict:
+        if payment_id in known:
+            return known[payment_id]
+        return await YOOKASSA.get_payment(payment_id)
+
+    async def process(
+        self, payment_ids: List[str], notify: bool = True, known: Optional[Dict[str, Dict]] = None
+    ) -> List[PaymentOutcome]:
+        """Проверяет платежи и активирует оплаченные; возвращает только новые активации.
+
+        known — уже полученные ответы GET /payments/{id}: повторно их не запрашиваем.
+        """
+        known = known or {}
+        async with self._lock:
+            ids = [pid for pid in dict.fromkeys(payment_ids) if self.processed.get(pid) is None]
+            if not ids:
+                return []
+            with span("payment_batch", size=len(ids)):
+                fetched = await asyncio.gather(
+                    *(self._fetch(pid, known) for pid in ids), return_exceptions=True
+                )
+                pending: Dict[str, Tuple[int, str]] = {}
+                records: Dict[str, Dict] = {}
+                for pid, payment in zip(ids, fetched):
+                    if isinstance(payment, PaymentsError):
+                        self._retry_later(pid)
+                        continue
+                    if isinstance(payment, BaseException):
+                        raise payment
+                    self._attempts.pop(pid, None)
+                    if payment.get("status") in ("pending", "waiting_for_capture"):
+                        continue  # ещё не оплачен — придёт следующее уведомление или нажатие кнопки
+                    activation = _activation(payment)
+                    records[pid] = {"status": payment.get("status"), "at": int(time.time())}
+                    owner = payment_owner(payment)
+                    if owner is not None:
+                        records[pid]["user_id"] = owner
+                    if activation:
+                        pending[pid] = activation
+                        records[pid].update(user_id=activation[0], service_code=activation[1])
+                profiles = activate_tariffs(list(dict.fromkeys(pending.values())))
+                self.processed.add_many(records)
+        outcomes = [
+            PaymentOutcome(pid, user_id, code, profiles[user_id]) for pid, (user_id, code) in pending.items()
+        ]
+        for outcome in outcomes:
+            log_event(outcome.user_id, f"paid:{outcome.service_code}", outcome.payment_id, stage="payment")
+            if notify and self._on_activated:
+                try:
+                    await self._on_activated(outcome)
+                except Exception as exc:  # noqa: BLE001
+                    print("PAYMENT NOTIFY ERROR:", exc)
+        return outcomes
+
+
+PAYMENT_EVENTS = PaymentEventProcessor(
+    ProcessedPayments(PROCESSED_PAYMENTS_PATH),
+    batch_size=config.PAYMENT_BATCH_SIZE,
+    batch_window=config.PAYMENT_BATCH_WINDOW,
+)
@@ -1,12 +1,192 @@
+import asyncio
+import time
 import uuid
-from typing import Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
+import httpx
 
 from ai_marketer import config
+from ai_marketer.tracing import span
 
 SERVICE_AMOUNTS: Dict[str, float] = {code: data["price"] for code, data in config.TARIFFS.items()}
 
+# Статусы, при которых имеет смысл повторить запрос с тем же Idempotence-Key
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class PaymentsError(Exception):
+    """Ошибка обращения к ЮKassa (после всех повторов)."""
+
+
+class CircuitOpenError(PaymentsError):
+    """ЮKassa недавно стабильно не отвечала — запросы временно не отправляем."""
+
+
+class CircuitBreaker:
+    """closed → (N ошибок подряд) → open → (reset_timeout) → half-open: один пробный запрос."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Запрос завершился без вердикта (отмена, непредвиденная ошибка): пробный слот свободен."""
+        self._probe_in_flight = False
+
+
+class YooKassaClient:
+    """Асинхронный клиент ЮKassa: общий пул keep-alive соединений, повторы с тем же
+    Idempotence-Key (ЮKassa вернёт уже созданный платёж, а не второй) и circuit breaker.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        shop_id: str,
+        api_key: str,
+        *,
+        timeout: float,
+        retries: int,
+        breaker: CircuitBreaker,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.shop_id = shop_id
+        self.api_key = api_key
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = breaker
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.shop_id and self.api_key)
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=(self.shop_id, self.api_key),
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        idempotence_key: Optional[str] = None,
+    ) -> Dict:
+        probe = self.breaker.state == "half-open"
+        if not self.breaker.allow():
+            raise CircuitOpenError("ЮKassa временно недоступна")
+        try:
+            return await self._request(method, path, json=json, params=params, idempotence_key=idempotence_key)
+        finally:
+            # Пробный запрос без вердикта (отмена задачи, сбой разбора ответа) иначе навсегда
+            # занял бы единственный слот half-open.
+            if probe:
+                self.breaker.release()
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: Optional[Dict[str, Any]],
+        params: Optional[Dict[str, Any]],
+        idempotence_key: Optional[str],
+    ) -> Dict:
+        headers = {"Idempotence-Key": idempotence_key} if idempotence_key else None
+        last_error: Optional[Exception] = None
+        with span("yookassa", method=method, path=path) as sp:
+            for attempt in range(1, self.retries + 1):
+                if sp is not None:
+                    sp.attrs["attempts"] = attempt
+                try:
+                    response = await self._http().request(method, path, json=json, params=params, headers=headers)
+                except httpx.TransportError as exc:
+                    last_error = exc
+                else:
+                    if response.status_code < 400:
+                        self.breaker.record_success()
+                        return response.json()
+                    if response.status_code not in _RETRY_STATUSES:
+                        # Ошибка в самом запросе: повтор не поможет, и ЮKassa при этом жива.
+                        self.breaker.record_success()
+                        raise PaymentsError(f"ЮKassa ответила {response.status_code}: {response.text[:300]}")
+                    last_error = PaymentsError(f"ЮKassa ответила {response.status_code}")
+                if attempt < self.retries:
+                    await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+        self.breaker.record_failure()
+        raise PaymentsError(str(last_error)) from last_error
+
+    async def create_payment(self, payload: Dict[str, Any], idempotence_key: Optional[str] = None) -> Dict:
+        return await self.request("POST", "/payments", json=payload, idempotence_key=idempotence_key or uuid.uuid4().hex)
+
+    async def get_payment(self, payment_id: str) -> Dict:
+        return await self.request("GET", f"/payments/{payment_id}")
+
+    async def list_payments(self, **params: Any) -> List[Dict]:
+        """Все платежи по фильтрам списка ЮKassa (status, created_at.gte, …) с обходом курсоров."""
+        params = {"limit": 100, **params}
+        items: List[Dict] = []
+        while True:
+            page = await self.request("GET", "/payments", params=params)
+            items.extend(page.get("items", []))
+            if not page.get("next_cursor"):
+                return items
+            params["cursor"] = page["next_cursor"]
+
+
+YOOKASSA = YooKassaClient(
+    config.YOOKASSA_API_URL,
+    config.YOOKASSA_SHOP_ID,
+    config.YOOKASSA_API_KEY,
+    timeout=config.YOOKASSA_TIMEOUT,
+    retries=config.YOOKASSA_RETRIES,
+    breaker=CircuitBreaker(config.YOOKASSA_BREAKER_FAILURES, config.YOOKASSA_BREAKER_RESET),
+)
+
 
 def _apply_promocode(amount: float, promo_code: Optional[str]) -> Tuple[float, Optional[str]]:
     if not promo_code:
@@ -21,9 +201,9 @@ def _apply_promocode(amount: float, promo_code: Optional[str]) -> Tuple[float, O
     return discounted_amount, normalized
 
 
-def create_payment(amount: float, description: str, metadata: Optional[Dict[str, str]] = None) -> Optional[Tuple[str, Dict]]:
+async def create_payment(amount: float, description: str, metadata: Optional[Dict[str, str]] = None) -> Optional[Tuple[str, Dict]]:
     """Создаёт платёж в ЮKassa и возвращает ссылку на оплату."""
-    if not config.YOOKASSA_SHOP_ID or not config.YOOKASSA_API_KEY:
+    if not YOOKASSA.configured:
         return None
 
     payload: Dict[str, object] = {
@@ -38,26 +218,22 @@ def create_payment(amount: float, description: str, metadata: Optional[Dict[str,
     if metadata:
         payload["metadata"] = metadata
 
-    headers = {"Idempotence-Key": uuid.uuid4().hex}
-    response = requests.post(
-        "https://api.yookassa.ru/v3/payments",
-        json=payload,
-        auth=(config.YOOKASSA_SHOP_ID, config.YOOKASSA_API_KEY),
-        headers=headers,
-        timeout=10,
-    )
-    response.raise_for_status()
-    data: Dict = response.json()
+    data = await YOOKASSA.create_payment(payload)
     confirmation = data.get("confirmation", {})
     return confirmation.get("confirmation_url"), data
 
 
-def build_service_payment(service_code: str, promo_code: Optional[str] = None) -> Optional[Tuple[str, Dict]]:
+async def build_service_payment(
+    service_code: str, promo_code: Optional[str] = None, user_id: Optional[int] = None
+) -> Optional[Tuple[str, Dict]]:
     amount = SERVICE_AMOUNTS.get(service_code)
     if amount is None:
         return None
 
     metadata: Dict[str, str] = {"service_code": service_code}
+    if user_id is not None:
+        # По user_id уведомление об оплате активирует тариф без участия пользователя
+        metadata["user_id"] = str(user_id)
 
     discounted_amount, normalized_promo = _apply_promocode(amount, promo_code)
     if normalized_promo:
@@ -69,4 +245,4 @@ def build_service_payment(service_code: str, promo_code: Optional[str] = None) -
     if normalized_promo:
         description += f" (промокод {normalized_promo})"
 
-    return create_payment(amount=discounted_amount, description=description, metadata=metadata)
+    return await create_payment(amount=discounted_amount, description=description, metadata=metadata)
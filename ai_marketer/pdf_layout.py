@@ -0,0 +1,128 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from ai_marketer import config
+
+REPORT_FONT = "ReportSans"
+REPORT_FONT_BOLD = "ReportSans-Bold"
+FONT_SEARCH_DIRS = (
+    "/usr/share/fonts/truetype/dejavu",
+    "/usr/share/fonts/dejavu",
+    "/usr/share/fonts/TTF",
+    "/Library/Fonts",
+    "C:\\Windows\\Fonts",
+)
+WIDTH_CACHE_LIMIT = 50_000
+
+_FONTS: Optional[Tuple[str, str]] = None
+_WIDTHS: Dict[Tuple[str, float], Dict[str, float]] = {}
+
+
+def _find_font(explicit: str, filename: str) -> Optional[str]:
+    if explicit:
+        return explicit if os.path.exists(explicit) else None
+    for directory in FONT_SEARCH_DIRS:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def register_fonts() -> Tuple[str, str]:
+    """Регистрирует TTF-шрифт с кириллицей один раз на процесс; без него — Helvetica."""
+    global _FONTS
+    if _FONTS is not None:
+        return _FONTS
+    regular = _find_font(config.PDF_FONT_PATH, "DejaVuSans.ttf")
+    bold = _find_font(config.PDF_FONT_BOLD_PATH, "DejaVuSans-Bold.ttf")
+    if not regular:
+        print("[WARN] TTF-шрифт с кириллицей не найден (PDF_FONT_PATH), PDF будет с Helvetica")
+        _FONTS = ("Helvetica", "Helvetica-Bold")
+        return _FONTS
+    pdfmetrics.registerFont(TTFont(REPORT_FONT, regular))
+    if bold:
+        pdfmetrics.registerFont(TTFont(REPORT_FONT_BOLD, bold))
+    _FONTS = (REPORT_FONT, REPORT_FONT_BOLD if bold else REPORT_FONT)
+    return _FONTS
+
+
+class TextLayout:
+    """Жадный перенос строк за один проход: ширина каждого слова считается один раз."""
+
+    def __init__(self, font: str, size: float, max_width: float):
+        self.font = font
+        self.size = size
+        self.max_width = max_width
+        self._widths = _WIDTHS.setdefault((font, size), {})
+        if len(self._widths) > WIDTH_CACHE_LIMIT:
+            self._widths.clear()
+        self.space_width = self.width(" ")
+
+    def width(self, word: str) -> float:
+        w = self._widths.get(word)
+        if w is None:
+            w = pdfmetrics.stringWidth(word, self.font, self.size)
+            self._widths[word] = w
+        return w
+
+    def wrap(self, text: str) -> List[str]:
+        lines: List[str] = []
+        for paragraph in text.split("\n"):
+            line: List[str] = []
+            line_width = 0.0
+            for word in paragraph.split():
+                w = self.width(word)
+                if line and line_width + self.space_width + w > self.max_width:
+                    lines.append(" ".join(line))
+                    line, line_width = [word], w
+                elif line:
+                    line.append(word)
+                    line_width += self.space_width + w
+                else:
+                    line, line_width = [word], w
+            lines.append(" ".join(line))
+            lines.append("")  # пустая строка между абзацами
+        return lines
+
+
+class PageWriter:
+    """Курсор по страницам canvas: заголовки и абзацы с переносом и пагинацией."""
+
+    def __init__(self, c, page_size: Tuple[float, float], *, margin: float = 18 * mm,
+                 bottom: float = 20 * mm, font_size: float = 11, leading: float = 14):
+        self.c = c
+        self.width, self.height = page_size
+        self.left = margin
+        self.top = self.height - 20 * mm
+        self.bottom = bottom
+        self.leading = leading
+        self.font, self.bold_font = register_fonts()
+        self.layout = TextLayout(self.font, font_size, self.width - 2 * margin)
+        self.y = self.top
+
+    def new_page(self):
+        self.c.showPage()
+        self.y = self.top
+
+    def line(self, text: str, *, size: float = 11, bold: bool = False, advance: Optional[float] = None):
+        self.c.setFont(self.bold_font if bold else self.font, size)
+        self.c.drawString(self.left, self.y, text)
+        self.y -= self.leading if advance is None else advance
+
+    def heading(self, text: str, *, size: float = 13, keep_with_next: float = 40 * mm):
+        if self.y < keep_with_next:
+            self.new_page()
+        self.line(text, size=size, bold=True, advance=18)
+
+    def paragraphs(self, text: str):
+        self.c.setFont(self.font, self.layout.size)
+        for ln in self.layout.wrap(text):
+            if self.y < self.bottom:
+                self.new_page()
+                self.c.setFont(self.font, self.layout.size)
+            self.c.drawString(self.left, self.y, ln)
+            self.y -= self.leading
@@ -0,0 +1,61 @@
+import hashlib
+import io
+import json
+from typing import Dict
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from ai_marketer import config
+from ai_marketer.cache import BytesLRUCache
+from ai_marketer.pdf_layout import PageWriter, register_fonts
+from ai_marketer.process_pool import WorkerPool
+from ai_marketer.text_utils import sanitize
+from ai_marketer.tracing import span
+
+PDF_CACHE = BytesLRUCache(config.PDF_CACHE_MAX_BYTES)
+PDF_POOL = WorkerPool(config.PDF_WORKERS, initializer=register_fonts)
+
+
+def make_pdf_report(username: str, summary_text: str, sections: Dict[str, str]) -> bytes:
+    """Синхронный рендер отчёта. Выполняется в процессе пула, поэтому зависит только от аргументов."""
+    bot_name = config.BOT_NAME
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    c.setTitle(f"Отчёт {bot_name}")
+    c.setAuthor(bot_name)
+
+    page = PageWriter(c, A4)
+    page.line(f"Итоговый отчёт — {bot_name}", size=16, bold=True)
+    page.line(f"Пользователь: {username}", advance=16)
+    page.heading("Краткое резюме")
+    page.paragraphs(sanitize(summary_text, 8000))
+
+    for title, body in sections.items():
+        page.heading(title)
+        page.paragraphs(sanitize(body, 8000))
+
+    c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def report_key(username: str, summary_text: str, sections: Dict[str, str]) -> str:
+    payload = json.dumps([username, summary_text or "", list((sections or {}).items())], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def render_pdf_report(username: str, summary_text: str, sections: Dict[str, str]) -> bytes:
+    """PDF из кеша или из пула процессов; при превышении PDF_RENDER_TIMEOUT — asyncio.TimeoutError."""
+    sections = sections or {}
+    key = report_key(username, summary_text, sections)
+    cached = PDF_CACHE.get(key)
+    with span("make_pdf_report", sections=len(sections), chars=len(summary_text or ""), cached=cached is not None):
+        if cached is not None:
+            return cached
+        pdf_bytes = await PDF_POOL.run(
+            make_pdf_report, username, summary_text, sections, timeout=config.PDF_RENDER_TIMEOUT
+        )
+    PDF_CACHE.set(key, pdf_bytes)
+    return pdf_bytes
+
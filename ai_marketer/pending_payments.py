@@ -0,0 +1,158 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from ai_marketer import config
+from ai_marketer.payment_events import PAYMENT_EVENTS
+from ai_marketer.payments import YOOKASSA, PaymentsError, build_service_payment
+from ai_marketer.tracing import span
+
+PENDING_PAYMENTS_PATH = Path(os.getenv("PENDING_PAYMENTS_PATH", "data/pending_payments.json"))
+
+
+def pending_key(user_id: int, service_code: str, promo_code: Optional[str]) -> str:
+    return f"{user_id}:{service_code}:{(promo_code or '').strip().lower()}"
+
+
+class PendingPayments:
+    """Неоплаченные платежи по (пользователь, услуга, промокод).
+
+    Пока ссылка не истекла и платёж не оплачен, повторное нажатие «Оплатить» отдаёт ту же ссылку
+    вместо нового платежа. Фоновая сверка раз в PENDING_RECONCILE_INTERVAL одним запросом списка
+    проверяет статусы: оплаченные отправляет в PAYMENT_EVENTS (на случай потерянного уведомления),
+    отменённые и просроченные удаляет.
+    """
+
+    def __init__(self, path: Path, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._data: Optional[Dict[str, Dict]] = None
+        # ключ → (замок, сколько задач его держат или ждут); свободные замки удаляются
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _load(self) -> Dict[str, Dict]:
+        if self._data is None:
+            self._data = {}
+            if self.path.exists():
+                try:
+                    with self.path.open("r", encoding="utf-8") as f:
+                        self._data = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    self._data = {}
+        return self._data
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(self._load(), f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def _fresh(self, key: str) -> Optional[Dict]:
+        entry = self._load().get(key)
+        if entry is None:
+            return None
+        if entry["expires_at"] <= time.time() or PAYMENT_EVENTS.processed.get(entry["payment"]["id"]) is not None:
+            del self._data[key]
+            self._save()
+            return None
+        return entry
+
+    @contextlib.asynccontextmanager
+    async def _key_lock(self, key: str):
+        lock, users = self._locks.get(key, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users > 1:
+                self._locks[key] = (lock, users - 1)
+            else:
+                del self._locks[key]
+
+    async def get_or_create(
+        self, user_id: int, service_code: str, promo_code: Optional[str] = None
+    ) -> Optional[Tuple[str, Dict]]:
+        """Как build_service_payment, но с переиспользованием ещё действующей ссылки."""
+        key = pending_key(user_id, service_code, promo_code)
+        # Двойное нажатие не должно успеть создать два платежа
+        async with self._key_lock(key):
+            entry = self._fresh(key)
+            if entry is not None:
+                return entry["url"], entry["payment"]
+            result = await build_service_payment(service_code, promo_code=promo_code, user_id=user_id)
+            if result and result[0] and result[1].get("id"):
+                now = time.time()
+                self._load()[key] = {
+                    "url": result[0],
+                    "payment": result[1],
+                    "created_at": now,
+                    "expires_at": now + self.ttl,
+                }
+                self._save()
+            return result
+
+    async def reconcile(self) -> Dict[str, int]:
+        """Сверяет статусы всех ожидающих платежей одним списком ЮKassa и чистит записи."""
+        data = self._load()
+        stats = {"succeeded": 0, "canceled": 0, "expired": 0}
+        if not data:
+            return stats
+        with span("pending_reconcile", pending=len(data)):
+            since = datetime.utcfromtimestamp(min(e["created_at"] for e in data.values()))
+            by_id = {entry["payment"]["id"]: key for key, entry in data.items()}
+            payments = await YOOKASSA.list_payments(**{"created_at.gte": since.strftime("%Y-%m-%dT%H:%M:%S.000Z")})
+            for payment in payments:
+                key = by_id.get(payment.get("id"))
+                status = payment.get("status")
+                if key is None or status not in ("succeeded", "canceled"):
+                    continue
+                if status == "succeeded":
+                    PAYMENT_EVENTS.submit(payment["id"])
+                data.pop(key, None)
+                stats[status] += 1
+            # Просрочку проверяем после сверки: оплату в последний момент не теряем
+            now = time.time()
+            for key in [key for key, entry in data.items() if entry["expires_at"] <= now]:
+                del data[key]
+                stats["expired"] += 1
+            if any(stats.values()):
+                self._save()
+        return stats
+
+    async def _reconcile_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reconcile()
+            except PaymentsError as exc:
+                print("PENDING RECONCILE:", exc)
+            except Exception:  # noqa: BLE001
+                traceback.print_exc()
+
+    def start(self, interval: float):
+        if self._task is None:
+            self._task = asyncio.create_task(self._reconcile_loop(interval), context=contextvars.Context())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+PENDING_PAYMENTS = PendingPayments(PENDING_PAYMENTS_PATH, config.PENDING_PAYMENT_TTL)
@@ -0,0 +1,172 @@
+import asyncio
+import itertools
+import multiprocessing
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Как часто проверять, взял ли воркер задачу: до этого таймаут не тикает
+PICKUP_CHECK_INTERVAL = 0.1
+# Сколько раз задачу можно переложить в новый пул, если старый закрыли до её старта
+RESUBMIT_ATTEMPTS = 2
+
+# Очередь «задача взята» в процессе воркера (задаётся инициализатором пула)
+_STARTED = None
+
+
+def _init_worker(started, initializer: Optional[Callable], initargs: Tuple):
+    global _STARTED
+    _STARTED = started
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _call(job_id: int, fn: Callable, args: Tuple) -> Any:
+    _STARTED.put((job_id, time.monotonic()))
+    return fn(*args)
+
+
+@dataclass
+class _Job:
+    executor: Optional[ProcessPoolExecutor] = None
+    future: Optional[asyncio.Future] = None
+    # time.monotonic() момента, когда воркер взял задачу (часы общие для процессов)
+    started: Optional[float] = None
+    # пул закрыт нами, а не упал из-за самой задачи
+    evicted: bool = False
+
+
+class WorkerPool:
+    """ProcessPoolExecutor с ленивым запуском и жёстким таймаутом на выполнение задачи.
+
+    Таймаут отсчитывается с момента, когда воркер взял задачу, а не с постановки в очередь.
+    Зависшую задачу через future не отменить, а убитый воркер ломает весь ProcessPoolExecutor,
+    поэтому по таймауту пул выводится из работы: новые задачи идут в новый пул, начатые задачи
+    других пользователей в старом доделываются, и только потом его процессы завершаются.
+    Задачи, которые старый пул так и не начал, перекладываются в новый.
+    """
+
+    def __init__(self, max_workers: int, initializer: Optional[Callable] = None, initargs: Tuple = ()):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._started_queue = None
+        self._jobs: Dict[int, _Job] = {}
+        # выведенные из работы пулы и их процессы (shutdown() забывает ссылки на процессы)
+        self._retired: List[Tuple[ProcessPoolExecutor, List[Any]]] = []
+        self._ids = itertools.count()
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            if self._started_queue is None:
+                self._started_queue = multiprocessing.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker,
+                initargs=(self._started_queue, self.initializer, self.initargs),
+            )
+        return self._executor
+
+    def _drain(self):
+        while True:
+            try:
+                job_id, started = self._started_queue.get_nowait()
+            except queue.Empty:
+                return
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.started = started
+
+    def _retire(self, executor: ProcessPoolExecutor):
+        """Новые задачи — в новый пул; старый завершается, когда в нём не останется чужих начатых задач."""
+        if self._executor is executor:
+            self._executor = None
+        if all(retired is not executor for retired, _ in self._retired):
+            processes = list((getattr(executor, "_processes", None) or {}).values())
+            self._retired.append((executor, processes))
+            executor.shutdown(wait=False)
+        self._collect()
+
+    def _collect(self):
+        self._drain()
+        for executor, processes in list(self._retired):
+            busy = any(
+                job.executor is executor and job.started is not None and not job.future.done()
+                for job in self._jobs.values()
+            )
+            if busy:
+                continue
+            self._retired.remove((executor, processes))
+            for job in self._jobs.values():
+                if job.executor is executor:
+                    job.evicted = True
+            executor.shutdown(wait=False, cancel_futures=True)
+            for proc in processes:
+                proc.terminate()
+
+    async def run(
+        self,
+        fn: Callable,
+        *args,
+        timeout: float,
+        poll: Optional[Callable[[], Any]] = None,
+        poll_interval: float = 1.0,
+    ) -> Any:
+        """Выполняет fn(*args) в пуле; poll вызывается на event loop каждые poll_interval секунд ожидания.
+
+        timeout — на выполнение в воркере; ожидание свободного воркера в него не входит.
+        """
+        loop = asyncio.get_running_loop()
+        job_id = next(self._ids)
+        job = self._jobs[job_id] = _Job()
+        try:
+            for attempt in range(1, RESUBMIT_ATTEMPTS + 1):
+                job.executor = self.executor()
+                job.future = loop.run_in_executor(job.executor, _call, job_id, fn, args)
+                job.started = None
+                job.evicted = False
+                try:
+                    return await self._wait(job, timeout, poll, poll_interval)
+                except BrokenProcessPool:
+                    self._drain()
+                    if (job.started is None or job.evicted) and attempt < RESUBMIT_ATTEMPTS:
+                        continue
+                    self._retire(job.executor)
+                    raise
+        except asyncio.TimeoutError:
+            job.future.cancel()
+            self._retire(job.executor)
+            raise
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        finally:
+            del self._jobs[job_id]
+            self._collect()
+
+    async def _wait(self, job: _Job, timeout: float, poll: Optional[Callable[[], Any]], poll_interval: float) -> Any:
+        loop = asyncio.get_running_loop()
+        deadline: Optional[float] = None
+        next_poll = loop.time() + poll_interval
+        while True:
+            self._drain()
+            if deadline is None and job.started is not None:
+                deadline = job.started + timeout
+            waits = [next_poll - loop.time()] if poll else []
+            if deadline is None:
+                waits.append(PICKUP_CHECK_INTERVAL)
+            else:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                waits.append(remaining)
+            done, _ = await asyncio.wait({job.future}, timeout=max(min(waits), 0))
+            if done:
+                return job.future.result()
+            if poll and loop.time() >= next_poll:
+                next_poll = loop.time() + poll_interval
+                poll()
@@ -0,0 +1,216 @@
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from ai_marketer import config
+from ai_marketer.state import get_state
+
+PROFILES_DIR = Path(os.getenv("PROFILES_DIR", "data/profiles"))
+PROFILE_INDEX = "index.jsonl"
+PROFILE_TOP = 25
+# Апдейт, чей профиль так и не закрылся (задачу отменили), перестаёт держать профайлер
+PROFILE_STALE_SECONDS = 600
+# Группы хендлеров: старт раньше всех, финиш после всех
+START_GROUP = -1
+FINISH_GROUP = 1000
+
+PROFILE_USAGE = (
+    "/profile — статус и последние медленные апдейты\n"
+    "/profile on [мс] — включить (порог по умолчанию из PROFILE_SLOW_MS)\n"
+    "/profile off — выключить"
+)
+
+
+@dataclass
+class _Run:
+    update_id: int
+    kind: str
+    stage: str
+    started: float
+    tags: Dict[str, Any] = field(default_factory=dict)
+    profile: Optional[cProfile.Profile] = None
+
+
+@dataclass
+class SlowUpdate:
+    at: str
+    update_id: int
+    user_id: Optional[int]
+    kind: str
+    handler: str
+    stage: str
+    duration_ms: float
+    tags: Dict[str, Any]
+    # файл .prof (pstats / snakeviz) или None, если в это время профилировался другой апдейт
+    profile: Optional[str]
+    top: List[str] = field(default_factory=list)
+
+
+_RUN: contextvars.ContextVar[Optional[_Run]] = contextvars.ContextVar("ai_marketer_profile_run", default=None)
+
+
+def _kind(update: Update) -> str:
+    if update.callback_query:
+        return f"callback:{(update.callback_query.data or '').split(':', 1)[0][:40]}"
+    message = update.effective_message
+    if message is None:
+        return "other"
+    if message.document:
+        return "document"
+    if message.text and message.text.startswith("/"):
+        return f"command:{message.text.split()[0][:40]}"
+    return "text"
+
+
+def _handler_name(application: Application, update: Update) -> str:
+    """Какой хендлер обработал апдейт: первый подходящий в первой сработавшей группе."""
+    for group, handlers in sorted(application.handlers.items()):
+        if group in (START_GROUP, FINISH_GROUP):
+            continue
+        for handler in handlers:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                return getattr(handler.callback, "__name__", type(handler).__name__)
+    return "-"
+
+
+class UpdateProfiler:
+    """Замер каждого апдейта от группы -1 до последней группы; медленные сохраняются с профилем.
+
+    Включается на лету (/profile on) без рестарта. cProfile в процессе один, поэтому профиль
+    пишется для одного апдейта за раз: остальные в это время только замеряются. В профиль
+    попадает всё, что event loop делал за время апдейта, включая чужие задачи.
+    """
+
+    def __init__(self, directory: Path, *, enabled: bool, slow_ms: float, keep: int):
+        self.directory = directory
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.keep = keep
+        self._active: Optional[_Run] = None
+        self.stats = {"timed": 0, "profiled": 0, "slow": 0}
+
+    def install(self, application: Application):
+        application.add_handler(TypeHandler(Update, self._start), group=START_GROUP)
+        application.add_handler(TypeHandler(Update, self._finish), group=FINISH_GROUP)
+
+    def tag(self, **tags: Any):
+        """Доп. сведения о текущем апдейте (например, ветка text_router); без профилирования — no-op."""
+        run = _RUN.get()
+        if run is not None:
+            run.tags.update(tags)
+
+    async def _start(self, update: Update, context):
+        if not self.enabled:
+            return
+        user = update.effective_user
+        run = _Run(
+            update_id=update.update_id,
+            kind=_kind(update),
+            stage=get_state(user.id).stage if user else "-",
+            started=time.monotonic(),
+        )
+        active = self._active
+        if active is not None and time.monotonic() - active.started > PROFILE_STALE_SECONDS:
+            active.profile.disable()
+            self._active = active = None
+        if active is None:
+            run.profile = cProfile.Profile()
+            self._active = run
+            run.profile.enable()
+        _RUN.set(run)
+
+    async def _finish(self, update: Update, context):
+        run = _RUN.get()
+        if run is None or run.update_id != update.update_id:
+            return
+        _RUN.set(None)
+        duration_ms = (time.monotonic() - run.started) * 1000
+        if run.profile is not None:
+            run.profile.disable()
+            if self._active is run:
+                self._active = None
+            self.stats["profiled"] += 1
+        self.stats["timed"] += 1
+        if duration_ms < self.slow_ms:
+            return
+        self.stats["slow"] += 1
+        user = update.effective_user
+        self._save(
+            SlowUpdate(
+                at=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                update_id=update.update_id,
+                user_id=user.id if user else None,
+                kind=run.kind,
+                handler=_handler_name(context.application, update),
+                stage=run.stage,
+                duration_ms=round(duration_ms, 1),
+                tags=run.tags,
+                profile=None,
+            ),
+            run.profile,
+        )
+
+    def _save(self, record: SlowUpdate, profile: Optional[cProfile.Profile]):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if profile is not None:
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{record.update_id}-{record.handler}.prof"
+            profile.dump_stats(str(self.directory / name))
+            record.profile = name
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            record.top = [line for line in out.getvalue().splitlines() if line.strip()][-PROFILE_TOP:]
+        with (self.directory / PROFILE_INDEX).open("a", encoding="utf-8") as f:
+            f.write(json.dumps(asdict(record), ensure_ascii=False) + "\n")
+        self._prune()
+
+    def _prune(self):
+        files = sorted(self.directory.glob("*.prof"))
+        for path in files[: max(len(files) - self.keep, 0)]:
+            path.unlink(missing_ok=True)
+        index = self.directory / PROFILE_INDEX
+        lines = index.read_text(encoding="utf-8").splitlines()
+        if len(lines) > self.keep * 2:
+            tmp = index.with_suffix(".tmp")
+            tmp.write_text("\n".join(lines[-self.keep:]) + "\n", encoding="utf-8")
+            os.replace(tmp, index)
+
+    def recent(self, limit: int = 5) -> List[Dict]:
+        index = self.directory / PROFILE_INDEX
+        if not index.exists():
+            return []
+        lines = index.read_text(encoding="utf-8").splitlines()[-limit:]
+        return [json.loads(line) for line in reversed(lines)]
+
+    def status_text(self, limit: int = 5) -> str:
+        state = f"включено, порог {self.slow_ms:.0f} мс" if self.enabled else "выключено"
+        lines = [
+            f"⏱ Профилирование апдейтов: {state}",
+            f"Замерено: {self.stats['timed']}, с профилем: {self.stats['profiled']}, медленных: {self.stats['slow']}",
+        ]
+        for item in self.recent(limit):
+            route = item["tags"].get("route")
+            where = f"{item['handler']}/{route}" if route else item["handler"]
+            lines.append(
+                f"• {item['at']} {where} stage={item['stage']} {item['duration_ms']:.0f} мс"
+                + (f" → {item['profile']}" if item["profile"] else "")
+            )
+        return "\n".join(lines)
+
+
+PROFILER = UpdateProfiler(
+    PROFILES_DIR,
+    enabled=config.PROFILE_ENABLED,
+    slow_ms=config.PROFILE_SLOW_MS,
+    keep=config.PROFILE_KEEP,
+)
@@ -0,0 +1,97 @@
+"""Промпты генераций вне FLOWS: собираются здесь, чтобы tools/check_prompt_budgets.py мог
+отрендерить их на фикстурах и проверить размер в токенах."""
+
+import json
+from typing import Dict, List, Optional
+
+# Сколько последних сообщений болталки уходит в модель
+CHAT_HISTORY_LIMIT = 12
+CHAT_SYSTEM_PROMPT = "Ты — AI-маркетолог 360°. Отвечай коротко, по делу, учитывай контекст диагностики."
+
+# Бюджеты в токенах на фикстурах tools/fixtures/prompts.json; "flow:<key>" — промпты FLOWS.
+# Запас ~25% к текущему размеру; поднимать бюджет — осознанное решение, а не правка ради зелёного CI.
+PROMPT_BUDGETS: Dict[str, int] = {
+    "demo_ideas": 190,
+    "demo_analysis": 450,
+    "plan_30d": 390,
+    "competitor_review": 170,
+    "final_report": 1000,
+    "chat": 1620,
+    "flow:quick_analyze": 180,
+    "flow:quick_strategy": 170,
+    "flow:quick_cplan": 160,
+    "flow:quick_channels": 160,
+    "flow:ai_automation": 100,
+    "flow:gen_image": 200,
+    "flow:gen_reels": 170,
+    "flow:gen_video": 190,
+    "flow:gen_presentation": 190,
+    "flow:reels": 160,
+    "flow:titles": 160,
+    "flow:posts": 160,
+    "flow:cplan14": 160,
+    "flow:banners": 170,
+}
+
+
+def _answers_json(answers: Dict) -> str:
+    return json.dumps(answers, ensure_ascii=False)
+
+
+def demo_ideas_prompt(product: Optional[str], channels: Optional[str], goal: Optional[str]) -> str:
+    return (
+        "Сгенерируй 6 быстрых гипотез роста для бизнеса на 30–60 дней, с приоритетами и ожидаемым эффектом.\n"
+        f"Бизнес: {product}\n"
+        f"Каналы сейчас: {channels}\n"
+        f"Цель: {goal}\n"
+        "Формат: нумерованный список, по каждой — идея, зачем, метрика, первый шаг."
+    )
+
+
+def demo_analysis_prompt(answers: Dict) -> str:
+    return (
+        "Сделай экспресс-разбор маркетинга по ответам пользователя.\n"
+        "Дай по делу: 1) Кратко о нише и модели 2) Сильные стороны 3) Слабые места/риски 4) Первые шаги на 7–14 дней "
+        "5) Приоритеты на 30 дней (3 пункта). Стиль: экспертно, дружелюбно, без воды, без символов * или #.\n\n"
+        f"Ответы пользователя (JSON): {_answers_json(answers)}"
+    )
+
+
+def plan_30d_prompt(answers: Dict) -> str:
+    return (
+        "Составь пошаговый 30-дневный план внедрения приоритетов: неделя за неделей,"
+        " задачи, ответственные роли, метрики успеха, ожидаемый эффект, чек-лист.\n"
+        f"Вводные (кратко): {_answers_json(answers)[:1200]}"
+    )
+
+
+def competitor_review_prompt(competitors: List[str], focus: str) -> str:
+    comps = "\n".join(competitors) if competitors else "Нет ссылок; подбери аналоги по нише."
+    return (
+        "Сделай краткий обзор конкурентов по нише пользователя.\n"
+        f"Ссылки/подсказки:\n{comps}\n\n"
+        f"Фокус: {focus}\n"
+        "Формат: 1) Наблюдения 2) Отличия 3) Риски 4) Возможности 5) 3 шага обойти конкурентов."
+    )
+
+
+def final_report_prompt(answers: Dict, sales_summary: Optional[str], competitors: List[str]) -> str:
+    sales_block = sales_summary or "Нет файла продаж. Рекомендую выгрузку для поиска потерь."
+    return (
+        "Сформируй итоговый отчёт AI-маркетолога 360° по 7 направлениям (кратко, по делу):\n"
+        "Направления: Продукт, Клиенты (ЦА), Продажи, Маркетинг, Команда, Конкуренты, Цифры.\n"
+        "В конце — приоритеты на 30 дней (5 пунктов).\n\n"
+        f"Исходные ответы пользователя (JSON): {_answers_json(answers)}\n"
+        f"Аналитика по файлу продаж (если есть): {sales_block}\n"
+        f"Ссылки конкурентов: {', '.join(competitors) if competitors else 'нет'}\n"
+        "Стиль: чётко, без Markdown, не используй символы * и #."
+    )
+
+
+def chat_messages(answers: Dict, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Сообщения для болталки: системный промпт, контекст диагностики и история диалога."""
+    return [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+        {"role": "system", "content": f"Контекст диагностики: {_answers_json(answers)}"},
+        *history,
+    ]
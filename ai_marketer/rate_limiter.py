@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+from ai_marketer import config
+from ai_marketer.tracing import span
+
+# Приоритеты (меньше — раньше). Передаются в методы бота как rate_limit_args.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# Методы, которые Telegram считает отправкой сообщений в чат.
+_LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+_UNLIMITED_ENDPOINTS = {"sendChatAction"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Забирает токен (можно в долг) и возвращает, сколько ждать до своей очереди."""
+        self._refill()
+        self.tokens -= 1
+        return max(-self.tokens / self.rate, 0.0)
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self) -> float:
+        self._refill()
+        return max((1 - self.tokens) / self.rate, 0.0)
+
+    def is_idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class PriorityTokenBucket:
+    """Глобальный бакет: при нехватке токенов первыми обслуживаются ожидающие с меньшим приоритетом."""
+
+    def __init__(self, rate: float, capacity: float):
+        self._bucket = TokenBucket(rate, capacity)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._drainer: Optional[asyncio.Task] = None
+
+    async def acquire(self, priority: int):
+        if not self._waiters and self._bucket.try_take():
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+        await fut
+
+    async def _drain(self):
+        while self._waiters:
+            delay = self._bucket.time_until_token()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():  # ожидающий отменён
+                continue
+            self._bucket.try_take()
+            fut.set_result(None)
+
+    async def close(self):
+        if self._drainer is not None:
+            self._drainer.cancel()
+        for _, _, fut in self._waiters:
+            if not fut.done():
+                fut.cancel()
+        self._waiters.clear()
+
+
+class SendScheduler(BaseRateLimiter[int]):
+    """Планировщик исходящих сообщений для ApplicationBuilder().rate_limiter().
+
+    Токен-бакет на чат (~1 сообщение/с), общий бакет (~30/с) с приоритетными полосами
+    и единая политика ретраев для RetryAfter / TimedOut / NetworkError.
+    """
+
+    def __init__(
+        self,
+        *,
+        chat_rate: float = config.SEND_CHAT_RATE,
+        chat_burst: float = config.SEND_CHAT_BURST,
+        global_rate: float = config.SEND_GLOBAL_RATE,
+        max_retries: int = config.SEND_MAX_RETRIES,
+        retry_delay: float = 1.0,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_rate = global_rate
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._global: Optional[PriorityTokenBucket] = None
+        self._calls = 0
+
+    async def initialize(self) -> None:
+        self._global = PriorityTokenBucket(self.global_rate, self.global_rate)
+
+    async def shutdown(self) -> None:
+        if self._global is not None:
+            await self._global.close()
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Группы и каналы: Telegram допускает ~20 сообщений в минуту.
+            group = isinstance(chat_id, str) or chat_id < 0
+            rate = 20 / 60 if group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        self._calls += 1
+        if self._calls % 1000 == 0:
+            self._chats = {key: b for key, b in self._chats.items() if not b.is_idle()}
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _wait_turn(self, chat_id: Any, priority: int):
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                await asyncio.sleep(delay)
+        if self._global is None:
+            await self.initialize()
+        await self._global.acquire(priority)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if not endpoint.startswith(_LIMITED_PREFIXES) or endpoint in _UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get("chat_id")
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+        attempt = 0
+        while True:
+            with span("telegram.send", endpoint=endpoint, priority=priority, attempt=attempt + 1):
+                await self._wait_turn(chat_id, priority)
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as exc:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = float(exc.retry_after) + 0.1
+                except BadRequest:
+                    # Наследник NetworkError, но повтор того же запроса ничего не исправит
+                    raise
+                except (TimedOut, NetworkError):
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self.retry_delay * (2 ** attempt)
+            attempt += 1
+            await asyncio.sleep(delay)
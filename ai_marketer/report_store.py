@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ai_marketer.text_utils import format_gpt_answer_for_telegram, split_for_telegram
+from ai_marketer.tracing import span
+
+REPORTS_DIR = Path(os.getenv("REPORTS_DIR", "data/reports"))
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "256"))
+REPORT_KEEP_VERSIONS = int(os.getenv("REPORT_KEEP_VERSIONS", "5"))
+
+
+@dataclass
+class StoredReport:
+    version: int
+    digest: str
+    created_at: str
+    text: str
+    sections: Dict[str, str] = field(default_factory=dict)
+    # Секции, уже отформатированные и порезанные под сообщения Telegram
+    chunks: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def report_digest(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def render_section_chunks(sections: Dict[str, str]) -> Dict[str, List[str]]:
+    return {
+        title: split_for_telegram(format_gpt_answer_for_telegram(f"{title}\n\n{body}"))
+        for title, body in sections.items()
+    }
+
+
+class ReportStore:
+    """Версионированные отчёты пользователей: data/reports/<uid>/v<N>.json.gz + LRU последних версий.
+
+    Отчёт переживает рестарт, а показ секции — это поиск готовых чанков без форматирования.
+    """
+
+    def __init__(self, root: Path, cache_size: int = REPORT_CACHE_SIZE, keep_versions: int = REPORT_KEEP_VERSIONS):
+        self.root = root
+        self.cache_size = cache_size
+        self.keep_versions = keep_versions
+        self._cache: "OrderedDict[int, Optional[StoredReport]]" = OrderedDict()
+
+    def _user_dir(self, user_id: int) -> Path:
+        return self.root / str(user_id)
+
+    def _versions(self, user_id: int) -> List[int]:
+        user_dir = self._user_dir(user_id)
+        if not user_dir.exists():
+            return []
+        versions = []
+        for path in user_dir.glob("v*.json.gz"):
+            try:
+                versions.append(int(path.name[1:].split(".", 1)[0]))
+            except ValueError:
+                continue
+        return sorted(versions)
+
+    def _remember(self, user_id: int, report: Optional[StoredReport]):
+        self._cache[user_id] = report
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _read(self, user_id: int, version: int) -> Optional[StoredReport]:
+        path = self._user_dir(user_id) / f"v{version}.json.gz"
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return StoredReport(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def latest(self, user_id: int) -> Optional[StoredReport]:
+        if user_id in self._cache:
+            self._cache.move_to_end(user_id)
+            return self._cache[user_id]
+        with span("report_store.load", user_id=user_id):
+            versions = self._versions(user_id)
+            report = self._read(user_id, versions[-1]) if versions else None
+        self._remember(user_id, report)
+        return report
+
+    def save(self, user_id: int, text: str, sections: Dict[str, str]) -> StoredReport:
+        digest = report_digest(text)
+        current = self.latest(user_id)
+        if current is not None and current.digest == digest:
+            return current
+        with span("report_store.save", user_id=user_id):
+            report = StoredReport(
+                version=(current.version if current else 0) + 1,
+                digest=digest,
+                created_at=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+                text=text,
+                sections=dict(sections),
+                chunks=render_section_chunks(sections),
+            )
+            user_dir = self._user_dir(user_id)
+            user_dir.mkdir(parents=True, exist_ok=True)
+            path = user_dir / f"v{report.version}.json.gz"
+            tmp = path.with_suffix(".tmp")
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                json.dump(asdict(report), f, ensure_ascii=False)
+            os.replace(tmp, path)
+            for old in self._versions(user_id)[:-self.keep_versions]:
+                (user_dir / f"v{old}.json.gz").unlink(missing_ok=True)
+        self._remember(user_id, report)
+        return report
+
+
+REPORTS = ReportStore(REPORTS_DIR)
@@ -0,0 +1,86 @@
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class TextRequest:
+    update: Any
+    context: Any
+    user: Any
+    st: Any
+    txt: str
+    chat_id: Optional[int]
+    profile: Optional[Dict] = None
+
+    @property
+    def message(self):
+        return self.update.message
+
+
+RouteHandler = Callable[[TextRequest], Awaitable[Any]]
+
+
+@dataclass(frozen=True)
+class Route:
+    handler: RouteHandler
+    needs_profile: bool = False
+    log: bool = False
+
+    @property
+    def name(self) -> str:
+        return getattr(self.handler, "__name__", "route")
+
+
+class TextRouter:
+    """Таблица маршрутов текстовых сообщений.
+
+    Порядок разрешения: точный текст кнопки → текущий stage → подстроки (в порядке регистрации).
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Route] = {}
+        self._stages: Dict[str, Route] = {}
+        self._contains: List[Tuple[str, Route]] = []
+
+    def exact(self, *texts: str, needs_profile: bool = False, log: bool = False):
+        def decorator(handler: RouteHandler) -> RouteHandler:
+            route = Route(handler, needs_profile=needs_profile, log=log)
+            for text in texts:
+                if text in self._exact:
+                    raise ValueError(f"Кнопка уже зарегистрирована: {text!r}")
+                self._exact[text] = route
+            return handler
+
+        return decorator
+
+    def stage(self, *stages: str, needs_profile: bool = False, log: bool = True):
+        def decorator(handler: RouteHandler) -> RouteHandler:
+            route = Route(handler, needs_profile=needs_profile, log=log)
+            for stage in stages:
+                if stage in self._stages:
+                    raise ValueError(f"Stage уже зарегистрирован: {stage!r}")
+                self._stages[stage] = route
+            return handler
+
+        return decorator
+
+    def contains(self, *fragments: str, needs_profile: bool = False, log: bool = False):
+        def decorator(handler: RouteHandler) -> RouteHandler:
+            route = Route(handler, needs_profile=needs_profile, log=log)
+            for fragment in fragments:
+                self._contains.append((fragment, route))
+            return handler
+
+        return decorator
+
+    def resolve(self, txt: str, stage: str) -> Optional[Route]:
+        route = self._exact.get(txt)
+        if route is not None:
+            return route
+        route = self._stages.get(stage)
+        if route is not None:
+            return route
+        for fragment, route in self._contains:
+            if fragment in txt:
+                return route
+        return None
@@ -0,0 +1,319 @@
+import re
+import warnings
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+DATE_RE = re.compile(r"date|дата|time|время|period|период", re.I)
+AMOUNT_RE = re.compile(r"revenue|amount|total|sum|выручк|сумм|итог|оборот|стоимост", re.I)
+PRICE_RE = re.compile(r"price|цена", re.I)
+QTY_RE = re.compile(r"qty|quantity|count|кол-?во|количеств|шт", re.I)
+PRODUCT_RE = re.compile(r"product|sku|item|goods|товар|продукт|наименован|артикул|услуг|номенклатур", re.I)
+CLIENT_RE = re.compile(r"client|customer|buyer|email|phone|клиент|покупател|заказчик|контрагент|телефон|почт", re.I)
+ID_RE = re.compile(r"(?:^|[^a-zа-я])id(?:$|[^a-zа-я])|код|code|номер|number|№|инн|inn", re.I)
+
+ABC_THRESHOLDS = (0.8, 0.95)
+FREQUENCY_BINS = (0, 1, 2, 4, 9, np.inf)
+TOP_PRODUCTS = 5
+MONTHS_IN_SUMMARY = 12
+# Частичные агрегаты по клиентам копятся списком и сворачиваются, когда строк становится больше
+PENDING_CLIENT_ROWS = 1_000_000
+
+
+@dataclass
+class ColumnMap:
+    date: Optional[str] = None
+    amount: Optional[str] = None
+    price: Optional[str] = None
+    qty: Optional[str] = None
+    product: Optional[str] = None
+    client: Optional[str] = None
+
+    def describe(self) -> str:
+        found = {k: v for k, v in self.__dict__.items() if v}
+        return ", ".join(f"{k}={v}" for k, v in found.items()) or "не распознаны"
+
+
+def _pick(columns: Sequence[str], pattern: re.Pattern, candidates: Optional[Sequence[str]] = None) -> Optional[str]:
+    pool = candidates if candidates is not None else columns
+    for col in pool:
+        if pattern.search(col):
+            return col
+    return None
+
+
+def detect_columns(sample: pd.DataFrame) -> ColumnMap:
+    """Угадывает роли колонок по названию и типу данных первого чанка."""
+    columns = [str(c) for c in sample.columns]
+    numeric = [str(c) for c in sample.select_dtypes(include="number").columns]
+    text = [c for c in columns if c not in numeric]
+    cmap = ColumnMap()
+    cmap.date = _pick(columns, DATE_RE)
+    if cmap.date is None:
+        for col in text:
+            parsed = _to_datetime(sample[col].head(50))
+            if parsed.notna().mean() > 0.8:
+                cmap.date = col
+                break
+    cmap.amount = _pick(numeric, AMOUNT_RE)
+    cmap.price = _pick(numeric, PRICE_RE)
+    cmap.qty = _pick(numeric, QTY_RE)
+    # Товар и клиент ищем и среди числовых колонок (client_id, артикул, телефон), текстовые — первыми
+    taken = {cmap.date, cmap.amount, cmap.price, cmap.qty}
+    pool = [c for c in text + numeric if c not in taken]
+    cmap.product = _pick(columns, PRODUCT_RE, pool)
+    cmap.client = _pick(columns, CLIENT_RE, [c for c in pool if c != cmap.product])
+    if cmap.amount is None and not (cmap.price and cmap.qty):
+        # Нет явной выручки — берём числовую колонку с наибольшей суммой, но не идентификатор:
+        # у id, телефонов и артикулов сумма обычно самая большая.
+        rest = [
+            c
+            for c in numeric
+            if c not in (cmap.qty, cmap.product, cmap.client)
+            and not ID_RE.search(c)
+            and not _unique_integers(sample[c])
+        ]
+        if rest:
+            cmap.amount = max(rest, key=lambda c: float(pd.to_numeric(sample[c], errors="coerce").abs().sum()))
+    return cmap
+
+
+def _unique_integers(values: pd.Series) -> bool:
+    """Целые без повторов — скорее номер строки или заказа, чем сумма.
+
+    Из parquet целые колонки читаются как float64, поэтому смотрим на значения, а не на dtype.
+    """
+    numbers = pd.to_numeric(values, errors="coerce").dropna()
+    return len(numbers) > 1 and bool((numbers % 1 == 0).all()) and numbers.is_unique
+
+
+def _keys(values: pd.Series) -> pd.Series:
+    """Ключ группировки строкой; числовые id без «.0», даже если в чанке были пропуски."""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        numbers = pd.to_numeric(values, errors="coerce")
+        if (numbers.dropna() % 1 == 0).all():
+            return numbers.astype("Int64").astype("string")
+    return values.astype("string")
+
+
+def _to_datetime(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    # Дат в выгрузке мало (дни/часы), строк — миллионы: парсим только уникальные значения.
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object)
+    # dayfirst нужен для 31.12.2024, но на ISO (2024-12-31) pandas с ним выводит формат %Y-%d-%m
+    iso = uniques.astype(str).str.match(r"\d{4}-\d{1,2}-").mean() > 0.5 if len(uniques) else False
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        parsed = pd.to_datetime(uniques, errors="coerce", dayfirst=not iso)
+    result = parsed.to_numpy()[codes]
+    result[codes < 0] = np.datetime64("NaT")
+    return pd.Series(result, index=values.index)
+
+
+def _compact(value: float) -> str:
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    for limit, suffix in ((1e9, "млрд"), (1e6, "млн"), (1e3, "тыс")):
+        if value >= limit:
+            return f"{sign}{value / limit:.1f} {suffix}"
+    return f"{sign}{value:.0f}"
+
+
+def _month_label(month: int) -> str:
+    return f"{month // 12 % 100:02d}-{month % 12 + 1:02d}"
+
+
+def _add_series(total: Optional[pd.Series], part: pd.Series) -> pd.Series:
+    return part if total is None else total.add(part, fill_value=0)
+
+
+class SalesAnalytics:
+    """Агрегаты, которые складываются по чанкам: выручка по месяцам и товарам, RFM-статы клиентов,
+    пары клиент×месяц для когорт. Итоговые метрики считаются в summary() по уже свёрнутым данным.
+    """
+
+    def __init__(self):
+        self.columns: Optional[ColumnMap] = None
+        self.orders = 0
+        self.revenue = 0.0
+        self.monthly: Optional[pd.Series] = None
+        self.products: Optional[pd.Series] = None
+        self._client_parts: List[pd.DataFrame] = []
+        self._pair_parts: List[pd.DataFrame] = []
+        self._pending_rows = 0
+
+    def add(self, chunk: pd.DataFrame):
+        if self.columns is None:
+            self.columns = detect_columns(chunk)
+        cmap = self.columns
+        amount = self._amount(chunk)
+        if amount is None:
+            return
+        valid = amount.notna()
+        self.orders += int(valid.sum())
+        self.revenue += float(amount[valid].sum())
+        frame = pd.DataFrame({"amount": amount})
+        if cmap.date:
+            frame["date"] = _to_datetime(chunk[cmap.date])
+            # Месяц как целое (год*12 + месяц): быстрее Period при группировках и вычитании
+            frame["month"] = frame["date"].dt.year * 12 + frame["date"].dt.month - 1
+        if cmap.product:
+            frame["product"] = _keys(chunk[cmap.product])
+        if cmap.client:
+            frame["client"] = _keys(chunk[cmap.client])
+        frame = frame[valid]
+
+        if "month" in frame:
+            self.monthly = _add_series(self.monthly, frame.groupby("month")["amount"].sum())
+        if "product" in frame:
+            self.products = _add_series(self.products, frame.groupby("product")["amount"].sum())
+        if "client" in frame:
+            self._add_clients(frame)
+
+    def _amount(self, chunk: pd.DataFrame) -> Optional[pd.Series]:
+        cmap = self.columns
+        if cmap.amount:
+            return pd.to_numeric(chunk[cmap.amount], errors="coerce")
+        if cmap.price and cmap.qty:
+            return pd.to_numeric(chunk[cmap.price], errors="coerce") * pd.to_numeric(chunk[cmap.qty], errors="coerce")
+        return None
+
+    def _add_clients(self, frame: pd.DataFrame):
+        agg = {"monetary": ("amount", "sum"), "frequency": ("amount", "size")}
+        if "date" in frame:
+            agg.update(first=("date", "min"), last=("date", "max"))
+            pairs = frame[["client", "month"]].dropna().drop_duplicates()
+            self._pair_parts.append(pairs)
+            self._pending_rows += len(pairs)
+        stats = frame.groupby("client").agg(**agg)
+        self._client_parts.append(stats)
+        self._pending_rows += len(stats)
+        if self._pending_rows > PENDING_CLIENT_ROWS:
+            self._compact_clients()
+
+    def _compact_clients(self):
+        if len(self._client_parts) > 1:
+            combined = pd.concat(self._client_parts)
+            rules = {"monetary": "sum", "frequency": "sum"}
+            if "first" in combined:
+                rules.update(first="min", last="max")
+            self._client_parts = [combined.groupby(level=0).agg(rules)]
+        if len(self._pair_parts) > 1:
+            self._pair_parts = [pd.concat(self._pair_parts).drop_duplicates()]
+        self._pending_rows = sum(len(part) for part in self._client_parts + self._pair_parts)
+
+    @property
+    def clients(self) -> Optional[pd.DataFrame]:
+        self._compact_clients()
+        return self._client_parts[0] if self._client_parts else None
+
+    @property
+    def client_months(self) -> Optional[pd.DataFrame]:
+        self._compact_clients()
+        return self._pair_parts[0] if self._pair_parts else None
+
+    # --- итоговые метрики ---
+
+    def _trend(self, monthly: pd.Series) -> Optional[float]:
+        """Наклон линейного тренда выручки, % от средней за месяц."""
+        if len(monthly) < 3 or monthly.mean() == 0:
+            return None
+        slope = np.polyfit(np.arange(len(monthly)), monthly.to_numpy(dtype=float), 1)[0]
+        return float(slope / monthly.mean() * 100)
+
+    def _abc(self) -> List[str]:
+        shares = self.products.sort_values(ascending=False)
+        total = shares.sum()
+        if total <= 0:
+            return []
+        n = len(shares)
+        cum = (shares.cumsum() / total).to_numpy()
+        a_end, b_end = (min(int(np.searchsorted(cum, t)) + 1, n) for t in ABC_THRESHOLDS)
+        a, b, c = a_end, b_end - a_end, n - b_end
+        top = ", ".join(f"{name} {value / total:.0%}" for name, value in shares.head(TOP_PRODUCTS).items())
+        return [
+            f"ABC товаров ({len(shares)}): A={a} ({a / len(shares):.0%} позиций → 80% выручки), B={b}, C={c}",
+            f"Топ-{min(TOP_PRODUCTS, len(shares))}: {top}",
+        ]
+
+    def _rfm(self, clients: pd.DataFrame) -> List[str]:
+        lines = []
+        repeat = float((clients["frequency"] > 1).mean())
+        lines.append(f"Клиентов: {len(clients)}, повторные: {repeat:.0%}, LTV ср.: {_compact(clients['monetary'].mean())}")
+        if "last" not in clients:
+            return lines
+        # Клиенты без распознанной даты в RFM не попадают: без давности сегмент не определить
+        clients = clients[clients["last"].notna()]
+        if len(clients) < 10:
+            return lines
+        now = clients["last"].max()
+        recency = (now - clients["last"]).dt.days
+        r = pd.qcut(recency.rank(method="first"), 5, labels=[5, 4, 3, 2, 1]).astype(int)
+        # Частоту режем по абсолютным порогам: у большинства клиентов одна покупка, квантили вырождаются.
+        f = pd.cut(clients["frequency"], FREQUENCY_BINS, labels=[1, 2, 3, 4, 5]).astype(int)
+        segments = np.select(
+            [(r >= 4) & (f >= 4), f >= 4, (r <= 2) & (f >= 3), (r <= 2), r >= 4],
+            ["чемпионы", "лояльные", "под угрозой", "ушедшие", "новые"],
+            default="спящие",
+        )
+        revenue = clients["monetary"].groupby(segments).sum()
+        counts = pd.Series(segments).value_counts()
+        total = clients["monetary"].sum() or 1.0
+        parts = [f"{seg} {counts[seg]} ({revenue[seg] / total:.0%} выручки)" for seg in counts.index]
+        lines.append("RFM: " + "; ".join(parts))
+        return lines
+
+    def _cohorts(self) -> Optional[str]:
+        pairs = self.client_months
+        if pairs is None or pairs.empty:
+            return None
+        first = pairs.groupby("client")["month"].transform("min")
+        age = pairs["month"] - first
+        cohort_sizes = first[age == 0].value_counts()
+        if len(cohort_sizes) < 2:
+            return None
+        last_month = pairs["month"].max()
+        retention = []
+        for lag in (1, 3):
+            active = first[age == lag].value_counts()
+            # Только когорты, которые уже успели дожить до этого месяца.
+            eligible = cohort_sizes[cohort_sizes.index <= last_month - lag]
+            if eligible.empty:
+                continue
+            rate = active.reindex(eligible.index, fill_value=0).sum() / eligible.sum()
+            retention.append(f"M{lag} {rate:.0%}")
+        if not retention:
+            return None
+        return f"Удержание когорт ({len(cohort_sizes)} мес.): " + ", ".join(retention)
+
+    def summary_lines(self) -> List[str]:
+        if self.columns is None:
+            return []
+        lines = [f"Колонки: {self.columns.describe()}"]
+        if not self.orders:
+            return lines
+        lines.append(f"Выручка: {_compact(self.revenue)}, строк-продаж: {self.orders}, ср. чек: {_compact(self.revenue / self.orders)}")
+        if self.monthly is not None and len(self.monthly):
+            monthly = self.monthly.sort_index()
+            monthly.index = monthly.index.astype(int)
+            first, last = int(monthly.index.min()), int(monthly.index.max())
+            monthly = monthly.reindex(range(first, last + 1), fill_value=0)
+            lines.append(f"Период: {_month_label(first)} — {_month_label(last)} ({len(monthly)} мес.)")
+            recent = monthly.tail(MONTHS_IN_SUMMARY)
+            lines.append("По месяцам: " + ", ".join(f"{_month_label(m)} {_compact(v)}" for m, v in recent.items()))
+            trend = self._trend(monthly)
+            if trend is not None:
+                lines.append(f"Тренд: {trend:+.1f}% в месяц от средней")
+        if self.products is not None and len(self.products):
+            lines.extend(self._abc())
+        clients = self.clients
+        if clients is not None and len(clients):
+            lines.extend(self._rfm(clients))
+            cohorts = self._cohorts()
+            if cohorts:
+                lines.append(cohorts)
+        return lines
@@ -0,0 +1,189 @@
+import csv
+import io
+import re
+import zipfile
+from dataclasses import dataclass, field
+from typing import IO, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from ai_marketer import config
+from ai_marketer.sales_analytics import SalesAnalytics
+
+SAMPLE_ROWS = 1000
+SNIFF_BYTES = 64 * 1024
+CSV_ENCODINGS = ("utf-8-sig", "cp1251")
+DATE_COLUMN_RE = re.compile(r"date|дата|time|время", re.I)
+
+BROKEN_FILE_TEXT = "Не получилось прочитать файл. Проверь формат/кодировку и попробуй снова."
+
+ProgressCallback = Callable[[int], None]
+
+
+class SalesFileError(Exception):
+    """Файл продаж нельзя разобрать; текст исключения можно показать пользователю."""
+
+
+@dataclass
+class SalesAccumulator:
+    """Бегущие агрегаты по файлу продаж: чанки складываются по мере чтения.
+
+    Если в файле нашлась выручка, сводка строится по SalesAnalytics, иначе — суммы числовых колонок.
+    """
+
+    columns: List[str] = field(default_factory=list)
+    numeric_columns: List[str] = field(default_factory=list)
+    rows: int = 0
+    sums: Dict[str, float] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+    truncated: bool = False
+    analytics: SalesAnalytics = field(default_factory=SalesAnalytics)
+
+    def add(self, chunk: pd.DataFrame):
+        if not self.columns:
+            self.columns = [str(c) for c in chunk.columns]
+            self.numeric_columns = [str(c) for c in chunk.select_dtypes(include="number").columns]
+        self.rows += len(chunk)
+        for col in self.numeric_columns[:3]:
+            if col not in chunk.columns:
+                continue
+            values = pd.to_numeric(chunk[col], errors="coerce")
+            self.sums[col] = self.sums.get(col, 0.0) + float(values.sum())
+            self.counts[col] = self.counts.get(col, 0) + int(values.count())
+        self.analytics.add(chunk)
+
+    def summary(self) -> str:
+        info = [f"Строк: {self.rows:,}".replace(",", " ")]
+        if self.truncated:
+            info[0] += " (дальше файл не читался — лимит строк)"
+        info.append(f"Колонок: {len(self.columns)}")
+        analytics = self.analytics.summary_lines()
+        if self.analytics.orders:
+            return "\n".join(info + analytics)
+        num_cols = self.numeric_columns
+        if num_cols:
+            info.append(f"Числовые колонки: {', '.join(num_cols[:6])}{' …' if len(num_cols)>6 else ''}")
+            for col in num_cols[:3]:
+                s = self.sums.get(col, 0.0)
+                m = s / self.counts[col] if self.counts.get(col) else 0.0
+                info.append(f"Σ {col}: {s:,.2f} | μ {col}: {m:,.2f}".replace(",", " "))
+        dt_cols = [c for c in self.columns if DATE_COLUMN_RE.search(c)]
+        if dt_cols:
+            info.append(f"Дата-колонки: {', '.join(dt_cols[:3])}")
+        return "\n".join(info)
+
+
+def summarize_sales_df(df: pd.DataFrame) -> str:
+    acc = SalesAccumulator()
+    acc.add(df)
+    return acc.summary()
+
+
+def _text_stream(fileobj: IO[bytes]) -> io.TextIOWrapper:
+    head = fileobj.read(SNIFF_BYTES)
+    fileobj.seek(0)
+    for encoding in CSV_ENCODINGS:
+        try:
+            head.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        return io.TextIOWrapper(fileobj, encoding=encoding, errors="replace", newline="")
+    return io.TextIOWrapper(fileobj, encoding="utf-8", errors="replace", newline="")
+
+
+def _sniff_delimiter(sample: str) -> str:
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+
+def iter_csv_chunks(fileobj: IO[bytes], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """CSV по чанкам; типы колонок выводятся по первым SAMPLE_ROWS строкам и фиксируются."""
+    text = _text_stream(fileobj)
+    try:
+        head = text.read(SNIFF_BYTES)
+        text.seek(0)
+        if len(head) == SNIFF_BYTES and "\n" in head:
+            head = head[: head.rfind("\n")]  # без обрезанной последней строки
+        sep = _sniff_delimiter(head)
+        sample = pd.read_csv(io.StringIO(head), sep=sep, nrows=SAMPLE_ROWS)
+        numeric = [col for col in sample.columns if pd.api.types.is_numeric_dtype(sample[col])]
+        # Всё читаем строками и числовые колонки приводим сами:
+        # «мусор» в середине файла не должен ронять чтение или менять тип колонки между чанками.
+        dtypes = {col: str for col in sample.columns}
+        for chunk in pd.read_csv(text, sep=sep, dtype=dtypes, chunksize=chunk_rows):
+            for col in numeric:
+                chunk[col] = pd.to_numeric(chunk[col].str.replace(",", ".", regex=False), errors="coerce")
+            yield chunk
+    finally:
+        # Не даём обёртке закрыть файл пользователя вместе с собой.
+        text.detach()
+
+
+def iter_xlsx_chunks(fileobj: IO[bytes], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """XLSX через openpyxl в read-only режиме: строки листа читаются потоком."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            return
+        columns = [str(c) if c is not None else f"col_{idx}" for idx, c in enumerate(header)]
+        batch: List[tuple] = []
+        for row in rows:
+            batch.append(row[: len(columns)])
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame.from_records(batch, columns=columns).infer_objects()
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=columns).infer_objects()
+    finally:
+        wb.close()
+
+
+def iter_sales_chunks(fileobj: IO[bytes], fname: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    fname = fname.lower()
+    if fname.endswith(".csv"):
+        return iter_csv_chunks(fileobj, chunk_rows)
+    if fname.endswith(".xlsx"):
+        return iter_xlsx_chunks(fileobj, chunk_rows)
+    if fname.endswith(".xls"):
+        # Старый бинарный формат потоком не читается; размер уже ограничен SALES_MAX_FILE_BYTES.
+        return iter([pd.read_excel(fileobj)])
+    raise SalesFileError("Поддерживаю CSV и XLSX. Отправь, пожалуйста, один из этих форматов.")
+
+
+def ingest_sales_file(
+    fileobj: IO[bytes],
+    fname: str,
+    *,
+    max_rows: Optional[int] = None,
+    chunk_rows: Optional[int] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    on_chunk: Optional[Callable[[pd.DataFrame], None]] = None,
+) -> SalesAccumulator:
+    """Читает файл продаж по чанкам и складывает агрегаты; после max_rows строк чтение прекращается."""
+    max_rows = config.SALES_MAX_ROWS if max_rows is None else max_rows
+    chunk_rows = config.SALES_CHUNK_ROWS if chunk_rows is None else chunk_rows
+    acc = SalesAccumulator()
+    try:
+        for chunk in iter_sales_chunks(fileobj, fname, chunk_rows):
+            left = max_rows - acc.rows
+            if len(chunk) > left:
+                chunk = chunk.iloc[:left]
+                acc.truncated = True
+            acc.add(chunk)
+            if on_chunk:
+                on_chunk(chunk)
+            if on_progress:
+                on_progress(acc.rows)
+            if acc.truncated:
+                break
+    except (zipfile.BadZipFile, pd.errors.ParserError, pd.errors.EmptyDataError) as exc:
+        raise SalesFileError(BROKEN_FILE_TEXT) from exc
+    if not acc.columns:
+        raise SalesFileError("Файл пустой или без заголовков колонок.")
+    return acc
@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import os
+import time
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from ai_marketer import config
+from ai_marketer.process_pool import WorkerPool
+from ai_marketer.sales_ingest import SalesAccumulator, SalesFileError, ingest_sales_file
+from ai_marketer.sales_store import META_FILE, DatasetWriter, enforce_quota, iter_dataset, load_meta, user_dir
+from ai_marketer.tracing import span
+
+TIMEOUT_TEXT = "Файл обрабатывается слишком долго. Выгрузи период покороче или только нужные колонки."
+MEMORY_TEXT = "Файл слишком тяжёлый для разбора. Выгрузи период покороче или только нужные колонки."
+ERROR_TEXT = "Не удалось обработать файл. Проверь формат/кодировку и попробуй снова."
+PROGRESS_INTERVAL = 2.0
+
+
+def _limit_memory(extra_mb: int):
+    """Инициализатор воркера: RLIMIT_AS = текущий объём адресного пространства + extra_mb."""
+    if extra_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:  # Windows
+        return
+    current = 0
+    try:
+        with open("/proc/self/statm", "r") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    limit = current + extra_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _write_progress(progress_path: str, rows: int):
+    with open(progress_path, "w") as f:
+        f.write(str(rows))
+
+
+def _read_progress(progress_path: str) -> Optional[int]:
+    try:
+        with open(progress_path, "r") as f:
+            return int(f.read() or 0)
+    except (OSError, ValueError):
+        return None
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _analyze_dataset(dataset: str, progress_path: str) -> Tuple[int, str]:
+    acc = SalesAccumulator()
+    for chunk in iter_dataset(Path(dataset), config.SALES_CHUNK_ROWS):
+        acc.add(chunk)
+        _write_progress(progress_path, acc.rows)
+    acc.truncated = bool((load_meta(Path(dataset)) or {}).get("truncated"))
+    return acc.rows, acc.summary()
+
+
+def _parse_file(path: str, fname: str, progress_path: str, store_dir: Optional[str]) -> Tuple[int, str]:
+    # Сводку считаем здесь же: обратно в бот едет текст, а не агрегаты по клиентам.
+    writer = None
+    if store_dir:
+        target = Path(store_dir) / _file_digest(path)[:16]
+        if load_meta(target) is not None:
+            # Тот же файл уже разбирали — читаем колонки с диска вместо повторного парсинга.
+            os.utime(target / META_FILE)
+            return _analyze_dataset(str(target), progress_path)
+        writer = DatasetWriter(target)
+    try:
+        with open(path, "rb") as f:
+            acc = ingest_sales_file(
+                f, fname,
+                on_progress=lambda rows: _write_progress(progress_path, rows),
+                on_chunk=writer.write if writer else None,
+            )
+        if writer:
+            writer.close(acc.rows, fname, acc.truncated)
+            enforce_quota(Path(store_dir))
+    except BaseException:
+        if writer:
+            writer.abort()
+        raise
+    return acc.rows, acc.summary()
+
+
+@dataclass
+class ParseResult:
+    ok: bool
+    rows: int = 0
+    summary: str = ""
+    # timeout | memory | crash | format | error
+    error: Optional[str] = None
+    message: str = ""
+    duration: float = 0.0
+
+
+@dataclass
+class ParseMetrics:
+    parsed: int = 0
+    failed: Dict[str, int] = field(default_factory=dict)
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def observe(self, result: ParseResult):
+        if result.ok:
+            self.parsed += 1
+        else:
+            self.failed[result.error] = self.failed.get(result.error, 0) + 1
+        self.total_seconds += result.duration
+        self.max_seconds = max(self.max_seconds, result.duration)
+
+    def snapshot(self) -> Dict:
+        total = self.parsed + sum(self.failed.values())
+        return {
+            "parsed": self.parsed,
+            "failed": dict(self.failed),
+            "avg_seconds": round(self.total_seconds / total, 3) if total else 0.0,
+            "max_seconds": round(self.max_seconds, 3),
+        }
+
+
+PARSE_POOL = WorkerPool(config.SALES_PARSE_WORKERS, initializer=_limit_memory, initargs=(config.SALES_PARSE_MEMORY_MB,))
+PARSE_METRICS = ParseMetrics()
+
+
+async def parse_sales_file(
+    path: str,
+    fname: str,
+    *,
+    user_id: Optional[int] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> ParseResult:
+    """Разбирает файл продаж в отдельном процессе с таймаутом и лимитом памяти; не бросает исключений.
+
+    С user_id разобранные данные сохраняются в колоночном виде для analyze_saved_dataset().
+    """
+    store_dir = str(user_dir(user_id)) if user_id is not None else None
+    progress_path = path + ".progress"
+    return await _run_parse(_parse_file, (path, fname, progress_path, store_dir), progress_path, fname, on_progress)
+
+
+async def analyze_saved_dataset(dataset: Path, *, on_progress: Optional[Callable[[int], None]] = None) -> ParseResult:
+    """Повторный анализ сохранённого датасета без повторной загрузки файла."""
+    progress_path = str(dataset) + ".progress"
+    return await _run_parse(_analyze_dataset, (str(dataset), progress_path), progress_path, dataset.name, on_progress)
+
+
+async def _run_parse(
+    fn: Callable, args: Tuple, progress_path: str, fname: str, on_progress: Optional[Callable[[int], None]]
+) -> ParseResult:
+    last_rows = 0
+
+    def poll():
+        nonlocal last_rows
+        rows = _read_progress(progress_path)
+        if on_progress and rows and rows != last_rows:
+            last_rows = rows
+            on_progress(rows)
+
+    started = time.perf_counter()
+    with span("parse_sales_file", fname=fname) as sp:
+        try:
+            rows, summary = await PARSE_POOL.run(
+                fn, *args, timeout=config.SALES_PARSE_TIMEOUT, poll=poll, poll_interval=PROGRESS_INTERVAL,
+            )
+            result = ParseResult(ok=True, rows=rows, summary=summary)
+        except asyncio.TimeoutError:
+            result = ParseResult(ok=False, error="timeout", message=TIMEOUT_TEXT)
+        except MemoryError:
+            result = ParseResult(ok=False, error="memory", message=MEMORY_TEXT)
+        except BrokenProcessPool:
+            # Воркер убит (чаще всего OOM killer) — для пользователя это тот же «слишком тяжёлый файл».
+            result = ParseResult(ok=False, error="crash", message=MEMORY_TEXT)
+        except SalesFileError as exc:
+            result = ParseResult(ok=False, error="format", message=str(exc))
+        except Exception:  # noqa: BLE001
+            traceback.print_exc()
+            result = ParseResult(ok=False, error="error", message=ERROR_TEXT)
+        finally:
+            if os.path.exists(progress_path):
+                os.remove(progress_path)
+        result.duration = time.perf_counter() - started
+        if sp is not None:
+            sp.attrs.update(ok=result.ok, error=result.error or "")
+    PARSE_METRICS.observe(result)
+    return result
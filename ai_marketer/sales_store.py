@@ -0,0 +1,245 @@
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from ai_marketer import config
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # без pyarrow храним колонки как raw-файлы под np.memmap
+    pa = pq = None
+
+SALES_DATASETS_DIR = Path(os.getenv("SALES_DATASETS_DIR", "data/datasets"))
+META_FILE = "meta.json"
+PARQUET_FILE = "data.parquet"
+
+
+class ParquetDatasetWriter:
+    """Чанки → один Parquet-файл; схема фиксируется по первому чанку, строки хранятся словарём.
+
+    Типы колонок в чанках xlsx выводятся заново, поэтому каждый чанк приводится к видам
+    колонок первого: «n/a» в числовой колонке становится пропуском, а не ошибкой cast.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._writer = None
+        self._schema = None
+        self._kinds: Optional[Dict[str, str]] = None
+
+    def write(self, chunk: pd.DataFrame):
+        chunk = chunk.copy()
+        if self._kinds is None:
+            self._kinds = {}
+            for col in chunk.columns:
+                if pd.api.types.is_datetime64_any_dtype(chunk[col]):
+                    self._kinds[col] = "datetime"
+                elif pd.api.types.is_numeric_dtype(chunk[col]):
+                    self._kinds[col] = "number"
+                else:
+                    self._kinds[col] = "string"
+        for col, kind in self._kinds.items():
+            if kind == "number":
+                # float64, как в memmap: целая колонка первого чанка не обрежет дроби в следующих
+                chunk[col] = pd.to_numeric(chunk[col], errors="coerce").astype("float64")
+            elif kind == "datetime":
+                chunk[col] = pd.to_datetime(chunk[col], errors="coerce")
+            else:
+                chunk[col] = chunk[col].astype("string")
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = pq.ParquetWriter(
+                str(self.root / PARQUET_FILE), self._schema, compression="zstd", use_dictionary=True
+            )
+        else:
+            table = table.cast(self._schema, safe=False)
+        self._writer.write_table(table)
+
+    def close(self, rows: int) -> Dict:
+        if self._writer is not None:
+            self._writer.close()
+        return {"format": "parquet", "rows": rows}
+
+
+class MemmapDatasetWriter:
+    """Чанки → по raw-файлу на колонку (читаются через np.memmap).
+
+    Строки кодируются в int-коды со справочником в meta.json, числа после записи ужимаются
+    до минимального подходящего типа (int8…int64, float32, если значения не теряются).
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.columns: Optional[List[Dict]] = None
+        self._categories: Dict[str, Dict[str, int]] = {}
+
+    def _path(self, idx: int) -> Path:
+        return self.root / f"c{idx}.bin"
+
+    def write(self, chunk: pd.DataFrame):
+        if self.columns is None:
+            self.columns = []
+            for idx, col in enumerate(chunk.columns):
+                series = chunk[col]
+                if pd.api.types.is_datetime64_any_dtype(series):
+                    kind = "datetime"
+                elif pd.api.types.is_numeric_dtype(series):
+                    kind = "number"
+                else:
+                    kind = "category"
+                self.columns.append({"name": str(col), "kind": kind, "file": self._path(idx).name})
+        for idx, column in enumerate(self.columns):
+            series = chunk.iloc[:, idx]
+            if column["kind"] == "number":
+                data = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+            elif column["kind"] == "datetime":
+                data = pd.to_datetime(series, errors="coerce").to_numpy(dtype="datetime64[ns]").view("int64")
+            else:
+                data = self._encode(column["name"], series)
+            with open(self.root / column["file"], "ab") as f:
+                f.write(np.ascontiguousarray(data).tobytes())
+
+    def _encode(self, name: str, series: pd.Series) -> np.ndarray:
+        mapping = self._categories.setdefault(name, {})
+        codes, uniques = pd.factorize(series.astype("string"))
+        lookup = np.fromiter((mapping.setdefault(str(u), len(mapping)) for u in uniques), dtype="int32", count=len(uniques))
+        out = np.full(len(codes), -1, dtype="int32")
+        known = codes >= 0
+        out[known] = lookup[codes[known]]
+        return out
+
+    def _downcast(self, column: Dict, rows: int):
+        path = self.root / column["file"]
+        if column["kind"] == "datetime":
+            column["dtype"] = "int64"
+            return
+        source_dtype = "float64" if column["kind"] == "number" else "int32"
+        values = np.fromfile(path, dtype=source_dtype, count=rows)
+        if column["kind"] == "number":
+            finite = values[~np.isnan(values)]
+            if finite.size and np.all(finite == np.round(finite)) and finite.size == values.size:
+                values = pd.to_numeric(pd.Series(values.astype("int64")), downcast="integer").to_numpy()
+            else:
+                values = pd.to_numeric(pd.Series(values), downcast="float").to_numpy()
+        else:
+            values = pd.to_numeric(pd.Series(values), downcast="integer").to_numpy()
+            categories = self._categories.get(column["name"], {})
+            column["categories"] = sorted(categories, key=categories.get)
+        column["dtype"] = values.dtype.str
+        values.tofile(path)
+
+    def close(self, rows: int) -> Dict:
+        for column in self.columns or []:
+            self._downcast(column, rows)
+        return {"format": "memmap", "rows": rows, "columns": self.columns or []}
+
+
+class DatasetWriter:
+    """Пишет датасет в каталог-черновик и публикует его атомарным rename при close()."""
+
+    def __init__(self, target: Path):
+        self.target = target
+        self.tmp = target.with_name(target.name + ".tmp")
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self._backend = ParquetDatasetWriter(self.tmp) if pq is not None else MemmapDatasetWriter(self.tmp)
+
+    def write(self, chunk: pd.DataFrame):
+        self._backend.write(chunk)
+
+    def close(self, rows: int, source: str, truncated: bool = False):
+        meta = self._backend.close(rows)
+        meta.update(source=source, truncated=truncated, created_at=time.time())
+        with open(self.tmp / META_FILE, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        shutil.rmtree(self.target, ignore_errors=True)
+        os.replace(self.tmp, self.target)
+
+    def abort(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def user_dir(user_id: int, root: Path = SALES_DATASETS_DIR) -> Path:
+    return root / str(user_id)
+
+
+def load_meta(path: Path) -> Optional[Dict]:
+    try:
+        with open(path / META_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_datasets(base: Path) -> List[Path]:
+    """Готовые датасеты в каталоге пользователя, свежие первыми."""
+    if not base.exists():
+        return []
+    ready = [p for p in base.iterdir() if p.is_dir() and (p / META_FILE).exists()]
+    return sorted(ready, key=lambda p: (p / META_FILE).stat().st_mtime, reverse=True)
+
+
+def latest_dataset(user_id: int) -> Optional[Path]:
+    datasets = list_datasets(user_dir(user_id))
+    return datasets[0] if datasets else None
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+
+def enforce_quota(base: Path, quota_bytes: Optional[int] = None) -> List[Path]:
+    """Удаляет самые старые датасеты пользователя сверх квоты; последний сохраняется всегда."""
+    quota_bytes = config.SALES_DATASET_QUOTA_MB * 1024 * 1024 if quota_bytes is None else quota_bytes
+    removed = []
+    used = 0
+    # Черновики от воркеров, убитых по таймауту, до close() так и не дошли.
+    stale_before = time.time() - 2 * config.SALES_PARSE_TIMEOUT
+    for draft in base.glob("*.tmp"):
+        if draft.stat().st_mtime < stale_before:
+            shutil.rmtree(draft, ignore_errors=True)
+    for idx, path in enumerate(list_datasets(base)):
+        used += _dir_size(path)
+        if idx > 0 and used > quota_bytes:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+    return removed
+
+
+def iter_dataset(path: Path, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Читает сохранённый датасет чанками без повторного разбора исходного файла."""
+    meta = load_meta(path)
+    if meta is None:
+        return
+    if meta["format"] == "parquet":
+        parquet = pq.ParquetFile(str(path / PARQUET_FILE), memory_map=True)
+        for batch in parquet.iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+        return
+    rows = meta["rows"]
+    if not rows:
+        return
+    arrays = {
+        column["name"]: np.memmap(path / column["file"], dtype=np.dtype(column["dtype"]), mode="r", shape=(rows,))
+        for column in meta["columns"]
+    }
+    for start in range(0, rows, chunk_rows):
+        end = min(start + chunk_rows, rows)
+        data = {}
+        for column in meta["columns"]:
+            values = arrays[column["name"]][start:end]
+            if column["kind"] == "category":
+                data[column["name"]] = pd.Categorical.from_codes(values.astype("int32"), categories=column["categories"])
+            elif column["kind"] == "datetime":
+                data[column["name"]] = np.asarray(values).view("datetime64[ns]")
+            else:
+                data[column["name"]] = np.asarray(values)
+        yield pd.DataFrame(data)
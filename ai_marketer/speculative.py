@@ -0,0 +1,96 @@
+import asyncio
+import contextlib
+import contextvars
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from ai_marketer import config
+from ai_marketer.logging_utils import log_event
+from ai_marketer.tracing import start_trace
+
+
+@dataclass
+class Speculation:
+    user_id: int
+    action: str
+    task: asyncio.Task
+    started_at: float
+
+
+class SpeculativePrefetcher:
+    """Фоновая генерация того, что пользователь, скорее всего, попросит следующим.
+
+    Ограничена дневным бюджетом и числом одновременных запросов. Результат забирается
+    через claim(); невостребованные генерации логируются для учёта расходов.
+    """
+
+    def __init__(self, *, max_concurrency: int, daily_budget: int, ttl: float):
+        self.max_concurrency = max_concurrency
+        self.daily_budget = daily_budget
+        self.ttl = ttl
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._items: Dict[Hashable, Speculation] = {}
+        self._budget_day = date.today()
+        self._spent = 0
+
+    def _take_budget(self) -> bool:
+        today = date.today()
+        if today != self._budget_day:
+            self._budget_day, self._spent = today, 0
+        if self._spent >= self.daily_budget:
+            return False
+        self._spent += 1
+        return True
+
+    def prefetch(self, key: Tuple[int, str, str], generate: Callable[[], Awaitable[Any]]) -> bool:
+        self.expire()
+        if key in self._items or not self._take_budget():
+            return False
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        user_id, action = key[0], key[1]
+        task = asyncio.create_task(self._run(user_id, action, generate), context=contextvars.Context())
+        self._items[key] = Speculation(user_id=user_id, action=action, task=task, started_at=time.monotonic())
+        return True
+
+    async def _run(self, user_id: int, action: str, generate: Callable[[], Awaitable[Any]]):
+        async with self._semaphore:
+            with start_trace(f"speculative.{action}", user_id=user_id):
+                return await generate()
+
+    def claim(self, key: Hashable) -> Optional[asyncio.Task]:
+        item = self._items.pop(key, None)
+        if item is None:
+            return None
+        log_event(item.user_id, f"speculative:{item.action}", "hit", stage="speculative")
+        return item.task
+
+    def discard_user(self, user_id: int):
+        for key in [k for k, item in self._items.items() if item.user_id == user_id]:
+            self._drop(key)
+
+    def expire(self):
+        now = time.monotonic()
+        for key in [k for k, item in self._items.items() if now - item.started_at > self.ttl]:
+            self._drop(key)
+
+    def _drop(self, key: Hashable):
+        item = self._items.pop(key)
+        if not item.task.done():
+            item.task.cancel()
+            log_event(item.user_id, f"speculative:{item.action}", "cancelled", stage="speculative")
+            return
+        result = None
+        with contextlib.suppress(Exception):
+            result = item.task.result()
+        chars = len(result) if isinstance(result, str) else 0
+        log_event(item.user_id, f"speculative:{item.action}", f"unused chars={chars}", stage="speculative")
+
+
+PREFETCHER = SpeculativePrefetcher(
+    max_concurrency=config.SPECULATIVE_MAX_CONCURRENCY,
+    daily_budget=config.SPECULATIVE_DAILY_BUDGET,
+    ttl=config.SPECULATIVE_TTL,
+)
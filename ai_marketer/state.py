@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 
 @dataclass
@@ -9,11 +9,11 @@ class UserState:
     answers: Dict[str, Any] = field(default_factory=dict)
     competitors: List[str] = field(default_factory=list)
     sales_df_summary: Optional[str] = None
-    last_report_text: Optional[str] = None
-    last_report_sections: Dict[str, str] = field(default_factory=dict)
     chat_mode: bool = False
     chat_history: List[Dict[str, str]] = field(default_factory=list)
     pending_payment_service: Optional[str] = None
+    # Номер сценария: растёт при входе в новый сценарий, устаревшие фоновые задачи не трогают state
+    session: int = 0
 
 
 STATE: Dict[int, UserState] = {}
@@ -27,3 +27,14 @@ def get_state(user_id: int) -> UserState:
 
 def reset_state(user_id: int):
     STATE[user_id] = UserState()
+
+
+def new_session(st: UserState):
+    """Пользователь начал новый сценарий: результаты прошлых фоновых задач больше не применяются."""
+    st.session += 1
+
+
+def session_guard(user_id: int, st: UserState) -> Callable[[], bool]:
+    """Проверка для фоновой задачи: пользователь всё ещё в том сценарии, в котором её запустил."""
+    token = st.session
+    return lambda: STATE.get(user_id) is st and st.session == token
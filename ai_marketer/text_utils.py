@@ -0,0 +1,89 @@
+import re
+from typing import List
+
+
+def sanitize(text: str, max_len: int = 3500) -> str:
+    if not text:
+        return ""
+    text = text.replace("\x00", " ").strip()
+    if len(text) > max_len:
+        return text[:max_len] + "…"
+    return text
+
+
+def split_for_telegram(text: str, chunk_size: int = 3500) -> List[str]:
+    cleaned = (text or "").replace("\x00", " ").strip()
+    if not cleaned:
+        return ["(пустой ответ)"]
+    parts: List[str] = []
+    remaining = cleaned
+    while remaining:
+        if len(remaining) <= chunk_size:
+            parts.append(remaining)
+            break
+        split_idx = remaining.rfind("\n", 0, chunk_size)
+        if split_idx == -1 or split_idx < chunk_size * 0.5:
+            split_idx = remaining.rfind(" ", 0, chunk_size)
+        if split_idx == -1 or split_idx < chunk_size * 0.5:
+            split_idx = chunk_size
+        parts.append(remaining[:split_idx].strip())
+        remaining = remaining[split_idx:].lstrip()
+    return [p for p in parts if p]
+
+
+def strip_md_symbols(text: str) -> str:
+    if not text:
+        return ""
+    return re.sub(r"[\*#]+", "", text)
+
+
+def format_gpt_answer_for_telegram(text: str) -> str:
+    """Делает структурированную выдачу для Telegram без Markdown/HTML и символов * или #."""
+    if not text:
+        return ""
+
+    normalized = strip_md_symbols(text.replace("\r\n", "\n").replace("\r", "\n").strip())
+    if not normalized:
+        return ""
+
+    blocks = [b.strip() for b in re.split(r"\n{2,}", normalized) if b.strip()]
+    formatted_blocks: List[str] = []
+
+    for block in blocks:
+        lines = [strip_md_symbols(ln.strip()) for ln in block.split("\n") if ln.strip()]
+        if not lines:
+            continue
+
+        original_header = lines[0]
+        header_line = strip_md_symbols(re.sub(r"^[\-•—\*]+\s*", "", original_header).strip())
+        header_line = strip_md_symbols(re.sub(r"^\d+[)\.\-–]\s*", "", header_line).strip())
+        if not header_line:
+            header_line = strip_md_symbols(original_header.strip())
+
+        inline_body = ""
+        if ":" in header_line:
+            potential_header, potential_body = header_line.split(":", 1)
+            if potential_body.strip():
+                inline_body = strip_md_symbols(potential_body.strip())
+            header_line = strip_md_symbols(potential_header.strip())
+
+        body_candidates = []
+        if inline_body:
+            body_candidates.append(inline_body)
+        body_candidates.extend(lines[1:])
+
+        formatted_body = []
+        for raw_line in body_candidates:
+            clean = strip_md_symbols(re.sub(r"^[\-•—\*]+\s*", "", raw_line).strip())
+            clean = strip_md_symbols(re.sub(r"^\d+[)\.\-–]\s*", "", clean).strip())
+            if clean:
+                formatted_body.append(f"• {clean}")
+
+        header_text = f"🔹 {header_line}" if header_line else ""
+        if formatted_body:
+            formatted_blocks.append(strip_md_symbols(header_text + "\n" + "\n".join(formatted_body)))
+        else:
+            formatted_blocks.append(strip_md_symbols(header_text))
+
+    result = "\n\n".join(formatted_blocks) if formatted_blocks else normalized
+    return strip_md_symbols(result)
@@ -0,0 +1,182 @@
+import contextlib
+import contextvars
+import functools
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from ai_marketer import config
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start_ns: int
+    end_ns: int = 0
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return max(self.end_ns - self.start_ns, 0) / 1e6
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    spans: List[Span] = field(default_factory=list)
+    has_error: bool = False
+
+
+_TRACE: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("ai_marketer_trace", default=None)
+_SPAN: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("ai_marketer_span", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _TRACE.get()
+    return trace.trace_id if trace else None
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """Вложенный спан внутри текущей трассы. Вне трассы ничего не делает."""
+    trace = _TRACE.get()
+    if trace is None:
+        yield None
+        return
+    parent = _SPAN.get()
+    current = Span(
+        trace_id=trace.trace_id,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent else None,
+        name=name,
+        start_ns=time.time_ns(),
+        attrs=attrs,
+    )
+    token = _SPAN.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.error = f"{type(exc).__name__}: {exc}"
+        trace.has_error = True
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _SPAN.reset(token)
+        trace.spans.append(current)
+
+
+@contextlib.contextmanager
+def start_trace(name: str, **attrs: Any) -> Iterator[Optional[Trace]]:
+    """Корневой спан апдейта. Решение об экспорте принимается в конце (tail sampling)."""
+    if config.TRACE_EXPORT == "off" or _TRACE.get() is not None:
+        yield None
+        return
+    trace = Trace(trace_id=uuid.uuid4().hex)
+    token = _TRACE.set(trace)
+    try:
+        with span(name, **attrs) as root:
+            yield trace
+    finally:
+        _TRACE.reset(token)
+        if _should_export(trace, root):
+            _export(trace)
+
+
+def traced(name: str, callback):
+    """Оборачивает PTB-колбэк: одна трасса на апдейт."""
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user = getattr(update, "effective_user", None)
+        attrs = {
+            "update_id": getattr(update, "update_id", None),
+            "user_id": getattr(user, "id", None),
+        }
+        with start_trace(name, **attrs):
+            return await callback(update, context)
+
+    return wrapper
+
+
+def _should_export(trace: Trace, root: Optional[Span]) -> bool:
+    if trace.has_error:
+        return True
+    if root is not None and root.duration_ms >= config.TRACE_SLOW_MS:
+        return True
+    return random.random() < config.TRACE_SAMPLE_RATE
+
+
+def _span_to_json(sp: Span) -> Dict[str, Any]:
+    return {
+        "trace_id": sp.trace_id,
+        "span_id": sp.span_id,
+        "parent_id": sp.parent_id,
+        "name": sp.name,
+        "start_ns": sp.start_ns,
+        "end_ns": sp.end_ns,
+        "duration_ms": round(sp.duration_ms, 3),
+        "attrs": sp.attrs,
+        "error": sp.error,
+    }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _span_to_otlp(sp: Span) -> Dict[str, Any]:
+    record: Dict[str, Any] = {
+        "traceId": sp.trace_id,
+        "spanId": sp.span_id,
+        "name": sp.name,
+        "startTimeUnixNano": str(sp.start_ns),
+        "endTimeUnixNano": str(sp.end_ns),
+        "attributes": [
+            {"key": key, "value": _otlp_value(value)} for key, value in sp.attrs.items() if value is not None
+        ],
+        "status": {"code": 2, "message": sp.error} if sp.error else {"code": 1},
+    }
+    if sp.parent_id:
+        record["parentSpanId"] = sp.parent_id
+    return record
+
+
+def _export(trace: Trace):
+    """Дописывает трассу в файл: JSONL (спан на строку) или OTLP/JSON (трасса на строку)."""
+    try:
+        with open(config.TRACE_FILE, "a", encoding="utf-8") as f:
+            if config.TRACE_EXPORT == "otlp":
+                payload = {
+                    "resourceSpans": [
+                        {
+                            "resource": {
+                                "attributes": [{"key": "service.name", "value": {"stringValue": config.BOT_NAME}}]
+                            },
+                            "scopeSpans": [
+                                {
+                                    "scope": {"name": "ai_marketer"},
+                                    "spans": [_span_to_otlp(sp) for sp in trace.spans],
+                                }
+                            ],
+                        }
+                    ]
+                }
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            else:
+                for sp in trace.spans:
+                    f.write(json.dumps(_span_to_json(sp), ensure_ascii=False, default=str) + "\n")
+    except Exception as exc:  # noqa: BLE001
+        print("TRACING ERROR:", exc)
@@ -0,0 +1,58 @@
+import asyncio
+import sys
+from typing import Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты одного пользователя выполняются строго по очереди, разных — параллельно.
+
+    UserState в state.STATE не защищён от конкурентного доступа, поэтому параллелим
+    только между пользователями. process_update у PTB финальный и берёт слот своего
+    семафора до do_process_update — апдейт, ждущий очереди пользователя, держал бы слот
+    впустую (пара пользователей с долгим разбором файла и серией нажатий забили бы все).
+    Поэтому PTB получает практически безлимитный семафор, а настоящий лимит — свой,
+    и берётся он уже после замка пользователя: слоты занимают только работающие апдейты.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(sys.maxsize)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._pending: Dict[int, int] = {}
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._pending[key] = self._pending.get(key, 0) + 1
+        try:
+            async with lock, self._slots:
+                await coroutine
+        finally:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -2,14 +2,19 @@ import json
 import os
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from ai_marketer import config
+from ai_marketer.cache import TTLCache
+from ai_marketer.tracing import span
 
 DATE_FMT = "%Y-%m-%dT%H:%M:%S"
 USER_DB_PATH = Path(os.getenv("USER_DB_PATH", "data/users.json"))
 
 DEFAULT_USAGE = {"images": 0, "video": 0, "presentations": 0}
+# Кому запись уже обновили (регистрация, username, снятие inactive): меню-кнопки не трогают базу.
+# Значение — username, с которым обновляли; смена username снова идёт в базу.
+_SEEN = TTLCache(ttl=6 * 3600, max_items=50_000)
 
 
 def _load_db() -> Dict[str, Dict]:
@@ -54,16 +59,26 @@ def _sanitize_user_record(record: Dict) -> Dict:
 
 
 def get_user(user_id: int, username: Optional[str] = None) -> Dict:
-    data = _load_db()
-    key = str(user_id)
-    if key not in data:
-        data[key] = _default_user(user_id, username)
-    else:
-        if username:
-            data[key]["username"] = username
-        data[key] = _sanitize_user_record(data[key])
-    _save_db(data)
-    return data[key]
+    with span("get_user", user_id=user_id):
+        data = _load_db()
+        key = str(user_id)
+        if key not in data:
+            data[key] = _default_user(user_id, username)
+        else:
+            if username:
+                data[key]["username"] = username
+            # Написал боту — значит, снова доступен для рассылок
+            data[key].pop("inactive", None)
+            data[key] = _sanitize_user_record(data[key])
+        _save_db(data)
+        _SEEN.set(user_id, username or "")
+        return data[key]
+
+
+def touch_user(user_id: int, username: Optional[str] = None):
+    """Дешёвый get_user для меню: в базу — только при первом обращении за процесс (или после mark_inactive)."""
+    if _SEEN.get(user_id) != (username or ""):
+        get_user(user_id, username)
 
 
 def _tariff_limits(tariff_code: str) -> Dict[str, Optional[int]]:
@@ -80,16 +95,20 @@ def _now() -> datetime:
     return datetime.utcnow()
 
 
-def activate_tariff(user_id: int, tariff_code: str, days: int = 30, username: Optional[str] = None) -> Dict:
-    data = _load_db()
-    key = str(user_id)
-    user = data.get(key, _default_user(user_id, username))
+def _apply_tariff(user: Dict, tariff_code: str, days: int) -> Dict:
     user = _sanitize_user_record(user)
     expires_at = _now() + timedelta(days=days)
     user["tariff"] = tariff_code
     user["subscription_expires_at"] = expires_at.strftime(DATE_FMT)
     user["usage"] = DEFAULT_USAGE.copy()
     user["last_payment_at"] = _now().strftime(DATE_FMT)
+    return user
+
+
+def activate_tariff(user_id: int, tariff_code: str, days: int = 30, username: Optional[str] = None) -> Dict:
+    data = _load_db()
+    key = str(user_id)
+    user = _apply_tariff(data.get(key, _default_user(user_id, username)), tariff_code, days)
     if username:
         user["username"] = username
     data[key] = user
@@ -97,6 +116,41 @@ def activate_tariff(user_id: int, tariff_code: str, days: int = 30, username: Op
     return user
 
 
+def activate_tariffs(items: List[Tuple[int, str]], days: int = 30) -> Dict[int, Dict]:
+    """Активирует тарифы пачкой (user_id, tariff_code) за одно чтение и одну запись базы."""
+    if not items:
+        return {}
+    with span("activate_tariffs", count=len(items)):
+        data = _load_db()
+        result = {}
+        for user_id, tariff_code in items:
+            key = str(user_id)
+            data[key] = _apply_tariff(data.get(key, _default_user(user_id)), tariff_code, days)
+            result[user_id] = data[key]
+        _save_db(data)
+        return result
+
+
+def iter_users(after_id: int = 0) -> Iterator[Dict]:
+    """Пользователи по возрастанию id, начиная после after_id (для рассылок с чекпоинтом)."""
+    data = _load_db()
+    for user_id in sorted(int(key) for key in data if key.lstrip("-").isdigit()):
+        if user_id > after_id:
+            yield _sanitize_user_record(data[str(user_id)])
+
+
+def mark_inactive(user_ids: List[int]):
+    """Помечает пользователей, заблокировавших бота: рассылки их пропускают."""
+    if not user_ids:
+        return
+    data = _load_db()
+    for user_id in user_ids:
+        _SEEN.pop(user_id)
+        if str(user_id) in data:
+            data[str(user_id)]["inactive"] = True
+    _save_db(data)
+
+
 def subscription_days_left(user: Dict) -> int:
     expires_at = user.get("subscription_expires_at")
     if not expires_at:
@@ -154,6 +208,17 @@ def register_usage(user_id: int, category: str, username: Optional[str] = None)
     return user
 
 
+def refund_usage(user_id: int, category: str) -> Dict:
+    """Возвращает списанную единицу лимита (генерация не состоялась)."""
+    data = _load_db()
+    key = str(user_id)
+    user = _sanitize_user_record(data.get(key, _default_user(user_id)))
+    user["usage"][category] = max(user["usage"].get(category, 0) - 1, 0)
+    data[key] = user
+    _save_db(data)
+    return user
+
+
 def add_prompt_history(user_id: int, prompt: str, answer: str, username: Optional[str] = None, max_items: int = 20) -> Dict:
     data = _load_db()
     key = str(user_id)
@@ -2,30 +2,30 @@
 # AI-МАРКЕТОЛОГ 360° — Telegram-бот в одном файле, продакшн-ready
 # Зависимости:
 #   pip install python-telegram-bot==20.8 openai python-dotenv pandas openpyxl reportlab
+#   (кириллица в PDF: шрифт DejaVuSans или PDF_FONT_PATH)
+#   (режим webhook: pip install aiohttp)
 
 import os
-import io
 import re
 import asyncio
+import hashlib
 import json
 import math
 import traceback
 import contextlib
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from typing import Any, Awaitable, Dict, List, Optional
 
-import pandas as pd
-
 from telegram import (
     Update,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     ReplyKeyboardMarkup,
     KeyboardButton,
-    InputFile,
 )
 from telegram.constants import ParseMode
-from telegram.error import NetworkError, RetryAfter, TimedOut
 from telegram.ext import (
     ApplicationBuilder,
     ContextTypes,
@@ -34,9 +34,15 @@ from telegram.ext import (
     CallbackQueryHandler,
     filters,
 )
+from telegram.request import BaseRequest
 
 from ai_marketer import config
-from ai_marketer.gpt_client import ask_gpt_with_typing, chatgpt_answer, client
+from ai_marketer.broadcast import BROADCAST_USAGE, BROADCASTER, BroadcastFilter, BroadcastJob, new_job
+from ai_marketer.cache import TTLCache
+from ai_marketer.file_ids import reply_document_cached
+from ai_marketer.flows import FLOWS, Flow
+from ai_marketer.gpt_client import ask_gpt_with_typing, chatgpt_answer, chatgpt_stream, client
+from ai_marketer.jobs import JOBS
 from ai_marketer.keyboards import (
     AI_MARKETER_MENU,
     CONTENT_MENU,
@@ -55,17 +61,45 @@ from ai_marketer.keyboards import (
     tariff_details_buttons,
 )
 from ai_marketer.logging_utils import log_event
-from ai_marketer.payments import build_service_payment
-from ai_marketer.state import UserState, get_state, reset_state
+from ai_marketer.payment_events import PAYMENT_EVENTS, PaymentOutcome, payment_owner
+from ai_marketer.payments import YOOKASSA, PaymentsError
+from ai_marketer.pdf_report import render_pdf_report, report_key
+from ai_marketer.pending_payments import PENDING_PAYMENTS
+from ai_marketer.profiling import PROFILE_USAGE, PROFILER
+from ai_marketer.prompts import (
+    CHAT_HISTORY_LIMIT,
+    chat_messages,
+    competitor_review_prompt,
+    demo_analysis_prompt,
+    demo_ideas_prompt,
+    final_report_prompt,
+    plan_30d_prompt,
+)
+from ai_marketer.rate_limiter import SendScheduler
+from ai_marketer.report_store import REPORTS
+from ai_marketer.router import TextRequest, TextRouter
+from ai_marketer.sales_parser import analyze_saved_dataset, parse_sales_file
+from ai_marketer.sales_store import latest_dataset
+from ai_marketer.speculative import PREFETCHER
+from ai_marketer.state import UserState, get_state, new_session, reset_state, session_guard
+from ai_marketer.text_utils import (
+    format_gpt_answer_for_telegram,
+    sanitize,
+    split_for_telegram,
+    strip_md_symbols,
+)
+from ai_marketer.tracing import span, traced
+from ai_marketer.update_processor import PerUserUpdateProcessor
 from ai_marketer.user_db import (
-    activate_tariff,
     active_tariff_label,
     add_prompt_history,
     check_access,
     get_user,
     has_active_subscription,
     subscription_days_left,
+    refund_usage,
     register_usage,
+    touch_user,
 )
 
 # ------------------------------
@@ -84,95 +118,13 @@ TARIFFS = config.TARIFFS
 # ------------------------------
 
 
-def sanitize(text: str, max_len: int = 3500) -> str:
-    if not text:
-        return ""
-    text = text.replace("\x00", " ").strip()
-    if len(text) > max_len:
-        return text[:max_len] + "…"
-    return text
-
-
-def split_for_telegram(text: str, chunk_size: int = 3500) -> List[str]:
-    cleaned = (text or "").replace("\x00", " ").strip()
-    if not cleaned:
-        return ["(пустой ответ)"]
-    parts: List[str] = []
-    remaining = cleaned
-    while remaining:
-        if len(remaining) <= chunk_size:
-            parts.append(remaining)
-            break
-        split_idx = remaining.rfind("\n", 0, chunk_size)
-        if split_idx == -1 or split_idx < chunk_size * 0.5:
-            split_idx = remaining.rfind(" ", 0, chunk_size)
-        if split_idx == -1 or split_idx < chunk_size * 0.5:
-            split_idx = chunk_size
-        parts.append(remaining[:split_idx].strip())
-        remaining = remaining[split_idx:].lstrip()
-    return [p for p in parts if p]
-
-
-def strip_md_symbols(text: str) -> str:
-    if not text:
-        return ""
-    return re.sub(r"[\*#]+", "", text)
-
-
-def format_gpt_answer_for_telegram(text: str) -> str:
-    """Делает структурированную выдачу для Telegram без Markdown/HTML и символов * или #."""
-    if not text:
-        return ""
-
-    normalized = strip_md_symbols(text.replace("\r\n", "\n").replace("\r", "\n").strip())
-    if not normalized:
-        return ""
-
-    blocks = [b.strip() for b in re.split(r"\n{2,}", normalized) if b.strip()]
-    formatted_blocks: List[str] = []
-
-    for block in blocks:
-        lines = [strip_md_symbols(ln.strip()) for ln in block.split("\n") if ln.strip()]
-        if not lines:
-            continue
-
-        original_header = lines[0]
-        header_line = strip_md_symbols(re.sub(r"^[\-•—\*]+\s*", "", original_header).strip())
-        header_line = strip_md_symbols(re.sub(r"^\d+[)\.\-–]\s*", "", header_line).strip())
-        if not header_line:
-            header_line = strip_md_symbols(original_header.strip())
-
-        inline_body = ""
-        if ":" in header_line:
-            potential_header, potential_body = header_line.split(":", 1)
-            if potential_body.strip():
-                inline_body = strip_md_symbols(potential_body.strip())
-            header_line = strip_md_symbols(potential_header.strip())
-
-        body_candidates = []
-        if inline_body:
-            body_candidates.append(inline_body)
-        body_candidates.extend(lines[1:])
-
-        formatted_body = []
-        for raw_line in body_candidates:
-            clean = strip_md_symbols(re.sub(r"^[\-•—\*]+\s*", "", raw_line).strip())
-            clean = strip_md_symbols(re.sub(r"^\d+[)\.\-–]\s*", "", clean).strip())
-            if clean:
-                formatted_body.append(f"• {clean}")
-
-        header_text = f"🔹 {header_line}" if header_line else ""
-        if formatted_body:
-            formatted_blocks.append(strip_md_symbols(header_text + "\n" + "\n".join(formatted_body)))
-        else:
-            formatted_blocks.append(strip_md_symbols(header_text))
-
-    result = "\n\n".join(formatted_blocks) if formatted_blocks else normalized
-    return strip_md_symbols(result)
+async def send_split_text(message_obj, text: str, *, parse_mode=None, disable_preview: bool = True, reply_markup=None):
+    await send_chunks(
+        message_obj, split_for_telegram(text), parse_mode=parse_mode, disable_preview=disable_preview, reply_markup=reply_markup
+    )
 
 
-async def send_split_text(message_obj, text: str, *, parse_mode=None, disable_preview: bool = True, reply_markup=None):
-    chunks = split_for_telegram(text)
+async def send_chunks(message_obj, chunks: List[str], *, parse_mode=None, disable_preview: bool = True, reply_markup=None):
     for idx, chunk in enumerate(chunks):
         kwargs = {
             "parse_mode": parse_mode,
@@ -180,36 +132,26 @@ async def send_split_text(message_obj, text: str, *, parse_mode=None, disable_pr
         }
         if idx == len(chunks) - 1 and reply_markup is not None:
             kwargs["reply_markup"] = reply_markup
-        await message_obj.reply_text(chunk, **kwargs)
-        await asyncio.sleep(0.4)
+        # Темп отправки задаёт SendScheduler (лимиты на чат и общий), без фиксированных пауз.
+        with span("send_split_text.chunk", idx=idx, chunks=len(chunks), chars=len(chunk)):
+            await message_obj.reply_text(chunk, **kwargs)
 
 
 async def safe_reply_text(
     message_obj,
     text: str,
     *,
-    retries: int = 2,
-    retry_delay: float = 1.0,
     reply_markup=None,
     parse_mode=None,
     disable_web_page_preview: bool | None = None,
 ):
-    """Send a message with retries on transient Telegram network errors."""
-
-    for attempt in range(retries):
-        try:
-            return await message_obj.reply_text(
-                text,
-                reply_markup=reply_markup,
-                parse_mode=parse_mode,
-                disable_web_page_preview=disable_web_page_preview,
-            )
-        except RetryAfter as exc:
-            await asyncio.sleep(exc.retry_after + 0.1)
-        except (TimedOut, NetworkError):
-            if attempt == retries - 1:
-                raise
-            await asyncio.sleep(retry_delay)
+    """Отправляет сообщение; повторы при RetryAfter/TimedOut/NetworkError делает SendScheduler."""
+    return await message_obj.reply_text(
+        text,
+        reply_markup=reply_markup,
+        parse_mode=parse_mode,
+        disable_web_page_preview=disable_web_page_preview,
+    )
 
 
 def tariff_text_intro() -> str:
@@ -301,9 +243,10 @@ def format_success_payment(code: str, user_data: Optional[Dict] = None) -> str:
 
 
 async def ensure_paid_access(message_obj, user_profile: Dict, category: str):
-    allowed, reason, updated_profile = check_access(
-        user_profile.get("id", 0), category, user_profile.get("username")
-    )
+    with span("ensure_paid_access", category=category):
+        allowed, reason, updated_profile = check_access(
+            user_profile.get("id", 0), category, user_profile.get("username")
+        )
     if not allowed:
         await message_obj.reply_text(
             f"{reason}\n\nТекущий статус: {active_tariff_label(updated_profile)}",
@@ -337,8 +280,9 @@ async def send_boltalka_hint(message_obj):
 
 async def send_gpt_reply(message_obj, st: UserState, answer: str, *, last_user_text: Optional[str] = None, parse_mode=None):
     formatted_answer = format_gpt_answer_for_telegram(answer)
-    await send_split_text(message_obj, formatted_answer, parse_mode=parse_mode)
+    # State меняем до первого await: из фоновой задачи это происходит сразу после проверки сессии.
     reset_boltalka_context(st, last_user_text, answer)
+    await send_split_text(message_obj, formatted_answer, parse_mode=parse_mode)
     try:
         user = getattr(message_obj, "from_user", None)
         if user:
@@ -363,12 +307,11 @@ DIAG_QUESTIONS = [
 # ------------------------------
 async def start_diagnostic_session(message_obj, st: UserState):
     """Запускает диагностику без дополнительных подтверждений."""
+    new_session(st)
     st.stage = "diag_running"
     st.diagnostic_step = 1
     st.answers = {}
     st.competitors = []
-    st.last_report_text = None
-    st.last_report_sections = {}
     st.chat_mode = False
 
 
@@ -378,80 +321,13 @@ async def start_diagnostic_session(message_obj, st: UserState):
         reply_markup=back_main_buttons()
     )
 
-# ------------------------------
-# 🖨️ PDF-ОТЧЁТ (ReportLab)
-# ------------------------------
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
-
-def make_pdf_report(username: str, summary_text: str, sections: Dict[str, str]) -> bytes:
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    width, height = A4
-    left = 18 * mm
-    top = height - 20 * mm
-
-    def write_wrapped(text: str, x: float, y: float, max_width: float, leading=14):
-        from reportlab.pdfbase.pdfmetrics import stringWidth
-        lines = []
-        for paragraph in text.split("\n"):
-            words = paragraph.split(" ")
-            line = ""
-            for w in words:
-                test = (line + " " + w).strip()
-                if stringWidth(test, "Helvetica", 11) <= max_width:
-                    line = test
-                else:
-                    lines.append(line)
-                    line = w
-            lines.append(line)
-            lines.append("")  # blank between paragraphs
-        cur_y = y
-        for ln in lines:
-            if cur_y < 20 * mm:
-                c.showPage()
-                cur_y = height - 20 * mm
-                c.setFont("Helvetica", 11)
-            c.drawString(x, cur_y, ln)
-            cur_y -= leading
-        return cur_y
-
-    c.setTitle(f"Отчёт {BOT_NAME}")
-    c.setAuthor(BOT_NAME)
-
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(left, top, f"Итоговый отчёт — {BOT_NAME}")
-    c.setFont("Helvetica", 11)
-    c.drawString(left, top - 14, f"Пользователь: {username}")
-
-    y = top - 30
-    c.setFont("Helvetica-Bold", 13)
-    c.drawString(left, y, "Краткое резюме")
-    y -= 18
-    c.setFont("Helvetica", 11)
-    y = write_wrapped(sanitize(summary_text, 8000), left, y, width - 2*left)
-
-    for title, body in sections.items():
-        if y < 40 * mm:
-            c.showPage()
-            y = height - 20 * mm
-        c.setFont("Helvetica-Bold", 13)
-        c.drawString(left, y, title)
-        y -= 18
-        c.setFont("Helvetica", 11)
-        y = write_wrapped(sanitize(body, 8000), left, y, width - 2*left)
-
-    c.showPage()
-    c.save()
-    buf.seek(0)
-    return buf.read()
-
 # ------------------------------
 # 🏁 СТАРТ / HELP / CANCEL
 # ------------------------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    JOBS.cancel_user(user.id)
+    PREFETCHER.discard_user(user.id)
     reset_state(user.id)
     text = (
         f"👋 Привет! Я — {BOT_NAME}\n"
@@ -487,9 +363,80 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    JOBS.cancel_user(user.id)
+    PREFETCHER.discard_user(user.id)
     reset_state(user.id)
     await update.message.reply_text("Окей, всё сбросил. Что дальше?", reply_markup=MAIN_MENU)
 
+# ------------------------------
+# 📣 РАССЫЛКИ (ADMIN_IDS)
+# ------------------------------
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    if update.effective_user.id not in config.ADMIN_IDS:
+        return
+    first_line, _, body = message.text.partition("\n")
+    try:
+        audience = BroadcastFilter.parse(first_line.split()[1:])
+    except ValueError as exc:
+        await message.reply_text(f"{exc}\n\n{BROADCAST_USAGE}")
+        return
+    if message.reply_to_message:
+        payload = {"from_chat_id": message.chat_id, "message_id": message.reply_to_message.message_id}
+    elif body.strip():
+        payload = {"text": body.strip()}
+    else:
+        await message.reply_text(BROADCAST_USAGE)
+        return
+    if BROADCASTER.running:
+        await message.reply_text("Уже идёт другая рассылка. Останови её: /broadcast_stop")
+        return
+    job = new_job(message.chat_id, audience, **payload)
+    BROADCASTER.start(context.bot, job)
+    log_event(update.effective_user.id, message.text, f"broadcast {job.job_id} total={job.total}", stage="broadcast")
+
+
+async def broadcast_stop_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in config.ADMIN_IDS:
+        return
+    job = await BROADCASTER.stop()
+    if job is None:
+        await update.message.reply_text("Сейчас рассылок нет.")
+        return
+    await update.message.reply_text(f"Остановил. Продолжить: /broadcast_resume {job.job_id}")
+
+
+async def broadcast_resume_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in config.ADMIN_IDS:
+        return
+    job = BroadcastJob.load(context.args[0]) if context.args else BroadcastJob.latest_unfinished()
+    if job is None or job.status == "done":
+        await update.message.reply_text("Незавершённых рассылок не нашёл.")
+        return
+    if not BROADCASTER.start(context.bot, job):
+        await update.message.reply_text("Уже идёт другая рассылка. Останови её: /broadcast_stop")
+
+# ------------------------------
+# ⏱ ПРОФИЛИРОВАНИЕ (ADMIN_IDS)
+# ------------------------------
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in config.ADMIN_IDS:
+        return
+    args = context.args or []
+    if args and args[0] == "on":
+        if len(args) > 1:
+            if not args[1].isdigit():
+                await update.message.reply_text(PROFILE_USAGE)
+                return
+            PROFILER.slow_ms = float(args[1])
+        PROFILER.enabled = True
+    elif args and args[0] == "off":
+        PROFILER.enabled = False
+    elif args:
+        await update.message.reply_text(PROFILE_USAGE)
+        return
+    await update.message.reply_text(PROFILER.status_text())
+
 # ------------------------------
 # 💳 ОПЛАТА И ТАРИФЫ
 # ------------------------------
@@ -499,9 +446,41 @@ async def show_tariffs(message_obj):
     await message_obj.reply_text(tariff_text_intro(), reply_markup=tariff_buttons())
 
 
+PAYMENT_PENDING_TEXT = (
+    "Оплата пока не подтверждена ЮKassa. Как только подтверждение придёт, тариф включится "
+    "автоматически и я напишу. Если прошло больше 10 минут — напиши менеджеру."
+)
+# Чужой или несуществующий платёж: одинаковый ответ, чтобы по id нельзя было узнать чужой тариф
+PAYMENT_NOT_FOUND_TEXT = "Платёж не найден. Если ты оплачивал(а) — напиши менеджеру, разберёмся."
+PAYMENT_SUCCESS_KEYBOARD = ReplyKeyboardMarkup(
+    [
+        ["🧬AI-Маркетолог", "☄️Генерация контента"],
+        ["⬅️ В главное меню"],
+    ],
+    resize_keyboard=True,
+)
+
+
+def payment_buttons(payment_url: str, payment_payload: Dict) -> InlineKeyboardMarkup:
+    rows = [[InlineKeyboardButton("Оплатить через ЮKassa", url=payment_url)]]
+    if payment_payload.get("id"):
+        # Кнопка не активирует тариф сама — только перепроверяет платёж в ЮKassa.
+        rows.append([InlineKeyboardButton("✅ Я оплатил", callback_data=f"pay_check_{payment_payload['id']}")])
+    rows.append([InlineKeyboardButton("Написать менеджеру", url="https://t.me/maglena_a")])
+    return InlineKeyboardMarkup(rows)
+
+
+async def notify_payment_success(bot, outcome: PaymentOutcome):
+    """Сообщение об активации тарифа по уведомлению ЮKassa (пользователь может быть не в чате с ботом)."""
+    chunks = split_for_telegram(format_success_payment(outcome.service_code, outcome.profile))
+    for idx, chunk in enumerate(chunks):
+        reply_markup = PAYMENT_SUCCESS_KEYBOARD if idx == len(chunks) - 1 else None
+        await bot.send_message(outcome.user_id, chunk, reply_markup=reply_markup, disable_web_page_preview=True)
+
+
 async def send_payment_link(message_obj, user, service_code: str, st: UserState, promo_code: Optional[str] = None):
     try:
-        payment_result = build_service_payment(service_code, promo_code=promo_code)
+        payment_result = await PENDING_PAYMENTS.get_or_create(user.id, service_code, promo_code)
     except Exception as exc:  # noqa: BLE001
         await message_obj.reply_text(
             "Не получилось создать счёт в ЮKassa. Напиши менеджеру, мы поможем оформить оплату.",
@@ -522,20 +501,14 @@ async def send_payment_link(message_obj, user, service_code: str, st: UserState,
     if promo_code:
         payment_text = "Промокод принят ✅\n" + payment_text
 
-    payment_keyboard = InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("Оплатить через ЮKassa", url=payment_url)],
-            [InlineKeyboardButton("✅ Я оплатил", callback_data=f"tariff_success_{service_code}")],
-            [InlineKeyboardButton("Написать менеджеру", url="https://t.me/maglena_a")],
-        ]
-    )
-    await message_obj.reply_text(payment_text, reply_markup=payment_keyboard)
+    await message_obj.reply_text(payment_text, reply_markup=payment_buttons(payment_url, payment_payload))
     log_event(user.id, f"buy:{service_code}", json.dumps(payment_payload, ensure_ascii=False), stage="payment")
     st.stage = "idle"
     st.pending_payment_service = None
 
 
 async def prompt_promocode(message_obj, service_code: str, st: UserState):
+    new_session(st)
     st.stage = "await_promo"
     st.pending_payment_service = service_code
     keyboard = InlineKeyboardMarkup(
@@ -554,502 +527,411 @@ async def prompt_promocode(message_obj, service_code: str, st: UserState):
 # ------------------------------
 # 🧭 ОБРАБОТКА ГЛАВНОГО МЕНЮ (ТЕКСТ)
 # ------------------------------
+ROUTER = TextRouter()
+
+
 async def text_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     st = get_state(user.id)
     txt = (update.message.text or "").strip()
-    chat_id = update.effective_chat.id if update.effective_chat else None
-    user_profile = get_user(user.id, user.username)
-
-    user_id = user.id
-    log_event(
-        user_id=user_id,
-        user_message=txt,
-        bot_answer="", 
-        stage=st.stage
+    req = TextRequest(
+        update=update,
+        context=context,
+        user=user,
+        st=st,
+        txt=txt,
+        chat_id=update.effective_chat.id if update.effective_chat else None,
     )
 
-
-    if txt in ("⬅️ В главное меню", "В главное меню", "/menu"):
-        reset_state(user.id)
-        await update.message.reply_text("Главное меню:", reply_markup=MAIN_MENU)
-        st.chat_mode = False
-        st.chat_history = []
+    route = ROUTER.resolve(txt, st.stage)
+    PROFILER.tag(route=route.name if route else "route_fallback")
+    # Меню-кнопкам профиль и лог не нужны; свободный ввод и stage-ветки логируем как раньше.
+    if route is None or route.log:
+        log_event(user_id=user.id, user_message=txt, bot_answer="", stage=st.stage)
+    if route is not None and route.needs_profile:
+        req.profile = get_user(user.id, user.username)
+    else:
+        # Профиль не нужен, но пользователь должен попасть в базу и выйти из inactive.
+        touch_user(user.id, user.username)
+    if route is None:
+        await route_fallback(req)
         return
+    with span("route", handler=route.name, stage=st.stage):
+        await route.handler(req)
 
-    if st.stage == "await_promo" and st.pending_payment_service:
-        normalized = txt.strip().lower()
-        if normalized in ("нет", "без промокода", "пропустить"):
-            await send_payment_link(update.message, user, st.pending_payment_service, st)
-            return
 
-        if normalized in config.PROMOCODES:
-            await send_payment_link(update.message, user, st.pending_payment_service, st, promo_code=txt.strip())
-            return
+async def route_fallback(req: TextRequest):
+    # === Болталка после диагностики ===
+    if req.st.chat_mode:
+        return await handle_chat_mode(req.update, req.context)
 
-        keyboard = InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        "Оплатить без промокода",
-                        callback_data=f"tariff_pay_direct_{st.pending_payment_service}",
-                    )
-                ]
-            ]
-        )
-        await update.message.reply_text(
-            "Не получилось активировать промокод. Проверь написание и попробуй снова или нажми «Оплатить без промокода».",
-            reply_markup=keyboard,
-        )
-        return
+    # Приклеиваем «умный ответ» если ничего не подошло
+    await req.message.reply_text(
+            "Я тебя услышал. Чтобы получить максимальную пользу — выбери действие в меню ниже:",
+            reply_markup=MAIN_MENU
+    )
 
-    if txt in ("🛠 Услуги", "Услуги"):
-        await update.message.reply_text(SERVICES_TEXT, reply_markup=SERVICES_MENU)
-        return
 
-    if txt in ("Оплата", "Оплата и тарифы", "💳 Оплата и тарифы"):
-        await show_tariffs(update.message)
-        return
+@ROUTER.exact("⬅️ В главное меню", "В главное меню", "/menu")
+async def route_main_menu(req: TextRequest):
+    # Уход в меню отменяет незаконченные генерации: не платим за ответ, который никто не ждёт.
+    JOBS.cancel_user(req.user.id)
+    PREFETCHER.discard_user(req.user.id)
+    reset_state(req.user.id)
+    await req.message.reply_text("Главное меню:", reply_markup=MAIN_MENU)
 
-    # 1️⃣ Протестировать AI-маркетолога
-    if "Протестировать AI-маркетолога" in txt:
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        msg = (
-            "Демо-режим 🧠\n"
-            "Покажу, как нахожу точки роста и формирую гипотезы.\n\n"
-            "Готов пройти мини-тест (3 вопроса) и получить идеи?"
-            " Напиши «да», когда будешь готов или скажи «позже»."
-        )
-        st.stage = "demo"
-        await update.message.reply_text(msg, reply_markup=back_main_buttons())
-        return
 
-    # 2️⃣ Диагностика бизнеса
-    if "Диагностика бизнеса" in txt or txt == "Пройти диагностику 🚀" or txt == "Начать диагностику 🚀" or txt == "🚀 НАЧАТЬ ДИАГНОСТИКУ":
-        await start_diagnostic_session(update.message, st)
+@ROUTER.stage("await_promo")
+async def route_await_promo(req: TextRequest):
+    st = req.st
+    if not st.pending_payment_service:
+        st.stage = "idle"
+        await route_fallback(req)
         return
 
-    # 3️⃣ Что я умею
-    if "Что я умею" in txt:
-        msg = (
-            "Я — не просто бот. Я маркетолог, который видит бизнес на 360°:\n\n"
-            "📊 Анализ бизнеса\n🎯 Стратегия продвижения\n📣 Контент\n🚀 Трафик и воронки\n🤖 Внедрение AI\n📈 Прогноз роста\n\n"
-            "Выбери, что показать:"
-        )
-        await update.message.reply_text(msg, reply_markup=aux_menu())
+    normalized = req.txt.lower()
+    if normalized in ("нет", "без промокода", "пропустить"):
+        await send_payment_link(req.message, req.user, st.pending_payment_service, st)
         return
 
-    # 4️⃣ Примеры и кейсы
-    if "Примеры и кейсы" in txt:
-        msg = (
-            "Реальные результаты:\n\n"
-            "👕 Бренд одежды — +220% за 3 месяца\n"
-            "💪 Спорпит — рост на 180%\n"
-            "🎓 Онлайн-курс — −40% CPL\n\n"
-            "Хочешь так же? Пройди диагностику."
-        )
-        await update.message.reply_text(msg, reply_markup=ReplyKeyboardMarkup([["Пройти диагностику 🚀"], ["⬅️ В главное меню"]], resize_keyboard=True))
+    if normalized in config.PROMOCODES:
+        await send_payment_link(req.message, req.user, st.pending_payment_service, st, promo_code=req.txt)
         return
 
-    # 5️⃣ Связаться с командой
-    if "Связаться с командой" in txt or "Связаться с командой 360°" in txt:
-        msg = (
-            "Хочешь индивидуальную стратегию или AI-внедрение под ключ?\n"
-            "Выбери действие:"
-        )
-        await update.message.reply_text(msg, reply_markup=back_main_buttons())
-        await update.message.reply_text("Контакты:", reply_markup=back_main_buttons())
-        await update.message.reply_text("Нажми кнопку ниже, чтобы написать менеджеру:", reply_markup=INLINE_CONTACT)
-        return
+    keyboard = InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    "Оплатить без промокода",
+                    callback_data=f"tariff_pay_direct_{st.pending_payment_service}",
+                )
+            ]
+        ]
+    )
+    await req.message.reply_text(
+        "Не получилось активировать промокод. Проверь написание и попробуй снова или нажми «Оплатить без промокода».",
+        reply_markup=keyboard,
+    )
 
-    # Подменю: AI-Маркетолог
-    if txt == "AI-Маркетолог" or txt == "🧬AI-Маркетолог":
-        await update.message.reply_text("Выбери действие:", reply_markup=AI_MARKETER_MENU)
-        return
 
-    if txt == "📊 Провести анализ компании":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        st.stage = "quick_analyze"
-        await update.message.reply_text("Напиши в одной фразе: что продаёте, кому и через какие каналы сейчас?", reply_markup=back_main_buttons())
-        return
+@ROUTER.exact("🛠 Услуги", "Услуги")
+async def route_services(req: TextRequest):
+    await req.message.reply_text(SERVICES_TEXT, reply_markup=SERVICES_MENU)
 
-    if st.stage == "quick_analyze" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        prompt = (
-            "Сделай экспресс-анализ компании и 5 точек роста."
-            " Формат: 1) Краткое резюме 2) Точки роста 3) Быстрые действия на 7 дней 4) Метрики.\n"
-            f"Ввод: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        st.stage = "idle"
-        return
 
-    if txt == "💡 Составить стратегию":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        st.stage = "quick_strategy"
-        await update.message.reply_text("Опиши цель на 30–90 дней и бюджет (диапазон).", reply_markup=back_main_buttons())
-        return
+@ROUTER.exact("Оплата", "Оплата и тарифы", "💳 Оплата и тарифы")
+async def route_tariffs(req: TextRequest):
+    await show_tariffs(req.message)
 
-    if st.stage == "quick_strategy" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        prompt = (
-            "Составь конспект стратегии на 90 дней: цели, каналы, гипотезы, вехи по неделям, риски, метрики."
-            f" Дано: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        st.stage = "idle"
-        return
 
-    if txt == "🧩 Создать контент-план":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        st.stage = "quick_cplan"
-        await update.message.reply_text("Ниша и ключевой продукт? Укажи площадку (TG/IG/ВК/YouTube).", reply_markup=back_main_buttons())
+# 1️⃣ Протестировать AI-маркетолога
+@ROUTER.contains("Протестировать AI-маркетолога", needs_profile=True)
+async def route_demo_start(req: TextRequest):
+    allowed, req.profile = await ensure_paid_access(req.message, req.profile, "text")
+    if not allowed:
         return
+    msg = (
+        "Демо-режим 🧠\n"
+        "Покажу, как нахожу точки роста и формирую гипотезы.\n\n"
+        "Готов пройти мини-тест (3 вопроса) и получить идеи?"
+        " Напиши «да», когда будешь готов или скажи «позже»."
+    )
+    new_session(req.st)
+    req.st.stage = "demo"
+    await req.message.reply_text(msg, reply_markup=back_main_buttons())
 
-    if st.stage == "quick_cplan" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        prompt = (
-            "Составь контент-план на 2 недели: 14 постов/роликов с идеей, тезисами, CTA и метрикой."
-            f" Дано: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        st.stage = "idle"
-        return
 
-    if txt == "📈 Подобрать каналы трафика":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        st.stage = "quick_channels"
-        await update.message.reply_text("Кто ЦА и какой средний чек?", reply_markup=back_main_buttons())
-        return
+# 2️⃣ Диагностика бизнеса
+@ROUTER.exact("🧭 Диагностика бизнеса", "Пройти диагностику 🚀", "Начать диагностику 🚀", "🚀 НАЧАТЬ ДИАГНОСТИКУ")
+@ROUTER.contains("Диагностика бизнеса")
+async def route_start_diagnostic(req: TextRequest):
+    await start_diagnostic_session(req.message, req.st)
 
-    if st.stage == "quick_channels" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        prompt = (
-            "Подбери 5 каналов трафика с обоснованием, старт-бюджетом, первыми шагами и основными рисками."
-            f" Дано: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        st.stage = "idle"
-        return
 
-    if txt == "⚙️ Внедрить AI для автоматизации":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        prompt = (
-            "Дай дорожную карту внедрения AI в SMB: контент, продажи, поддержка, аналитика, алерты, интеграции."
-            " Формат: этапы (2 недели, 30 дней, 60 дней), инструменты, метрики, риски."
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        return
+# 3️⃣ Что я умею
+@ROUTER.contains("Что я умею")
+async def route_capabilities(req: TextRequest):
+    msg = (
+        "Я — не просто бот. Я маркетолог, который видит бизнес на 360°:\n\n"
+        "📊 Анализ бизнеса\n🎯 Стратегия продвижения\n📣 Контент\n🚀 Трафик и воронки\n🤖 Внедрение AI\n📈 Прогноз роста\n\n"
+        "Выбери, что показать:"
+    )
+    await req.message.reply_text(msg, reply_markup=aux_menu())
+
+
+# 4️⃣ Примеры и кейсы
+@ROUTER.contains("Примеры и кейсы")
+async def route_cases(req: TextRequest):
+    msg = (
+        "Реальные результаты:\n\n"
+        "👕 Бренд одежды — +220% за 3 месяца\n"
+        "💪 Спорпит — рост на 180%\n"
+        "🎓 Онлайн-курс — −40% CPL\n\n"
+        "Хочешь так же? Пройди диагностику."
+    )
+    await req.message.reply_text(msg, reply_markup=ReplyKeyboardMarkup([["Пройти диагностику 🚀"], ["⬅️ В главное меню"]], resize_keyboard=True))
 
-    # Подменю: Генерация контента
-    if txt == "Генерация контента" or txt == "☄️Генерация контента":
-        await update.message.reply_text("Что сгенерировать?", reply_markup=CONTENT_MENU)
-        return
 
-    if txt == "Создать изображение 🖼️":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "images")
-        if not allowed:
-            return
-        st.stage = "gen_image"
-        await update.message.reply_text(
-            "Опиши задачу: продукт/услуга, ЦА, эмоция и стиль. Сгенерирую готовые описания для нейросетей изображений и подписи.",
-            reply_markup=back_main_buttons(),
-        )
-        return
-    if st.stage == "gen_image" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "images")
-        if not allowed:
-            return
-        prompt = (
-            "Сгенерируй 4 подробных описания для генерации изображений (Midjourney/DALL·E):"
-            " каждая сцена должна включать ключевые объекты, настроение и композицию, а также подпись с CTA."
-            f" Ввод: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        register_usage(user.id, "images", username=user.username)
-        st.stage = "idle"
-        return
+# 5️⃣ Связаться с командой
+@ROUTER.exact("📞 Связаться с командой")
+@ROUTER.contains("Связаться с командой")
+async def route_contact_team(req: TextRequest):
+    msg = (
+        "Хочешь индивидуальную стратегию или AI-внедрение под ключ?\n"
+        "Выбери действие:"
+    )
+    await req.message.reply_text(msg, reply_markup=back_main_buttons())
+    await req.message.reply_text("Контакты:", reply_markup=back_main_buttons())
+    await req.message.reply_text("Нажми кнопку ниже, чтобы написать менеджеру:", reply_markup=INLINE_CONTACT)
 
-    if txt == "Создать Reels/Shorts 🎬":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "video")
-        if not allowed:
-            return
-        st.stage = "gen_reels"
-        await update.message.reply_text(
-            "Укажи нишу/продукт и площадку. Дам 5 сценариев Reels/Shorts с хук-строкой и раскадровкой.",
-            reply_markup=back_main_buttons(),
-        )
-        return
-    if st.stage == "gen_reels" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "video")
-        if not allowed:
-            return
-        prompt = (
-            "Сгенерируй 5 сценариев Reels/Shorts: хук, 3-4 шага сюжета, финальный CTA, длительность до 35 сек."
-            f" Дано: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt, model_type="video")
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        register_usage(user.id, "video", username=user.username)
-        st.stage = "idle"
-        return
 
-    if txt == "Создать видео до 3 минут 🎥":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "video")
-        if not allowed:
-            return
-        st.stage = "gen_video"
-        await update.message.reply_text(
-            "Что за продукт и цель ролика? Сценарий будет до 3 минут с репликами и планом съёмок.",
-            reply_markup=back_main_buttons(),
-        )
-        return
-    if st.stage == "gen_video" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "video")
-        if not allowed:
-            return
-        prompt = (
-            "Напиши сценарий видео до 3 минут: интро, основной блок в 4-5 сценах, финальный оффер."
-            " Добавь таймкоды, визуальные подсказки и текст ведущего."
-            f" Дано: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt, model_type="video")
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        register_usage(user.id, "video", username=user.username)
-        st.stage = "idle"
-        return
+# Подменю: AI-Маркетолог
+@ROUTER.exact("AI-Маркетолог", "🧬AI-Маркетолог")
+async def route_ai_marketer_menu(req: TextRequest):
+    await req.message.reply_text("Выбери действие:", reply_markup=AI_MARKETER_MENU)
 
-    if txt == "Создать презентацию 📑":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "presentations")
-        if not allowed:
-            return
-        st.stage = "gen_presentation"
-        await update.message.reply_text(
-            "Про что презентация и кто аудитория? Дам структуру до 20 слайдов с тезисами.",
-            reply_markup=back_main_buttons(),
-        )
-        return
-    if st.stage == "gen_presentation" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "presentations")
-        if not allowed:
-            return
-        prompt = (
-            "Сделай план презентации до 20 слайдов: заголовок, цель, тезисы, CTA."
-            " Укажи ключевые цифры/офер, предложи визуальные подсказки и спикер-ноты."
-            f" Ввод: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt, model_type="presentations")
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        register_usage(user.id, "presentations", username=user.username)
-        st.stage = "idle"
-        return
 
-    if txt == "Идеи Reels 🎬":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "video")
-        if not allowed:
-            return
-        st.stage = "reels"
-        await update.message.reply_text("Опиши продукт/услугу и площадку. Дам 10 идей с хук-строками.", reply_markup=back_main_buttons())
-        return
-    if st.stage == "reels" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "video")
-        if not allowed:
-            return
-        prompt = (
-            "Сгенерируй 10 идей Reels/Shorts: хук, сюжет в 3 шага, финальный CTA, хронометраж до 30 сек."
-            f" Ввод: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt, model_type="video")
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        register_usage(user.id, "video", username=user.username)
-        st.stage = "idle"
-        return
+# ------------------------------
+# ⚙️ ДВИЖОК ГЕНЕРАЦИЙ (FLOWS)
+# ------------------------------
+FLOW_CACHE = TTLCache(ttl=600, max_items=256)
+STREAM_EDIT_INTERVAL = 1.5
 
-    if txt == "Заголовки 🔥":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        st.stage = "titles"
-        await update.message.reply_text("Какая тема? Дам 20 заголовков в 4 стилях.", reply_markup=back_main_buttons())
-        return
-    if st.stage == "titles" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        prompt = (
-            "Сгенерируй 20 заголовков: 5 инфо, 5 выгода, 5 триггер, 5 проблематика."
-            f" Тема: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        st.stage = "idle"
-        return
 
-    if txt == "Посты/описания ✍️":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        st.stage = "posts"
-        await update.message.reply_text("Тема/оффер и площадка (TG/IG/ВК/маркетплейс)?", reply_markup=back_main_buttons())
+async def stream_gpt_answer(message_obj, flow: Flow, prompt: str) -> str:
+    """Показывает ответ по мере генерации в сообщении-черновике и возвращает полный текст."""
+    loop = asyncio.get_running_loop()
+    draft = await message_obj.reply_text("⏳ Генерирую…")
+    parts: List[str] = []
+    shown = ""
+    last_edit = loop.time()
+    try:
+        async for delta in chatgpt_stream(prompt, model_type=flow.model_type, max_tokens=flow.max_tokens):
+            parts.append(delta)
+            if loop.time() - last_edit < STREAM_EDIT_INTERVAL:
+                continue
+            preview = sanitize(strip_md_symbols("".join(parts)))
+            if preview and preview != shown:
+                with contextlib.suppress(Exception):
+                    await draft.edit_text(preview + " ▌")
+                shown = preview
+            last_edit = loop.time()
+    finally:
+        with contextlib.suppress(Exception):
+            await draft.delete()
+    return "".join(parts).strip()
+
+
+async def generate_flow_answer(req: TextRequest, flow: Flow, prompt: str, *, typing: bool = True) -> str:
+    cache_key = (flow.key, hashlib.sha1(prompt.encode("utf-8")).hexdigest())
+    answer = FLOW_CACHE.get(cache_key) if flow.cache_ttl else None
+    if answer is not None:
+        return answer
+    with span("flow.generate", flow=flow.key, stream=flow.stream):
+        if flow.stream:
+            answer = await stream_gpt_answer(req.message, flow, prompt)
+        else:
+            answer = await ask_gpt_with_typing(
+                req.context.bot if typing else None,
+                req.chat_id,
+                prompt,
+                model_type=flow.model_type,
+                max_tokens=flow.max_tokens,
+            )
+    if flow.cache_ttl and answer:
+        FLOW_CACHE.set(cache_key, answer, ttl=flow.cache_ttl)
+    return answer
+
+
+async def run_flow(req: TextRequest, flow: Flow, user_input: str):
+    """Общий конвейер генерации: доступ → резерв лимита → кеш/GPT → ответ."""
+    allowed, req.profile = await ensure_paid_access(req.message, req.profile, flow.category)
+    if not allowed:
         return
-    if st.stage == "posts" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        prompt = (
-            "Напиши 3 варианта поста/описания: краткий, подробный, продающий. Добавь CTA и эмодзи."
-            f" Тема: {txt}"
+    prompt = flow.render(user_input)
+    last_user_text = req.txt
+    if flow.input_truncated(user_input):
+        await req.message.reply_text(
+            f"✂️ Текст длинный — в работу пошли первые {flow.max_input_chars} символов. "
+            "Если важное осталось в конце, пришли его короче отдельным сообщением."
         )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        st.stage = "idle"
-        return
 
-    if txt == "Контент-план на 14 дней 🗓️":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        st.stage = "cplan14"
-        await update.message.reply_text("Ниша, задача (продажи/охваты/экспертность) и платформа?", reply_markup=back_main_buttons())
-        return
-    if st.stage == "cplan14" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
-            return
-        prompt = (
-            "Сформируй таблицей план на 14 дней: формат, идея, тезисы, CTA, цель метрики."
-            f" Ввод: {txt}"
+    # Лимит резервируем до запроса и возвращаем, если генерация не состоялась.
+    if flow.metered:
+        register_usage(req.user.id, flow.category, username=req.user.username)
+
+    def refund():
+        if flow.metered:
+            refund_usage(req.user.id, flow.category)
+
+    async def deliver(answer: str):
+        await send_gpt_reply(req.message, req.st, answer, last_user_text=last_user_text)
+
+    if flow.background:
+        if not flow.one_shot:
+            req.st.stage = "idle"
+        job = JOBS.start(
+            req.user.id,
+            flow.key,
+            lambda: generate_flow_answer(req, flow, prompt, typing=False),
+            on_result=deliver,
+            bot=req.context.bot,
+            chat_id=req.chat_id,
+            on_cancel=refund,
+            is_current=session_guard(req.user.id, req.st),
         )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        st.stage = "idle"
+        if job is None:
+            refund()
         return
 
-    if txt == "Тексты для баннеров 📣":
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
-        if not allowed:
+    try:
+        answer = await generate_flow_answer(req, flow, prompt)
+    except BaseException:
+        refund()
+        raise
+    await deliver(answer)
+    if not flow.one_shot:
+        req.st.stage = "idle"
+
+
+def register_flow_routes(flow: Flow):
+    async def start_flow(req: TextRequest):
+        if flow.one_shot:
+            await run_flow(req, flow, req.txt)
             return
-        st.stage = "banners"
-        await update.message.reply_text("Продукт + спецпредложение + ЦА. Дам 8 вариантов УТП в 4 форматах.", reply_markup=back_main_buttons())
-        return
-    if st.stage == "banners" and txt not in ("⬅️ В главное меню",):
-        allowed, user_profile = await ensure_paid_access(update.message, user_profile, "text")
+        allowed, req.profile = await ensure_paid_access(req.message, req.profile, flow.category)
         if not allowed:
             return
-        prompt = (
-            "Сгенерируй 8 баннерных текстов: короткие (до 6 слов), оффер+боль, срочность, соц.доказательства."
-            f" Дано: {txt}"
-        )
-        ans = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(update.message, st, ans, last_user_text=txt)
-        st.stage = "idle"
-        return
+        new_session(req.st)
+        req.st.stage = flow.key
+        await req.message.reply_text(flow.intro, reply_markup=back_main_buttons())
 
-    # Доп. ветки
-    if "Как я могу помочь твоему бизнесу" in txt:
-        await update.message.reply_text(
-            "Я анализирую текущие показатели, выявляю точки потерь и даю пошаговый план: стратегия, контент, трафик, автоматизация. Обычно видимые улучшения — в первые 30 дней.",
-            reply_markup=aux_menu()
-        )
-        return
+    async def flow_input(req: TextRequest):
+        await run_flow(req, flow, req.txt)
 
-    if "Показать стратегию роста" in txt:
-        await update.message.reply_text(
-            "Чтобы показать реальную стратегию, пройдём диагностику — это займёт 3–5 минут.",
-            reply_markup=ReplyKeyboardMarkup([["Начать диагностику 🚀"], ["⬅️ В главное меню"]], resize_keyboard=True)
-        )
-        return
+    start_flow.__name__ = f"flow_{flow.key}"
+    flow_input.__name__ = f"flow_{flow.key}_input"
+    ROUTER.exact(flow.trigger, needs_profile=True, log=flow.one_shot)(start_flow)
+    if not flow.one_shot:
+        ROUTER.stage(flow.key, needs_profile=True)(flow_input)
 
-    if "AI-инструменты для компании" in txt:
-        ideas = (
-            "🧠 Где внедрить AI:\n"
-            "• Автогенерация контента (посты, Reels, баннеры)\n"
-            "• Сценарии лид-менеджмента и триггеры\n"
-            "• Скрипты продаж и Q&A по базе знаний\n"
-            "• Прогноз спроса/бюджетов, алерты по метрикам\n"
-            "• Аналитика воронки и когорт"
-        )
-        await update.message.reply_text(ideas, reply_markup=aux_menu())
-        return
 
-    if "Мои цифры и анализ" in txt:
-        st.stage = "await_sales_file"
-        await update.message.reply_text(
-            "Отправь файл с продажами (CSV или XLSX). Я выделю закономерности и слабые места.",
-            reply_markup=ReplyKeyboardMarkup([["Пропустить"], ["⬅️ В главное меню"]], resize_keyboard=True)
-        )
-        return
+for _flow in FLOWS.values():
+    register_flow_routes(_flow)
+
+
+# Подменю: Генерация контента
+@ROUTER.exact("Генерация контента", "☄️Генерация контента")
+async def route_content_menu(req: TextRequest):
+    await req.message.reply_text("Что сгенерировать?", reply_markup=CONTENT_MENU)
+
+
+# Доп. ветки
+@ROUTER.exact("💡 Как я могу помочь твоему бизнесу")
+@ROUTER.contains("Как я могу помочь твоему бизнесу")
+async def route_how_can_help(req: TextRequest):
+    await req.message.reply_text(
+        "Я анализирую текущие показатели, выявляю точки потерь и даю пошаговый план: стратегия, контент, трафик, автоматизация. Обычно видимые улучшения — в первые 30 дней.",
+        reply_markup=aux_menu()
+    )
+
+
+@ROUTER.exact("📊 Показать стратегию роста")
+@ROUTER.contains("Показать стратегию роста")
+async def route_growth_strategy(req: TextRequest):
+    await req.message.reply_text(
+        "Чтобы показать реальную стратегию, пройдём диагностику — это займёт 3–5 минут.",
+        reply_markup=ReplyKeyboardMarkup([["Начать диагностику 🚀"], ["⬅️ В главное меню"]], resize_keyboard=True)
+    )
+
+
+@ROUTER.exact("🧠 AI-инструменты для компании")
+@ROUTER.contains("AI-инструменты для компании")
+async def route_ai_tools(req: TextRequest):
+    ideas = (
+        "🧠 Где внедрить AI:\n"
+        "• Автогенерация контента (посты, Reels, баннеры)\n"
+        "• Сценарии лид-менеджмента и триггеры\n"
+        "• Скрипты продаж и Q&A по базе знаний\n"
+        "• Прогноз спроса/бюджетов, алерты по метрикам\n"
+        "• Аналитика воронки и когорт"
+    )
+    await req.message.reply_text(ideas, reply_markup=aux_menu())
+
+
+@ROUTER.exact("🧾 Мои цифры и анализ")
+@ROUTER.contains("Мои цифры и анализ")
+async def route_sales_upload(req: TextRequest):
+    new_session(req.st)
+    req.st.stage = "await_sales_file"
+    buttons = [["Пропустить"], ["⬅️ В главное меню"]]
+    if latest_dataset(req.user.id) is not None:
+        buttons.insert(0, [REANALYZE_SALES_TEXT])
+    await req.message.reply_text(
+        "Отправь файл с продажами (CSV или XLSX). Я выделю закономерности и слабые места.",
+        reply_markup=ReplyKeyboardMarkup(buttons, resize_keyboard=True)
+    )
 
-    # Кнопки отчёта
-    if txt in ("Продукт 📦", "Целевая аудитория 🎯", "Продажи 💰", "Маркетинг 📣", "Команда 👥", "Конкуренты ⚔️", "Цифры и аналитика 📊", "Приоритеты ⚡️"):
-        await show_report_section(update, context, txt)
-        return
 
-    if txt == "Сохранить отчёт PDF 📁":
-        await export_pdf(update, context)
+REANALYZE_SALES_TEXT = "🔁 Разобрать прошлый файл"
+
+
+@ROUTER.exact(REANALYZE_SALES_TEXT)
+async def route_sales_reanalyze(req: TextRequest):
+    dataset = latest_dataset(req.user.id)
+    if dataset is None:
+        await req.message.reply_text("Сохранённых файлов нет — отправь выгрузку продаж (CSV или XLSX).")
         return
-    
-    if txt == "💬 Поддержка":
-        await update.message.reply_text(
-            "Нажми на кнопку ниже, чтобы написать в поддержку:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Написать в поддержку", url="https://t.me/maglena_a")]
-            ])
-        )
+    progress_msg = await req.message.reply_text("Пересчитываю аналитику по сохранённому файлу…")
+    result = await analyze_saved_dataset(dataset, on_progress=chat_progress(progress_msg))
+    with contextlib.suppress(Exception):
+        await progress_msg.delete()
+    if not result.ok:
+        await req.message.reply_text(result.message)
         return
+    req.st.sales_df_summary = result.summary
+    req.st.stage = "idle"
+    await req.message.reply_text("Готово ✅\nРазбор сохранённого файла:", reply_markup=aux_menu())
+    await req.message.reply_text(f"```\n{result.summary}\n```", parse_mode=ParseMode.MARKDOWN)
 
 
-    # «Да/Позже» в разных ветках
-    if st.stage == "demo":
-        await handle_demo_flow(update, context, txt)
-        return
+# Кнопки отчёта
+@ROUTER.exact("Продукт 📦", "Целевая аудитория 🎯", "Продажи 💰", "Маркетинг 📣", "Команда 👥", "Конкуренты ⚔️", "Цифры и аналитика 📊", "Приоритеты ⚡️")
+async def route_report_section(req: TextRequest):
+    await show_report_section(req.update, req.context, req.txt)
 
-    if st.stage == "diag_choice":
-        await handle_diag_choice_input(update, context, txt)
-        return
 
-    if st.stage in ("diag", "diag_running"):
-        await handle_diagnostic_flow(update, context, txt)
-        return
-    
-    # === Болталка после диагностики ===
-    if st.chat_mode:
-        return await handle_chat_mode(update, context)
+@ROUTER.exact("Сохранить отчёт PDF 📁")
+async def route_export_pdf(req: TextRequest):
+    await export_pdf(req.update, req.context)
 
 
-    # Приклеиваем «умный ответ» если ничего не подошло
-    await update.message.reply_text(
-            "Я тебя услышал. Чтобы получить максимальную пользу — выбери действие в меню ниже:",
-            reply_markup=MAIN_MENU
+@ROUTER.exact("💬 Поддержка")
+async def route_support(req: TextRequest):
+    await req.message.reply_text(
+        "Нажми на кнопку ниже, чтобы написать в поддержку:",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("Написать в поддержку", url="https://t.me/maglena_a")]
+        ])
     )
-    
-    
+
+
+# «Да/Позже» в разных ветках
+@ROUTER.stage("demo")
+async def route_demo_input(req: TextRequest):
+    await handle_demo_flow(req.update, req.context, req.txt)
+
+
+@ROUTER.stage("diag_choice")
+async def route_diag_choice_input(req: TextRequest):
+    await handle_diag_choice_input(req.update, req.context, req.txt)
+
+
+@ROUTER.stage("diag", "diag_running")
+async def route_diagnostic_input(req: TextRequest):
+    await handle_diagnostic_flow(req.update, req.context, req.txt)
+
+
 async def handle_chat_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     st = get_state(user.id)
@@ -1060,20 +942,11 @@ async def handle_chat_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     st.chat_history.append({"role": "user", "content": txt})
 
     # ограничиваем историю
-    MAX_HISTORY = 12
-    if len(st.chat_history) > MAX_HISTORY:
-        st.chat_history = st.chat_history[-MAX_HISTORY:]
-
-    # формируем сообщения
-    messages = [
-        {"role": "system", "content": "Ты — AI-маркетолог 360°. Отвечай коротко, по делу, учитывай контекст диагностики."},
-
-        # контекст диагностики
-        {"role": "system", "content": f"Контекст диагностики: {json.dumps(st.answers, ensure_ascii=False)}"},
-    ]
+    if len(st.chat_history) > CHAT_HISTORY_LIMIT:
+        st.chat_history = st.chat_history[-CHAT_HISTORY_LIMIT:]
 
-    # сама история
-    messages.extend(st.chat_history)
+    # формируем сообщения: системный промпт, контекст диагностики и сама история
+    messages = chat_messages(st.answers, st.chat_history)
 
     # вызываем OpenAI
     resp = await client.chat.completions.create(
@@ -1107,45 +980,71 @@ async def file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not (fname.endswith(".csv") or fname.endswith(".xlsx") or fname.endswith(".xls")):
         await update.message.reply_text("Поддерживаю CSV и XLSX. Отправь, пожалуйста, один из этих форматов.")
         return
+    if doc.file_size and doc.file_size > config.SALES_MAX_FILE_BYTES:
+        limit_mb = config.SALES_MAX_FILE_BYTES // (1024 * 1024)
+        await update.message.reply_text(f"Файл больше {limit_mb} МБ. Выгрузи период покороче или только нужные колонки.")
+        return
 
+    progress_msg = await update.message.reply_text("Загружаю файл…")
+    suffix = os.path.splitext(fname)[1]
+    fd, path = tempfile.mkstemp(prefix="sales_", suffix=suffix)
+    os.close(fd)
     try:
         file = await doc.get_file()
-        bio = io.BytesIO()
-        await file.download_to_memory(bio)
-        bio.seek(0)
-        if fname.endswith(".csv"):
-            df = pd.read_csv(bio)
-        else:
-            df = pd.read_excel(bio)
-        summary = summarize_sales_df(df)
-        st.sales_df_summary = summary
-        await update.message.reply_text("Принял файл ✅\nПредварительный разбор:", reply_markup=aux_menu())
-        await update.message.reply_text(f"```\n{summary}\n```", parse_mode=ParseMode.MARKDOWN)
-        st.stage = "idle"
-    except Exception as e:
-        await update.message.reply_text("Не удалось обработать файл. Проверь формат/кодировку и попробуй снова.")
-        print("File parse error:", e)
+        await file.download_to_drive(path)
+        result = await parse_sales_file(path, fname, user_id=user.id, on_progress=chat_progress(progress_msg))
+    except Exception as exc:  # noqa: BLE001
+        print("File download error:", exc)
+        result = None
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+    with contextlib.suppress(Exception):
+        await progress_msg.delete()
+
+    if result is None or not result.ok:
+        await update.message.reply_text(result.message if result else SALES_DOWNLOAD_FAILED_TEXT)
+        log_event(user.id, fname, f"parse failed: {result.error if result else 'download'}", stage="sales_parse")
+        return
+
+    summary = result.summary
+    st.sales_df_summary = summary
+    log_event(user.id, fname, f"parsed rows={result.rows} in {result.duration:.1f}s", stage="sales_parse")
+    await update.message.reply_text("Принял файл ✅\nПредварительный разбор:", reply_markup=aux_menu())
+    await update.message.reply_text(f"```\n{summary}\n```", parse_mode=ParseMode.MARKDOWN)
+    st.stage = "idle"
 
-def summarize_sales_df(df: pd.DataFrame) -> str:
-    info = []
-    try:
-        info.append(f"Строк: {len(df):,}".replace(",", " "))
-        info.append(f"Колонок: {len(df.columns)}")
-        num_cols = df.select_dtypes(include="number").columns.tolist()
-        if num_cols:
-            info.append(f"Числовые колонки: {', '.join(num_cols[:6])}{' …' if len(num_cols)>6 else ''}")
-            # Проба сумм/средних
-            for col in num_cols[:3]:
-                s = float(df[col].sum())
-                m = float(df[col].mean())
-                info.append(f"Σ {col}: {s:,.2f} | μ {col}: {m:,.2f}".replace(",", " "))
-        # Возможная дата
-        dt_cols = [c for c in df.columns if re.search(r"date|дата|time|время", str(c), re.I)]
-        if dt_cols:
-            info.append(f"Дата-колонки: {', '.join(dt_cols[:3])}")
-    except Exception:
-        pass
-    return "\n".join(info)
+
+SALES_DOWNLOAD_FAILED_TEXT = "Не получилось скачать файл из Telegram. Попробуй отправить его ещё раз."
+
+
+# Сильные ссылки на задачи правки прогресса: без них незавершённую задачу может собрать GC
+PROGRESS_TASKS: set = set()
+
+
+def chat_progress(message_obj):
+    """Колбэк прогресса разбора: правит статусное сообщение в чате, не дожидаясь ответа Telegram.
+
+    В полёте не больше одной правки: пока Telegram отвечает, новые значения только запоминаются,
+    и следом уходит последнее — правки не обгоняют друг друга и не копятся при медленном API.
+    """
+    pending: Dict[str, Any] = {"text": None, "task": None}
+
+    async def edit():
+        while pending["text"] is not None:
+            text, pending["text"] = pending["text"], None
+            with contextlib.suppress(Exception):
+                await message_obj.edit_text(text)
+
+    def report(rows: int):
+        pending["text"] = f"Обрабатываю файл… строк: {rows:,}".replace(",", " ")
+        if pending["task"] is not None and not pending["task"].done():
+            return
+        task = pending["task"] = asyncio.create_task(edit())
+        PROGRESS_TASKS.add(task)
+        task.add_done_callback(PROGRESS_TASKS.discard)
+
+    return report
 
 # ------------------------------
 # 🧪 ДЕМО-РЕЖИМ
@@ -1177,12 +1076,8 @@ async def handle_demo_flow(update: Update, context: ContextTypes.DEFAULT_TYPE, t
             if not allowed:
                 st.stage = "idle"
                 return
-            prompt = (
-                "Сгенерируй 6 быстрых гипотез роста для бизнеса на 30–60 дней, с приоритетами и ожидаемым эффектом.\n"
-                f"Бизнес: {st.answers.get('demo_prod')}\n"
-                f"Каналы сейчас: {st.answers.get('demo_channels')}\n"
-                f"Цель: {st.answers.get('demo_goal')}\n"
-                "Формат: нумерованный список, по каждой — идея, зачем, метрика, первый шаг."
+            prompt = demo_ideas_prompt(
+                st.answers.get("demo_prod"), st.answers.get("demo_channels"), st.answers.get("demo_goal")
             )
             ideas = await ask_gpt_with_typing(context.bot, chat_id, prompt)
             await send_gpt_reply(
@@ -1241,6 +1136,7 @@ async def handle_diagnostic_flow(update: Update, context: ContextTypes.DEFAULT_T
 
     # Последний ответ получен — предлагаем варианты продолжения
     st.diagnostic_step = 0
+    start_speculative_prefetch(user, st)
     await present_post_diag_choices(update.message, st)
     return
 
@@ -1255,21 +1151,36 @@ async def present_post_diag_choices(message_obj, st: UserState):
     )
 
 
-async def run_demo_after_diagnostic(message_obj, st: UserState, *, bot=None, chat_id: Optional[int] = None):
+def start_speculative_prefetch(user, st: UserState):
+    """Пока пользователь читает экран выбора, заранее готовим экспресс-разбор (и обзор конкурентов)."""
+    if not config.SPECULATIVE_PREFETCH:
+        return
+    fingerprint = session_fingerprint(st)
+    prompt = demo_analysis_prompt(st.answers)
+    PREFETCHER.prefetch((user.id, "diag_demo", fingerprint), lambda: chatgpt_answer(prompt))
+    if config.SPECULATIVE_COMPETITORS and has_active_subscription(get_user(user.id, user.username)):
+        snapshot = UserState(answers=dict(st.answers), competitors=list(st.competitors))
+        PREFETCHER.prefetch(
+            (user.id, "comp_all", fingerprint),
+            lambda: generate_competitor_review(snapshot, "Все разделы вместе"),
+        )
+
+
+async def run_demo_after_diagnostic(message_obj, user, st: UserState, *, bot=None, chat_id: Optional[int] = None) -> bool:
     st.stage = "idle"
-    prompt = (
-        "Сделай экспресс-разбор маркетинга по ответам пользователя.\n"
-        "Дай по делу: 1) Кратко о нише и модели 2) Сильные стороны 3) Слабые места/риски 4) Первые шаги на 7–14 дней "
-        "5) Приоритеты на 30 дней (3 пункта). Стиль: экспертно, дружелюбно, без воды, без символов * или #.\n\n"
-        f"Ответы пользователя (JSON): {json.dumps(st.answers, ensure_ascii=False)}"
-    )
-    analysis = await ask_gpt_with_typing(bot, chat_id, prompt)
-    await send_gpt_reply(
-        message_obj,
-        st,
-        "Экспресс-разбор готов 👇\n\n" + analysis,
+    prompt = demo_analysis_prompt(st.answers)
+
+    async def deliver_demo(analysis: str):
+        await send_gpt_reply(
+            message_obj,
+            st,
+            "Экспресс-разбор готов 👇\n\n" + analysis,
+        )
+        await send_demo_value_message(message_obj)
+
+    return await run_cached_job(
+        user, st, "diag_demo", lambda: chatgpt_answer(prompt), deliver_demo, bot=bot, chat_id=chat_id
     )
-    await send_demo_value_message(message_obj)
 
 
 async def send_demo_value_message(message_obj):
@@ -1325,7 +1236,9 @@ async def handle_diag_choice_input(update: Update, context: ContextTypes.DEFAULT
     chat_id = update.effective_chat.id if update.effective_chat else None
     normalized = txt.lower()
     if "демо" in normalized:
-        await run_demo_after_diagnostic(update.message, st, bot=context.bot, chat_id=chat_id)
+        started = await run_demo_after_diagnostic(update.message, user, st, bot=context.bot, chat_id=chat_id)
+        if not started:
+            await update.message.reply_text(ALREADY_GENERATING_TEXT)
         return
     if "пол" in normalized or "верс" in normalized or "тариф" in normalized or "куп" in normalized:
         await send_full_version_pitch(update.message, st)
@@ -1346,15 +1259,79 @@ async def finalize_diagnostic(update: Update, context: ContextTypes.DEFAULT_TYPE
     st.diagnostic_step = 0
 
     await safe_reply_text(update.message, "Формирую итоговый отчёт и план…")
-    report_text = await make_final_report(user, st, bot=context.bot, chat_id=chat_id)
 
-    await send_gpt_reply(update.message, st, report_text)
-    await safe_reply_text(
-        update.message,
-        "Нужно углубиться в конкретный блок? Выбери раздел отчёта или просто продолжай диалог.",
-        reply_markup=report_menu()
+    async def deliver_report(report_text: str):
+        remember_report(user.id, report_text)
+        await send_gpt_reply(update.message, st, report_text)
+        await safe_reply_text(
+            update.message,
+            "Нужно углубиться в конкретный блок? Выбери раздел отчёта или просто продолжай диалог.",
+            reply_markup=report_menu()
+        )
+
+    await run_cached_job(
+        user, st, "get_report", lambda: make_final_report(user, st), deliver_report, bot=context.bot, chat_id=chat_id
     )
 
+# ------------------------------
+# ⏳ ДОЛГИЕ ГЕНЕРАЦИИ: ЗАЩИТА ОТ ДВОЙНЫХ НАЖАТИЙ
+# ------------------------------
+DEBOUNCED_ACTIONS = {"get_report", "plan_30d", "comp_prices", "comp_content", "comp_product", "comp_all", "diag_demo"}
+ALREADY_GENERATING_TEXT = "Уже генерирую — ответ придёт в этот чат ⏳"
+RESULT_CACHE = TTLCache(ttl=config.RESULT_CACHE_TTL, max_items=2048)
+
+
+def session_fingerprint(st: UserState) -> str:
+    """Хеш вводных сессии: пока они не менялись, готовый результат можно отдать повторно."""
+    payload = json.dumps(
+        [st.answers, st.competitors, st.sales_df_summary], ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+async def run_cached_job(user, st: UserState, action: str, generate, deliver, *, bot=None, chat_id=None) -> bool:
+    """Отдаёт свежий результат из кеша или запускает генерацию в фоне.
+
+    Возвращает False, если такая генерация у пользователя уже идёт.
+    """
+    key = (user.id, action, session_fingerprint(st))
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        await deliver(cached)
+        return True
+
+    speculative = PREFETCHER.claim(key)
+    if speculative is not None:
+        if speculative.done() and not speculative.cancelled() and speculative.exception() is None:
+            result = speculative.result()
+            RESULT_CACHE.set(key, result)
+            await deliver(result)
+            return True
+        if not speculative.done():
+            # Запрос уже идёт — job просто дожидается его, а не стартует новый.
+            async def await_speculative():
+                return await speculative
+
+            generate = await_speculative
+
+    async def generate_and_remember():
+        # Кешируем сразу: даже если пользователь ушёл в другой сценарий, повтор отдастся мгновенно.
+        result = await generate()
+        if result:
+            RESULT_CACHE.set(key, result)
+        return result
+
+    job = JOBS.start(
+        user.id,
+        action,
+        generate_and_remember,
+        on_result=deliver,
+        bot=bot,
+        chat_id=chat_id,
+        is_current=session_guard(user.id, st),
+    )
+    return job is not None
+
 # ------------------------------
 # 🔎 КНОПКИ АНАЛИЗА КОНКУРЕНТОВ И ОТЧЁТ
 # ------------------------------
@@ -1363,6 +1340,10 @@ async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     st = get_state(user.id)
     q = update.callback_query
     data = q.data
+    # Повторное нажатие, пока идёт генерация, не запускает её второй раз.
+    if data in DEBOUNCED_ACTIONS and JOBS.is_running(user.id, data):
+        await q.answer(ALREADY_GENERATING_TEXT)
+        return
     await q.answer()
     chat_id = update.effective_chat.id if update.effective_chat else None
 
@@ -1401,24 +1382,53 @@ async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("tariff_success_"):
-        code = data.replace("tariff_success_", "", 1)
-        if code in TARIFFS:
-            profile = activate_tariff(user.id, code, username=user.username)
-            success_text = format_success_payment(code, profile)
-            success_keyboard = ReplyKeyboardMarkup(
-                [
-                    ["🧬AI-Маркетолог", "☄️Генерация контента"],
-                    ["⬅️ В главное меню"],
-                ],
-                resize_keyboard=True,
+        # Кнопки из старых сообщений: тариф теперь включает только подтверждённый платёж.
+        await q.message.reply_text(PAYMENT_PENDING_TEXT, reply_markup=INLINE_CONTACT)
+        return
+
+    if data.startswith("pay_check_"):
+        payment_id = data.replace("pay_check_", "", 1)
+        record = PAYMENT_EVENTS.processed.get(payment_id)
+        if record is None:
+            try:
+                payment = await YOOKASSA.get_payment(payment_id)
+            except PaymentsError:
+                await q.message.reply_text(PAYMENT_PENDING_TEXT, reply_markup=INLINE_CONTACT)
+                return
+            if payment_owner(payment) != user.id:
+                await q.message.reply_text(PAYMENT_NOT_FOUND_TEXT, reply_markup=INLINE_CONTACT)
+                return
+            outcomes = await PAYMENT_EVENTS.process([payment_id], notify=False, known={payment_id: payment})
+            record = PAYMENT_EVENTS.processed.get(payment_id)
+            if outcomes:
+                outcome = outcomes[0]
+                await send_split_text(
+                    q.message,
+                    format_success_payment(outcome.service_code, outcome.profile),
+                    reply_markup=PAYMENT_SUCCESS_KEYBOARD,
+                    disable_preview=True,
+                )
+                return
+        if record is not None and record.get("user_id") != user.id:
+            await q.message.reply_text(PAYMENT_NOT_FOUND_TEXT, reply_markup=INLINE_CONTACT)
+            return
+        if record and record.get("service_code") in TARIFFS:
+            # Уже активирован уведомлением ЮKassa — просто показываем текущий тариф.
+            profile = get_user(user.id, user.username)
+            await send_split_text(
+                q.message,
+                format_success_payment(record["service_code"], profile),
+                reply_markup=PAYMENT_SUCCESS_KEYBOARD,
+                disable_preview=True,
             )
-            await send_split_text(q.message, success_text, reply_markup=success_keyboard, disable_preview=True)
             return
+        await q.message.reply_text(PAYMENT_PENDING_TEXT, reply_markup=INLINE_CONTACT)
+        return
 
     if data.startswith("buy_service_"):
         service_code = data.replace("buy_service_", "", 1)
         try:
-            payment_result = build_service_payment(service_code)
+            payment_result = await PENDING_PAYMENTS.get_or_create(user.id, service_code)
         except Exception as exc:  # noqa: BLE001
             await q.message.reply_text(
                 "Не получилось создать счёт в ЮKassa. Напиши менеджеру, мы поможем оформить оплату.",
@@ -1435,15 +1445,9 @@ async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         payment_url, payment_payload = payment_result
-        payment_keyboard = InlineKeyboardMarkup(
-            [
-                [InlineKeyboardButton("Оплатить через ЮKassa", url=payment_url)],
-                [InlineKeyboardButton("Написать менеджеру", url="https://t.me/maglena_a")],
-            ]
-        )
         await q.message.reply_text(
             "Готово! Ниже ссылка на оплату через ЮKassa. После оплаты лимиты обновятся автоматически.",
-            reply_markup=payment_keyboard,
+            reply_markup=payment_buttons(payment_url, payment_payload),
         )
         log_event(user.id, f"buy:{service_code}", json.dumps(payment_payload, ensure_ascii=False), stage="payment")
         return
@@ -1453,7 +1457,7 @@ async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "diag_demo":
-        await run_demo_after_diagnostic(q.message, st, bot=context.bot, chat_id=chat_id)
+        await run_demo_after_diagnostic(q.message, user, st, bot=context.bot, chat_id=chat_id)
         return
 
     if data == "diag_full":
@@ -1466,25 +1470,28 @@ async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if data == "get_report":
         # Сформировать итоговый отчёт и показать меню секций
-        txt = await make_final_report(user, st, bot=context.bot, chat_id=chat_id)
-        await q.message.reply_text("Готово ✅\nНиже — краткий отчёт и рекомендации.")
-        await send_gpt_reply(q.message, st, txt)
-        st.stage = "idle"
+        async def deliver_report(txt: str):
+            st.stage = "idle"
+            remember_report(user.id, txt)
+            await send_gpt_reply(q.message, st, "Готово ✅\nНиже — краткий отчёт и рекомендации.\n\n" + txt)
+
+        await run_cached_job(
+            user, st, data, lambda: make_final_report(user, st), deliver_report, bot=context.bot, chat_id=chat_id
+        )
         return
 
     if data == "plan_30d":
         # 30-дневный пошаговый план
-        prompt = (
-            "Составь пошаговый 30-дневный план внедрения приоритетов: неделя за неделей,"
-            " задачи, ответственные роли, метрики успеха, ожидаемый эффект, чек-лист.\n"
-            f"Вводные (кратко): {json.dumps(st.answers, ensure_ascii=False)[:1200]}"
-        )
+        prompt = plan_30d_prompt(st.answers)
         allowed, _ = await ensure_paid_access(q.message, get_user(user.id, user.username), "text")
         if not allowed:
             return
-        plan = await ask_gpt_with_typing(context.bot, chat_id, prompt)
-        await send_gpt_reply(q.message, st, plan)
-        st.stage = "idle"
+
+        async def deliver_plan(plan: str):
+            st.stage = "idle"
+            await send_gpt_reply(q.message, st, plan)
+
+        await run_cached_job(user, st, data, lambda: chatgpt_answer(prompt), deliver_plan, bot=context.bot, chat_id=chat_id)
         return
 
     # Анализ конкурентов — выбор раздела
@@ -1502,38 +1509,35 @@ async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             allowed, _ = await ensure_paid_access(q.message, get_user(user.id, user.username), "text")
             if not allowed:
                 return
-            comp_text = await generate_competitor_review(st, section, bot=context.bot, chat_id=chat_id)
-            await send_gpt_reply(q.message, st, comp_text)
+
+            async def deliver_review(comp_text: str):
+                await send_gpt_reply(q.message, st, comp_text)
+
+            await run_cached_job(
+                user,
+                st,
+                data,
+                lambda: generate_competitor_review(st, section),
+                deliver_review,
+                bot=context.bot,
+                chat_id=chat_id,
+            )
         return
 
 # Генерация обзора конкурентов
 async def generate_competitor_review(st: UserState, focus: str, *, bot=None, chat_id: Optional[int] = None) -> str:
-    comps = "\n".join(st.competitors) if st.competitors else "Нет ссылок; подбери аналоги по нише."
-    prompt = (
-        "Сделай краткий обзор конкурентов по нише пользователя.\n"
-        f"Ссылки/подсказки:\n{comps}\n\n"
-        f"Фокус: {focus}\n"
-        "Формат: 1) Наблюдения 2) Отличия 3) Риски 4) Возможности 5) 3 шага обойти конкурентов."
-    )
+    prompt = competitor_review_prompt(st.competitors, focus)
     return await ask_gpt_with_typing(bot, chat_id, prompt)
 
 # ------------------------------
 # 📄 ИТОГОВЫЙ ОТЧЁТ
 # ------------------------------
 async def make_final_report(user: Any, st: UserState, *, bot=None, chat_id: Optional[int] = None) -> str:
-    sales_block = st.sales_df_summary or "Нет файла продаж. Рекомендую выгрузку для поиска потерь."
-    prompt = (
-        "Сформируй итоговый отчёт AI-маркетолога 360° по 7 направлениям (кратко, по делу):\n"
-        "Направления: Продукт, Клиенты (ЦА), Продажи, Маркетинг, Команда, Конкуренты, Цифры.\n"
-        "В конце — приоритеты на 30 дней (5 пунктов).\n\n"
-        f"Исходные ответы пользователя (JSON): {json.dumps(st.answers, ensure_ascii=False)}\n"
-        f"Аналитика по файлу продаж (если есть): {sales_block}\n"
-        f"Ссылки конкурентов: {', '.join(st.competitors) if st.competitors else 'нет'}\n"
-        "Стиль: чётко, без Markdown, не используй символы * и #."
-    )
-    full = await ask_gpt_with_typing(bot, chat_id, prompt)
-    st.last_report_text = full
+    prompt = final_report_prompt(st.answers, st.sales_df_summary, st.competitors)
+    return await ask_gpt_with_typing(bot, chat_id, prompt)
+
 
+def remember_report(user_id: int, full: str):
     # Выделим секции для быстрого меню
     parts = {
         "Продукт 📦": r"(?si)продукт.*?(?=\n#|\Z)",
@@ -1545,35 +1549,45 @@ async def make_final_report(user: Any, st: UserState, *, bot=None, chat_id: Opti
         "Цифры и аналитика 📊": r"(?si)(цифр|аналитик).*?(?=\n#|\Z)",
         "Приоритеты ⚡️": r"(?si)(приоритет|30 дней|шаг[аи]).*?(?=\n#|\Z)",
     }
-    st.last_report_sections = {}
+    sections = {}
     for title, regex in parts.items():
         m = re.search(regex, full)
         if m:
-            st.last_report_sections[title] = m.group(0).strip()
-    return full
+            sections[title] = m.group(0).strip()
+    REPORTS.save(user_id, full, sections)
 
 async def show_report_section(update: Update, context: ContextTypes.DEFAULT_TYPE, title: str):
     user = update.effective_user
-    st = get_state(user.id)
-    if not st.last_report_text:
+    report = REPORTS.latest(user.id)
+    if report is None:
         await update.message.reply_text("Сначала нужно завершить диагностику, чтобы сформировать отчёт.", reply_markup=MAIN_MENU)
         return
-    body = st.last_report_sections.get(title) or "Эта секция не выделена отдельно. См. общий отчёт."
-    formatted_body = format_gpt_answer_for_telegram(f"{title}\n\n{body}")
-    await send_split_text(update.message, formatted_body, reply_markup=report_menu())
+    chunks = report.chunks.get(title)
+    if chunks is None:
+        chunks = split_for_telegram(format_gpt_answer_for_telegram(f"{title}\n\nЭта секция не выделена отдельно. См. общий отчёт."))
+    await send_chunks(update.message, chunks, reply_markup=report_menu())
+
+PDF_FAILED_TEXT = "Не удалось собрать PDF — попробуй ещё раз через минуту 🙏"
+
 
 async def export_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    st = get_state(user.id)
-    if not st.last_report_text:
+    report = REPORTS.latest(user.id)
+    if report is None:
         await update.message.reply_text("Сначала сформируй отчёт, а затем можно экспортировать в PDF.", reply_markup=MAIN_MENU)
         return
-    pdf_bytes = make_pdf_report(
-        username=user.full_name or user.username or f"id:{user.id}",
-        summary_text=st.last_report_text,
-        sections=st.last_report_sections or {}
-    )
-    await update.message.reply_document(document=InputFile(io.BytesIO(pdf_bytes), filename="ai_marketer_360_report.pdf"), caption="Отчёт готов 📁")
+    username = user.full_name or user.username or f"id:{user.id}"
+    try:
+        await reply_document_cached(
+            update.message,
+            f"report:{user.id}",
+            report_key(username, report.text, report.sections),
+            lambda: render_pdf_report(username=username, summary_text=report.text, sections=report.sections),
+            filename="ai_marketer_360_report.pdf",
+            caption="Отчёт готов 📁",
+        )
+    except (asyncio.TimeoutError, BrokenProcessPool):
+        await update.message.reply_text(PDF_FAILED_TEXT, reply_markup=MAIN_MENU)
 
 # ------------------------------
 # 🧵 ЗАВЕРШЕНИЕ ДИАГНОСТИКИ (ТРИГГЕР)
@@ -1608,31 +1622,104 @@ async def any_message_postprocess(update: Update, context: ContextTypes.DEFAULT_
 # ------------------------------
 # ▶️ MAIN
 # ------------------------------
-def main():
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+async def on_startup(app):
+    """Фоновые задачи: обработка оплат ЮKassa; в polling-режиме — HTTP-сервер, если он включён."""
+    PAYMENT_EVENTS.start(lambda outcome: notify_payment_success(app.bot, outcome))
+    PENDING_PAYMENTS.start(config.PENDING_RECONCILE_INTERVAL)
+    if config.BOT_MODE != "webhook" and config.HTTP_SERVER_IN_POLLING:
+        from ai_marketer.http_server import start_http_server
+
+        app.bot_data["http_runner"] = await start_http_server(app, telegram_updates=False)
+        print(f"🌐 HTTP-сервер слушает {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}")
+
+
+async def on_shutdown(app):
+    """Останавливает фоновые задачи и закрывает общие HTTP-клиенты (пул соединений ЮKassa)."""
+    # Рассылка останавливается на границе пачки и сохраняет чекпоинт для /broadcast_resume
+    await BROADCASTER.stop()
+    await PENDING_PAYMENTS.stop()
+    await PAYMENT_EVENTS.stop()
+    runner = app.bot_data.pop("http_runner", None)
+    if runner is not None:
+        await runner.cleanup()
+    await YOOKASSA.aclose()
+
+
+async def run_webhook(app):
+    """Webhook-режим: свой HTTP-сервер принимает апдейты и кладёт их в очередь приложения."""
+    from ai_marketer.http_server import start_http_server
+
+    async with app:
+        await app.start()
+        await on_startup(app)
+        if config.WEBHOOK_URL:
+            await app.bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET,
+                allowed_updates=config.ALLOWED_UPDATES,
+            )
+        runner = await start_http_server(app, telegram_updates=True)
+        print(f"🌐 Webhook слушает {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            await app.stop()
+            await on_shutdown(app)
+
+
+def build_application(request: Optional[BaseRequest] = None):
+    """Приложение со всеми хендлерами; request подменяет HTTP-транспорт Bot API (tools/bench_replay.py)."""
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .rate_limiter(SendScheduler())
+        .concurrent_updates(PerUserUpdateProcessor(config.UPDATE_CONCURRENCY))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    app = builder.build()
+    # Замер апдейтов целиком (группы -1 и 1000), включается на лету через /profile
+    PROFILER.install(app)
 
     # Команды
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_cmd))
-    app.add_handler(CommandHandler("cancel", cancel))
+    app.add_handler(CommandHandler("start", traced("start", start)))
+    app.add_handler(CommandHandler("help", traced("help", help_cmd)))
+    app.add_handler(CommandHandler("cancel", traced("cancel", cancel)))
+    app.add_handler(CommandHandler("broadcast", traced("broadcast", broadcast_cmd)))
+    app.add_handler(CommandHandler("broadcast_stop", traced("broadcast_stop", broadcast_stop_cmd)))
+    app.add_handler(CommandHandler("broadcast_resume", traced("broadcast_resume", broadcast_resume_cmd)))
+    app.add_handler(CommandHandler("profile", traced("profile", profile_cmd)))
 
     # Callback-кнопки
-    app.add_handler(CallbackQueryHandler(cb_handler))
+    app.add_handler(CallbackQueryHandler(traced("cb_handler", cb_handler)))
 
     # Документы (CSV/XLSX)
-    app.add_handler(MessageHandler(filters.Document.ALL, file_handler))
+    app.add_handler(MessageHandler(filters.Document.ALL, traced("file_handler", file_handler)))
 
     # Текстовый роутер
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_router))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, traced("text_router", text_router)))
 
     # Постобработка (необязательно)
     app.add_handler(MessageHandler(filters.ALL, any_message_postprocess))
 
     # Ошибки
     app.add_error_handler(error_handler)
+    return app
+
 
+def main():
+    app = build_application()
     print("🤖 Бот запущен. Нажми Ctrl+C для остановки.")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if config.BOT_MODE == "webhook":
+        if not config.WEBHOOK_SECRET:
+            raise RuntimeError("Для BOT_MODE=webhook задай WEBHOOK_SECRET (A-Z, a-z, 0-9, _ и -, до 256 символов)")
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(run_webhook(app))
+        return
+    app.run_polling(allowed_updates=config.ALLOWED_UPDATES)
 
 if __name__ == "__main__":
     main()
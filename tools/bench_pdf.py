@@ -0,0 +1,151 @@
+"""Бенчмарк рендера PDF-отчёта: новый layout против прежнего write_wrapped.
+
+Собирает синтетический отчёт примерно на N страниц и печатает JSON со временем и страницами в секунду.
+
+    python tools/bench_pdf.py --pages 50 --repeat 3
+    PDF_FONT_PATH=/path/DejaVuSans.ttf python tools/bench_pdf.py
+
+Запускать из корня репозитория: модуль ai_marketer читает config, поэтому
+TELEGRAM_TOKEN/OPENAI_API_KEY подставляются заглушками, если их нет в окружении.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import re
+import sys
+import time
+from typing import Callable, Dict, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from reportlab.lib.pagesizes import A4  # noqa: E402
+from reportlab.lib.units import mm  # noqa: E402
+from reportlab.pdfbase.pdfmetrics import stringWidth  # noqa: E402
+from reportlab.pdfgen import canvas  # noqa: E402
+
+from ai_marketer.pdf_layout import register_fonts  # noqa: E402
+from ai_marketer.pdf_report import make_pdf_report  # noqa: E402
+from ai_marketer.text_utils import sanitize  # noqa: E402
+
+WORDS = (
+    "маркетинг воронка конверсия трафик аудитория оффер бюджет гипотеза контент охват лиды "
+    "продажи retention LTV CAC CTR креатив таргет рассылка сегмент метрика стратегия"
+).split()
+
+
+def legacy_pdf_report(username: str, summary_text: str, sections: Dict[str, str]) -> bytes:
+    """Прежний рендер (до pdf_layout): квадратичный перенос строк и Helvetica."""
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    width, height = A4
+    left = 18 * mm
+    top = height - 20 * mm
+
+    def write_wrapped(text: str, x: float, y: float, max_width: float, leading=14):
+        lines = []
+        for paragraph in text.split("\n"):
+            line = ""
+            for w in paragraph.split(" "):
+                test = (line + " " + w).strip()
+                if stringWidth(test, "Helvetica", 11) <= max_width:
+                    line = test
+                else:
+                    lines.append(line)
+                    line = w
+            lines.append(line)
+            lines.append("")
+        cur_y = y
+        for ln in lines:
+            if cur_y < 20 * mm:
+                c.showPage()
+                cur_y = height - 20 * mm
+                c.setFont("Helvetica", 11)
+            c.drawString(x, cur_y, ln)
+            cur_y -= leading
+        return cur_y
+
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(left, top, f"Итоговый отчёт — {username}")
+    y = top - 30
+    c.setFont("Helvetica", 11)
+    y = write_wrapped(sanitize(summary_text, 8000), left, y, width - 2 * left)
+    for title, body in sections.items():
+        if y < 40 * mm:
+            c.showPage()
+            y = height - 20 * mm
+        c.setFont("Helvetica-Bold", 13)
+        c.drawString(left, y, title)
+        y -= 18
+        c.setFont("Helvetica", 11)
+        y = write_wrapped(sanitize(body, 8000), left, y, width - 2 * left)
+    c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def synthetic_report(pages: int, seed: int = 42) -> Tuple[str, Dict[str, str]]:
+    # ~55 строк на странице A4 при leading=14; абзац ~8 строк + пустая строка, плюс заголовок секции.
+    rnd = random.Random(seed)
+    paragraphs_per_section = 8
+    sections_count = max(1, pages * 55 // (9 * paragraphs_per_section + 2))
+
+    def paragraph() -> str:
+        # Длинные абзацы как в ответах GPT: до ~8000 символов на секцию (лимит sanitize).
+        return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(60, 90)))
+
+    summary = "\n".join(paragraph() for _ in range(4))
+    sections = {
+        f"Раздел {i + 1}": "\n".join(paragraph() for _ in range(paragraphs_per_section))
+        for i in range(sections_count)
+    }
+    return summary, sections
+
+
+def count_pages(pdf: bytes) -> int:
+    return len(re.findall(rb"/Type\s*/Page[^s]", pdf))
+
+
+def bench(render: Callable[..., bytes], summary: str, sections: Dict[str, str], repeat: int) -> Dict:
+    timings = []
+    pdf = b""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        pdf = render("bench", summary, sections)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    pages = count_pages(pdf)
+    return {
+        "pages": pages,
+        "bytes": len(pdf),
+        "best_seconds": round(best, 4),
+        "pages_per_second": round(pages / best, 1) if best else None,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    summary, sections = synthetic_report(args.pages)
+    font, _ = register_fonts()
+    result = {
+        "font": font,
+        "legacy": bench(legacy_pdf_report, summary, sections, args.repeat),
+        "layout": bench(make_pdf_report, summary, sections, args.repeat),
+    }
+    legacy_pps = result["legacy"]["pages_per_second"] or 0
+    if legacy_pps:
+        result["speedup"] = round(result["layout"]["pages_per_second"] / legacy_pps, 2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,514 @@
+"""Сквозной бенчмарк хендлеров main.py на записанных сценариях без реальных сервисов.
+
+Апдейты из tools/fixtures/flows/*.jsonl проигрываются за N виртуальных пользователей через
+настоящий Application (PerUserUpdateProcessor, SendScheduler, хендлеры text_router/cb_handler/
+file_handler). Bot API подменяется in-process транспортом (FakeTelegramRequest), OpenAI и ЮKassa —
+локальным aiohttp-сервером с настраиваемой задержкой и стримингом.
+
+    python tools/bench_replay.py --users 50 --flows diagnostic,report,payment
+    python tools/bench_replay.py --openai-latency 800 --chunks 40 --output bench.json
+    python tools/bench_replay.py --compare bench.json --max-regression 10
+
+Каждый пользователь проходит сценарии по шагам: следующий апдейт уходит, когда предыдущий
+обработан и фоновые генерации пользователя (JOBS) завершились. Печатает JSON: updates/s,
+p50/p99 времени хендлера (всего и по хендлерам), p50/p99 шага сценария с фоновыми задачами,
+лаг event loop и число вызовов Bot API / OpenAI. С --compare сравнивает с прошлым отчётом и
+возвращает 1, если updates/s упал или p99 вырос больше чем на --max-regression процентов.
+
+Данные бота (data/, logs.jsonl, traces.jsonl) пишутся во временный каталог.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram.request import BaseRequest, RequestData  # noqa: E402
+
+BOT_USER = {"id": 999, "is_bot": True, "first_name": "AI360", "username": "ai_marketer_360_bot"}
+REPORT_TEXT = (
+    "Продукт: кофе и выпечка навынос, сильная сторона — скорость и локация у метро.\n"
+    "Целевая аудитория: офисные сотрудники 25–40 лет и жители района, клиенты ценят скорость.\n"
+    "Продажи: 900 чеков в месяц, провал летом, нет программы лояльности.\n"
+    "Маркетинг: сарафан и карточка на картах, таргет без системы и без аналитики.\n"
+    "Команда: два бариста, маркетингом занимается собственник урывками.\n"
+    "Конкуренты: две сетевые кофейни рядом, у них приложение и акции.\n"
+    "Цифры и аналитика: средний чек 450 ₽, доля повторных покупок неизвестна.\n"
+    "Приоритеты на 30 дней: 1) лояльность 2) отзывы на картах 3) утреннее комбо 4) рассылка 5) учёт повторных.\n"
+)
+
+
+def load_flows(names: List[str]) -> Dict[str, List[Dict]]:
+    flows = {}
+    for name in names:
+        with open(os.path.join(ROOT, "tools", "fixtures", "flows", f"{name}.jsonl"), "r", encoding="utf-8") as f:
+            flows[name] = [json.loads(line) for line in f if line.strip()]
+    return flows
+
+
+def _retarget(update: Dict, update_id: int, user_id: int) -> Dict:
+    update = copy.deepcopy(update)
+    update["update_id"] = update_id
+    for key in ("message", "callback_query"):
+        payload = update.get(key)
+        if not payload:
+            continue
+        payload["from"]["id"] = user_id
+        message = payload if key == "message" else payload.get("message", {})
+        if "chat" in message:
+            message["chat"]["id"] = user_id
+        if key == "callback_query":
+            payload["data"] = payload["data"].replace("{user_id}", str(user_id))
+    return update
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct), len(values) - 1)]
+
+
+def _stats_ms(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(statistics.median(values) * 1000, 2) if values else None,
+        "p99_ms": round(_percentile(values, 0.99) * 1000, 2) if values else None,
+        "max_ms": round(max(values) * 1000, 2) if values else None,
+    }
+
+
+def make_sales_csv(rows: int) -> bytes:
+    rnd = random.Random(42)
+    lines = ["date;client_id;product;qty;amount"]
+    for idx in range(rows):
+        day = 1 + idx % 28
+        month = 1 + (idx // 28) % 12
+        qty = rnd.randint(1, 5)
+        lines.append(f"2024-{month:02d}-{day:02d};c{rnd.randint(1, rows // 10 + 1)};p{rnd.randint(1, 40)};{qty};{qty * 450}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Bot API в памяти: отвечает правдоподобными объектами и считает вызовы по методам."""
+
+    def __init__(self, latency: float, files: Dict[str, bytes]):
+        self.latency = latency
+        self.files = files
+        self.calls: Dict[str, int] = {}
+        self._message_id = 1000
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _message(self, params: Dict, **extra) -> Dict:
+        self._message_id += 1
+        chat_id = params.get("chat_id", 0)
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        message.update(extra)
+        return message
+
+    def _result(self, endpoint: str, params: Dict):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": file_id + "-u", "file_size": len(self.files[file_id]), "file_path": file_id}
+        if endpoint == "sendDocument":
+            doc_id = f"doc-{self._message_id}"
+            return self._message(params, document={"file_id": doc_id, "file_unique_id": doc_id + "-u"})
+        if endpoint == "copyMessage":
+            self._message_id += 1
+            return {"message_id": self._message_id}
+        if endpoint.startswith(("send", "edit")):
+            return self._message(params)
+        return True
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "/file/bot" in url:
+            self.calls["file_download"] = self.calls.get("file_download", 0) + 1
+            return 200, self.files[url.rsplit("/", 1)[-1]]
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        params = request_data.parameters if request_data else {}
+        body = {"ok": True, "result": self._result(endpoint, params)}
+        return 200, json.dumps(body).encode("utf-8")
+
+
+class FakeServices:
+    """OpenAI (/v1/chat/completions, обычный и SSE-стриминг) и ЮKassa (/v3/payments) на одном aiohttp."""
+
+    def __init__(self, latency: float, chunks: int, chunk_delay: float):
+        self.latency = latency
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.openai_calls = 0
+        self.payments: Dict[str, Dict] = {}
+        self.runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def _completions(self, request: web.Request) -> web.StreamResponse:
+        self.openai_calls += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": body.get("model", "bench")}
+        if not body.get("stream"):
+            return web.json_response({
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": REPORT_TEXT}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 500, "completion_tokens": 400, "total_tokens": 900},
+            })
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        size = max(len(REPORT_TEXT) // self.chunks, 1)
+        for start in range(0, len(REPORT_TEXT), size):
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": REPORT_TEXT[start:start + size]}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(self.chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def _create_payment(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        metadata = body.get("metadata", {})
+        payment_id = f"bench-{metadata.get('user_id')}-{metadata.get('service_code')}"
+        self.payments[payment_id] = {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": body.get("amount"),
+            "metadata": metadata,
+            "confirmation": {"type": "redirect", "confirmation_url": f"https://yookassa.example/{payment_id}"},
+        }
+        return web.json_response(self.payments[payment_id])
+
+    async def _get_payment(self, request: web.Request) -> web.Response:
+        payment = self.payments.get(request.match_info["payment_id"])
+        if payment is None:
+            return web.json_response({"type": "error", "code": "not_found"}, status=404)
+        # Оплата «проходит» к моменту проверки
+        return web.json_response({**payment, "status": "succeeded", "paid": True})
+
+    async def _list_payments(self, request: web.Request) -> web.Response:
+        return web.json_response({"type": "list", "items": []})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._completions)
+        app.router.add_post("/v3/payments", self._create_payment)
+        app.router.add_get("/v3/payments", self._list_payments)
+        app.router.add_get("/v3/payments/{payment_id}", self._get_payment)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+async def _loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(loop.time() - expected, 0.0))
+
+
+def _configure_env(services: FakeServices, real_send_limits: bool):
+    base = f"http://127.0.0.1:{services.port}"
+    os.environ.update(
+        TELEGRAM_TOKEN="123456:bench",
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=f"{base}/v1",
+        YOOKASSA_SHOP_ID="bench",
+        YOOKASSA_API_KEY="bench",
+        YOOKASSA_API_URL=f"{base}/v3",
+        BOT_MODE="polling",
+        HTTP_SERVER_IN_POLLING="0",
+        SPECULATIVE_PREFETCH="0",
+    )
+    if not real_send_limits:
+        # По умолчанию меряем бота, а не паузы антифлуда; --real-send-limits включает лимиты Telegram.
+        os.environ.update(SEND_CHAT_RATE="100000", SEND_CHAT_BURST="100000", SEND_GLOBAL_RATE="100000")
+
+
+class ReplayHarness:
+    """Поднимает фейковые сервисы и настоящий Application, проигрывает сценарии за пользователя.
+
+    Используется bench_replay (пропускная способность) и soak (рост памяти). Запускать из
+    временного рабочего каталога: бот пишет data/ и логи относительно cwd.
+    """
+
+    def __init__(
+        self,
+        flows: Dict[str, List[Dict]],
+        *,
+        telegram_latency: float,
+        openai_latency: float,
+        chunks: int,
+        chunk_delay: float,
+        sales_rows: int,
+        real_send_limits: bool = False,
+        think: float = 0.0,
+        tariff: Optional[str] = "agency",
+    ):
+        self.flows = flows
+        self.think = think
+        self.tariff = tariff
+        self.real_send_limits = real_send_limits
+        self.services = FakeServices(openai_latency, chunks, chunk_delay)
+        self.request = FakeTelegramRequest(telegram_latency, {"bench-sales-csv": make_sales_csv(sales_rows)})
+        self.handler_times: Dict[str, List[float]] = {}
+        self.step_times: Dict[str, List[float]] = {}
+        self.errors: List[str] = []
+        self.app = None
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._update_ids = iter(range(1, 10**12))
+
+    async def start(self):
+        await self.services.start()
+        _configure_env(self.services, self.real_send_limits)
+        # main читает config при импорте, поэтому импорт — после подмены окружения
+        import main as bot_main
+
+        self.main = bot_main
+        self.app = bot_main.build_application(self.request)
+        processor = self.app.update_processor
+        original = processor.do_process_update
+
+        async def timed(update, coroutine):
+            started = time.perf_counter()
+            try:
+                await original(update, coroutine)
+            finally:
+                self._record(update, time.perf_counter() - started)
+
+        processor.do_process_update = timed
+
+        async def count_error(update, context):
+            self.errors.append(repr(context.error))
+
+        self.app.add_error_handler(count_error)
+        await self.app.initialize()
+        await self.app.start()
+        await bot_main.on_startup(self.app)
+
+    def _record(self, update, elapsed: float):
+        from telegram import Update
+
+        if not isinstance(update, Update):
+            return
+        if update.callback_query:
+            kind = "cb_handler"
+        elif update.message and update.message.document:
+            kind = "file_handler"
+        else:
+            kind = "text_router"
+        self.handler_times.setdefault(kind, []).append(elapsed)
+        waiter = self._waiters.pop(update.update_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def stop(self):
+        await self.app.stop()
+        await self.main.on_shutdown(self.app)
+        await self.app.shutdown()
+        await self.services.stop()
+
+    def activate_users(self, user_ids: List[int]):
+        # Платные сценарии не должны упираться в проверку тарифа
+        if self.tariff:
+            from ai_marketer.user_db import activate_tariffs
+
+            activate_tariffs([(user_id, self.tariff) for user_id in user_ids])
+
+    async def run_user(self, user_id: int):
+        """Все сценарии за одного пользователя: шаг — апдейт плюс его фоновые задачи."""
+        from telegram import Update
+
+        from ai_marketer.jobs import JOBS
+
+        loop = asyncio.get_running_loop()
+        for flow_name, fixtures in self.flows.items():
+            for fixture in fixtures:
+                update = Update.de_json(_retarget(fixture, next(self._update_ids), user_id), self.app.bot)
+                waiter = self._waiters[update.update_id] = loop.create_future()
+                started = time.perf_counter()
+                await self.app.update_queue.put(update)
+                await waiter
+                while JOBS.running_for(user_id):
+                    await asyncio.sleep(0.01)
+                self.step_times.setdefault(flow_name, []).append(time.perf_counter() - started)
+                if self.think:
+                    await asyncio.sleep(self.think)
+
+    async def send_burst(self, user_id: int, fixtures: List[Dict]):
+        """Все апдейты сразу, не дожидаясь ответов — как быстрые нажатия; ждёт обработки всех."""
+        from telegram import Update
+
+        loop = asyncio.get_running_loop()
+        waiters = []
+        for fixture in fixtures:
+            update = Update.de_json(_retarget(fixture, next(self._update_ids), user_id), self.app.bot)
+            waiters.append(self._waiters.setdefault(update.update_id, loop.create_future()))
+            await self.app.update_queue.put(update)
+        await asyncio.gather(*waiters)
+
+
+async def run(args) -> Dict:
+    harness = ReplayHarness(
+        load_flows(args.flows.split(",")),
+        telegram_latency=args.telegram_latency / 1000,
+        openai_latency=args.openai_latency / 1000,
+        chunks=args.chunks,
+        chunk_delay=args.chunk_delay / 1000,
+        sales_rows=args.sales_rows,
+        real_send_limits=args.real_send_limits,
+        think=args.think / 1000,
+    )
+    await harness.start()
+    users = [args.base_user + idx for idx in range(args.users)]
+    harness.activate_users(users)
+
+    lag: List[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_loop_lag(lag, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(harness.run_user(user_id) for user_id in users))
+    wall = time.perf_counter() - started
+    stop.set()
+    await monitor
+    await harness.stop()
+
+    all_handlers = [value for values in harness.handler_times.values() for value in values]
+    all_steps = [value for values in harness.step_times.values() for value in values]
+    return {
+        "config": {
+            "users": args.users,
+            "flows": list(harness.flows),
+            "telegram_latency_ms": args.telegram_latency,
+            "openai_latency_ms": args.openai_latency,
+            "chunks": args.chunks,
+            "chunk_delay_ms": args.chunk_delay,
+            "sales_rows": args.sales_rows,
+            "real_send_limits": args.real_send_limits,
+        },
+        "updates": len(all_handlers),
+        "errors": len(harness.errors),
+        "wall_seconds": round(wall, 3),
+        "ups": round(len(all_handlers) / wall, 1) if wall else None,
+        "handler": {
+            "all": _stats_ms(all_handlers),
+            **{name: _stats_ms(v) for name, v in sorted(harness.handler_times.items())},
+        },
+        "flow_step": {"all": _stats_ms(all_steps), **{name: _stats_ms(v) for name, v in harness.step_times.items()}},
+        "loop_lag": _stats_ms(lag),
+        "telegram_calls": dict(sorted(harness.request.calls.items())),
+        "openai_calls": harness.services.openai_calls,
+    }
+
+
+def compare(report: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Регрессии относительно baseline больше max_regression процентов."""
+    problems = []
+    if baseline.get("ups") and report.get("ups") is not None:
+        drop = (baseline["ups"] - report["ups"]) / baseline["ups"] * 100
+        if drop > max_regression:
+            problems.append(f"ups: {baseline['ups']} → {report['ups']} (-{drop:.1f}%)")
+    for section in ("handler", "flow_step", "loop_lag"):
+        before = (baseline.get(section) or {}).get("all", baseline.get(section) or {}).get("p99_ms")
+        after = (report.get(section) or {}).get("all", report.get(section) or {}).get("p99_ms")
+        if before and after is not None:
+            growth = (after - before) / before * 100
+            if growth > max_regression:
+                problems.append(f"{section}.p99_ms: {before} → {after} (+{growth:.1f}%)")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--base-user", type=int, default=20_000_000)
+    parser.add_argument("--flows", default="diagnostic,report,payment,sales,strategy")
+    parser.add_argument("--telegram-latency", type=float, default=20.0, help="мс на вызов Bot API")
+    parser.add_argument("--openai-latency", type=float, default=300.0, help="мс до ответа / первого куска")
+    parser.add_argument("--chunks", type=int, default=20, help="кусков в стриминговом ответе")
+    parser.add_argument("--chunk-delay", type=float, default=30.0, help="мс между кусками стрима")
+    parser.add_argument("--sales-rows", type=int, default=5000)
+    parser.add_argument("--think", type=float, default=0.0, help="мс паузы пользователя между шагами")
+    parser.add_argument("--real-send-limits", action="store_true")
+    parser.add_argument("--output", help="куда сохранить JSON-отчёт")
+    parser.add_argument("--compare", help="прошлый JSON-отчёт для сравнения")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="допустимая регрессия, %%")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    workdir = tempfile.mkdtemp(prefix="bench_replay_")
+    os.chdir(workdir)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        os.chdir(ROOT)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    problems = compare(report, baseline, args.max_regression) if baseline else []
+    if baseline:
+        report["regressions"] = problems
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""Проверка клиента ЮKassa на локальной заглушке: повторы, Idempotence-Key и circuit breaker.
+
+    python tools/check_payments.py
+
+Заглушка отвечает по сценарию (503, 400, зависание, успешный платёж) и записывает каждый
+запрос. Клиент и breaker создаются свои, с маленькими таймаутами — глобальный YOOKASSA и
+настройки из окружения не используются. Сценарии:
+
+1. 503, 503, 200 — три попытки с одним и тем же Idempotence-Key, платёж создан.
+2. Платёж создан, но ответ потерян (502) — повтор с тем же ключом возвращает тот же платёж.
+3. 400 — без повторов, breaker остаётся закрытым.
+4. Ошибки подряд открывают breaker: следующий запрос не уходит в сеть.
+5. half-open пропускает ровно один пробный запрос; успех закрывает breaker.
+6. Пробный запрос отменён — слот освобождается, следующий запрос проходит.
+7. Сетевая ошибка (порт закрыт) — повторы и отказ с PaymentsError.
+
+Возвращает 1, если хоть одна проверка не прошла.
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import uuid
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Ключи нужны только для импорта config: сеть не используется
+os.environ.setdefault("TELEGRAM_TOKEN", "payments-check")
+os.environ.setdefault("OPENAI_API_KEY", "payments-check")
+
+from ai_marketer.payments import (  # noqa: E402
+    CircuitBreaker,
+    CircuitOpenError,
+    PaymentsError,
+    YooKassaClient,
+)
+
+FAILURES = 2
+RESET = 0.3
+HANG = 1.0
+
+
+class StubYooKassa:
+    """Заглушка API: ответы берутся из script по порядку, по умолчанию — успех."""
+
+    def __init__(self):
+        self.script: List[Tuple[str, int]] = []
+        self.requests: List[Dict] = []
+        self.payments: Dict[str, Dict] = {}
+        self.port = 0
+        self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        key = request.headers.get("Idempotence-Key")
+        self.requests.append({"method": request.method, "path": request.path, "key": key})
+        action, status = self.script.pop(0) if self.script else ("ok", 200)
+        if action == "hang":
+            await asyncio.sleep(HANG)
+        if action == "status":
+            return web.json_response({"type": "error"}, status=status)
+        payment = self._payment(key)
+        if action == "lost":
+            # Платёж создан, но клиент ответа не увидел
+            return web.json_response({"type": "error"}, status=status)
+        return web.json_response(payment)
+
+    def _payment(self, key) -> Dict:
+        if key is None:
+            return {"id": uuid.uuid4().hex, "status": "pending"}
+        if key not in self.payments:
+            self.payments[key] = {
+                "id": uuid.uuid4().hex,
+                "status": "pending",
+                "confirmation": {"confirmation_url": "https://yookassa.test/pay"},
+            }
+        return self.payments[key]
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def reset(self, *script: Tuple[str, int]):
+        self.script = list(script)
+        self.requests.clear()
+
+
+def _client(port: int) -> YooKassaClient:
+    return YooKassaClient(
+        f"http://127.0.0.1:{port}",
+        "shop",
+        "key",
+        timeout=2.0,
+        retries=3,
+        breaker=CircuitBreaker(FAILURES, RESET),
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _raises(coro, exc_type) -> bool:
+    try:
+        await coro
+    except exc_type:
+        return True
+    return False
+
+
+async def run() -> List[str]:
+    stub = StubYooKassa()
+    await stub.start()
+    client = _client(stub.port)
+    problems: List[str] = []
+
+    def expect(ok: bool, text: str):
+        print(("✅ " if ok else "❌ ") + text)
+        if not ok:
+            problems.append(text)
+
+    try:
+        # 1. Повторы на 5xx с одним ключом
+        stub.reset(("status", 503), ("status", 503))
+        data = await client.create_payment({"amount": {"value": "1.00"}}, idempotence_key="k1")
+        keys = {r["key"] for r in stub.requests}
+        expect(len(stub.requests) == 3 and keys == {"k1"} and data.get("id"), "503, 503, 200: три попытки с одним ключом")
+
+        # 2. Ответ потерян после создания — тот же платёж, а не второй
+        stub.reset(("lost", 502))
+        stub.payments.clear()
+        first = await client.create_payment({"amount": {"value": "1.00"}}, idempotence_key="k2")
+        again = await client.create_payment({"amount": {"value": "1.00"}}, idempotence_key="k2")
+        expect(
+            len(stub.payments) == 1 and first["id"] == again["id"],
+            "потерянный ответ: повтор с тем же ключом вернул тот же платёж",
+        )
+
+        # 3. Ошибка запроса не повторяется и не считается отказом ЮKassa
+        stub.reset(("status", 400))
+        failed = await _raises(client.get_payment("bad"), PaymentsError)
+        expect(
+            failed and len(stub.requests) == 1 and client.breaker.state == "closed",
+            "400: одна попытка, breaker закрыт",
+        )
+
+        # 4. Отказы подряд открывают breaker
+        stub.reset(*[("status", 503)] * (3 * FAILURES))
+        for _ in range(FAILURES):
+            await _raises(client.get_payment("p"), PaymentsError)
+        sent = len(stub.requests)
+        blocked = await _raises(client.get_payment("p"), CircuitOpenError)
+        expect(
+            client.breaker.state == "open" and blocked and len(stub.requests) == sent,
+            f"{FAILURES} отказа подряд: breaker открыт, запрос не ушёл в сеть",
+        )
+
+        # 5. half-open: один пробный запрос, успех закрывает
+        await asyncio.sleep(RESET)
+        stub.reset()
+        probe = asyncio.create_task(client.get_payment("p"))
+        await asyncio.sleep(0)
+        second = await _raises(client.get_payment("p"), CircuitOpenError)
+        await probe
+        expect(second and client.breaker.state == "closed", "half-open: второй запрос отклонён, проба закрыла breaker")
+
+        # 6. Отменённая проба не занимает слот навсегда
+        stub.reset(*[("status", 503)] * (3 * FAILURES))
+        for _ in range(FAILURES):
+            await _raises(client.get_payment("p"), PaymentsError)
+        await asyncio.sleep(RESET)
+        stub.reset(("hang", 0))
+        probe = asyncio.create_task(client.get_payment("p"))
+        while not stub.requests:
+            await asyncio.sleep(0.01)
+        probe.cancel()
+        await _raises(probe, asyncio.CancelledError)
+        stub.reset()
+        recovered = not await _raises(client.get_payment("p"), CircuitOpenError)
+        expect(recovered and client.breaker.state == "closed", "отменённая проба освободила слот half-open")
+    finally:
+        await client.aclose()
+        await stub.stop()
+
+    # 7. Сетевая ошибка: повторы и PaymentsError
+    offline = _client(_free_port())
+    try:
+        failed = await _raises(offline.get_payment("p"), PaymentsError)
+        expect(failed and offline.breaker.failures == 1, "порт закрыт: PaymentsError после повторов")
+    finally:
+        await offline.aclose()
+    return problems
+
+
+def main() -> int:
+    problems = asyncio.run(run())
+    print(f"Проблем: {len(problems)}" if problems else "Клиент ЮKassa ведёт себя как ожидается.")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
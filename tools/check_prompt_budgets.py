@@ -0,0 +1,145 @@
+"""Проверка размера промптов: каждый промпт (FLOWS и ai_marketer/prompts.py) рендерится на
+фикстурах tools/fixtures/prompts.json, считается в токенах и сравнивается с PROMPT_BUDGETS.
+
+    python tools/check_prompt_budgets.py              # таблица; код 1, если есть превышения
+    python tools/check_prompt_budgets.py --show final_report
+
+Бюджеты проверяются по локальной оценке (без сети и зависимостей, одинаковой везде): слова
+латиницей — 4 символа на токен, кириллицей — 3, знаки препинания — по токену, плюс служебные
+токены на каждое сообщение. Оценка намеренно завышает: если установлен tiktoken, рядом
+печатается точный счёт для модели OPENAI_MODEL. Промпт без бюджета и бюджет без промпта —
+тоже ошибка: новый шаблон должен прийти вместе со своим лимитом.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Ключи нужны только для импорта config: сеть не используется
+os.environ.setdefault("TELEGRAM_TOKEN", "prompt-check")
+os.environ.setdefault("OPENAI_API_KEY", "prompt-check")
+
+from ai_marketer import config  # noqa: E402
+from ai_marketer import prompts  # noqa: E402
+from ai_marketer.flows import FLOWS  # noqa: E402
+
+FIXTURES_PATH = os.path.join(ROOT, "tools", "fixtures", "prompts.json")
+# Служебные токены chat-формата: на сообщение и на ответ ассистента
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+Messages = List[Dict[str, str]]
+
+
+def estimate_tokens(text: str) -> int:
+    total = 0
+    for piece in _PIECES.findall(text):
+        if not piece[0].isalnum() and piece[0] != "_":
+            total += 1
+        elif piece.isascii():
+            total += math.ceil(len(piece) / 4)
+        else:
+            total += math.ceil(len(piece) / 3)
+    return total
+
+
+def _tiktoken_counter() -> Optional[Callable[[str], int]]:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        encoding = tiktoken.encoding_for_model(config.OPENAI_MODEL)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+    return lambda text: len(encoding.encode(text))
+
+
+def count_messages(messages: Messages, count: Callable[[str], int]) -> int:
+    return sum(count(m["content"]) + MESSAGE_OVERHEAD for m in messages) + REPLY_OVERHEAD
+
+
+def render_all(fixtures: Dict) -> Dict[str, Messages]:
+    """Все промпты бота в виде сообщений, как они уходят в chat.completions."""
+    answers = fixtures["answers"]
+    demo = fixtures["demo"]
+    rendered = {
+        "demo_ideas": prompts.demo_ideas_prompt(demo["product"], demo["channels"], demo["goal"]),
+        "demo_analysis": prompts.demo_analysis_prompt(answers),
+        "plan_30d": prompts.plan_30d_prompt(answers),
+        "competitor_review": prompts.competitor_review_prompt(fixtures["competitors"], fixtures["competitor_focus"]),
+        "final_report": prompts.final_report_prompt(answers, fixtures["sales_summary"], fixtures["competitors"]),
+    }
+    for key, flow in FLOWS.items():
+        rendered[f"flow:{key}"] = flow.render(fixtures["flow_input"])
+    messages = {name: [{"role": "user", "content": text}] for name, text in rendered.items()}
+    messages["chat"] = prompts.chat_messages(answers, fixtures["chat_history"][-prompts.CHAT_HISTORY_LIMIT:])
+    return messages
+
+
+def check(messages: Dict[str, Messages], budgets: Dict[str, int]) -> List[Dict]:
+    exact = _tiktoken_counter()
+    rows = []
+    for name in sorted(set(messages) | set(budgets)):
+        row = {"name": name, "budget": budgets.get(name), "tokens": None, "tiktoken": None, "problem": None}
+        if name not in messages:
+            row["problem"] = "бюджет есть, промпта нет"
+        else:
+            row["tokens"] = count_messages(messages[name], estimate_tokens)
+            if exact is not None:
+                row["tiktoken"] = count_messages(messages[name], exact)
+            if row["budget"] is None:
+                row["problem"] = "нет бюджета в PROMPT_BUDGETS"
+            elif row["tokens"] > row["budget"]:
+                row["problem"] = f"превышен на {row['tokens'] - row['budget']}"
+        rows.append(row)
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--show", metavar="NAME", help="напечатать отрендеренный промпт")
+    parser.add_argument("--json", action="store_true", help="результат в JSON")
+    args = parser.parse_args()
+
+    with open(args.fixtures, "r", encoding="utf-8") as f:
+        fixtures = json.load(f)
+    messages = render_all(fixtures)
+
+    if args.show:
+        if args.show not in messages:
+            print(f"Нет промпта {args.show!r}. Есть: {', '.join(sorted(messages))}", file=sys.stderr)
+            return 2
+        for message in messages[args.show]:
+            print(f"--- {message['role']}\n{message['content']}")
+        return 0
+
+    rows = check(messages, prompts.PROMPT_BUDGETS)
+    failed = [row for row in rows if row["problem"]]
+    if args.json:
+        print(json.dumps({"rows": rows, "failed": len(failed)}, ensure_ascii=False, indent=2))
+    else:
+        width = max(len(row["name"]) for row in rows)
+        print(f"{'промпт':<{width}}  {'оценка':>7}  {'бюджет':>7}  {'tiktoken':>8}")
+        for row in rows:
+            print(
+                f"{row['name']:<{width}}  {row['tokens'] if row['tokens'] is not None else '-':>7}"
+                f"  {row['budget'] if row['budget'] is not None else '-':>7}"
+                f"  {row['tiktoken'] if row['tiktoken'] is not None else '-':>8}"
+                + (f"  ❌ {row['problem']}" if row["problem"] else "")
+            )
+        print(f"\nПревышений и ошибок: {len(failed)}" if failed else "\nВсе промпты в бюджете.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Проверка PerUserUpdateProcessor: апдейты одного пользователя не пересекаются, разных — идут параллельно.
+
+    python tools/check_update_order.py
+    python tools/check_update_order.py --users 100 --no-lock   # без блокировки проверка должна упасть
+
+Две части:
+1. Процессор отдельно: пересечения апдейтов одного пользователя, порядок, параллельность
+   разных пользователей, лимит max_concurrent_updates и очистка словаря замков. Апдейты
+   приходят пачками от каждого пользователя: ждущие своей очереди не должны занимать слоты,
+   так что при пользователях не меньше лимита заняты все limit слотов.
+2. Настоящий Application (ReplayHarness из bench_replay): каждый пользователь присылает все
+   ответы диагностики разом, не дожидаясь вопросов. TypeHandler'ы в крайних группах отмечают
+   начало и конец обработки: два апдейта пользователя внутри хендлеров одновременно — ошибка.
+   После обработки каждый ответ должен лежать под своим вопросом.
+
+Возвращает 1, если хоть одна проверка не прошла.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_replay import ROOT, ReplayHarness, load_flows  # noqa: E402
+
+from telegram import Update  # noqa: E402
+
+from ai_marketer.update_processor import PerUserUpdateProcessor  # noqa: E402
+
+
+def _update(update_id: int, user_id: int) -> Update:
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+                "text": "x",
+            },
+        },
+        None,
+    )
+
+
+async def check_processor(users: int, per_user: int, limit: int) -> List[str]:
+    processor = PerUserUpdateProcessor(limit)
+    active: Dict[int, int] = {}
+    order: Dict[int, List[int]] = {}
+    overlapped = set()
+    peak = {"total": 0, "now": 0}
+
+    async def handler(user_id: int, seq: int):
+        active[user_id] = active.get(user_id, 0) + 1
+        peak["now"] += 1
+        peak["total"] = max(peak["total"], peak["now"])
+        if active[user_id] > 1:
+            overlapped.add(user_id)
+        order.setdefault(user_id, []).append(seq)
+        # несколько переключений контекста, как при await send_message
+        for _ in range(3):
+            await asyncio.sleep(0.01)
+        active[user_id] -= 1
+        peak["now"] -= 1
+
+    tasks = []
+    update_id = 0
+    # апдейты пользователя подряд: без очереди они попали бы в соседние слоты и пошли одновременно
+    for user_id in range(1, users + 1):
+        for seq in range(per_user):
+            update_id += 1
+            # как Application: задача на апдейт в порядке поступления
+            tasks.append(asyncio.create_task(processor.process_update(_update(update_id, user_id), handler(user_id, seq))))
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - started
+
+    problems = [f"у {len(overlapped)} пользователей апдейты шли одновременно"] if overlapped else []
+    for user_id, seqs in order.items():
+        if seqs != sorted(seqs):
+            problems.append(f"пользователь {user_id}: порядок нарушен {seqs}")
+    if peak["total"] > limit:
+        problems.append(f"одновременно {peak['total']} апдейтов при лимите {limit}")
+    if users > 1 and peak["total"] < 2:
+        problems.append("разные пользователи не обрабатывались параллельно")
+    if users >= limit and peak["total"] < limit:
+        problems.append(f"заняты не все слоты: одновременно {peak['total']} из {limit}")
+    serial = users * per_user * 0.03
+    if users > limit and wall > serial / 2:
+        problems.append(f"нет параллельности: {wall:.2f} с против {serial:.2f} с последовательно")
+    if processor._locks or processor._pending:
+        problems.append(f"словарь замков не очищен: {len(processor._locks)}")
+    print(f"[processor] users={users} per_user={per_user} limit={limit} peak={peak['total']} wall={wall:.2f}s")
+    return problems
+
+
+async def check_application(users: int) -> List[str]:
+    fixtures = load_flows(["diagnostic"])["diagnostic"]
+    # только /start, кнопка и ответы; экспресс-разбор (GPT) для проверки порядка не нужен
+    fixtures = [f for f in fixtures if "message" in f]
+    harness = ReplayHarness(
+        {"diagnostic": fixtures}, telegram_latency=0.01, openai_latency=0, chunks=1, chunk_delay=0, sales_rows=10
+    )
+    await harness.start()
+    from telegram.ext import TypeHandler
+
+    active: Dict[int, int] = {}
+    peak = {"user": 0, "total": 0, "now": 0}
+
+    async def enter(update, context):
+        user_id = update.effective_user.id
+        active[user_id] = active.get(user_id, 0) + 1
+        peak["now"] += 1
+        peak["user"] = max(peak["user"], active[user_id])
+        peak["total"] = max(peak["total"], peak["now"])
+
+    async def leave(update, context):
+        active[update.effective_user.id] -= 1
+        peak["now"] -= 1
+
+    harness.app.add_handler(TypeHandler(Update, enter), group=-100)
+    harness.app.add_handler(TypeHandler(Update, leave), group=10_000)
+    base = 40_000_000
+    try:
+        await asyncio.gather(*(harness.send_burst(base + idx, fixtures) for idx in range(users)))
+    finally:
+        await harness.stop()
+
+    from ai_marketer.state import get_state
+
+    answers = [f["message"]["text"] for f in fixtures[2:]]
+    expected = {key: text for (key, _question), text in zip(harness.main.DIAG_QUESTIONS, answers)}
+    problems = [f"ошибки хендлеров: {harness.errors[:3]}"] if harness.errors else []
+    if peak["user"] > 1:
+        problems.append(f"до {peak['user']} апдейтов одного пользователя обрабатывались одновременно")
+    if users > 1 and peak["total"] < 2:
+        problems.append("разные пользователи не обрабатывались параллельно")
+    for idx in range(users):
+        got = {key: get_state(base + idx).answers.get(key) for key in expected}
+        if got != expected:
+            problems.append(f"пользователь {base + idx}: ответы перемешаны {got}")
+    print(
+        f"[application] users={users} updates/user={len(fixtures)} "
+        f"peak_per_user={peak['user']} peak_total={peak['total']}"
+    )
+    return problems
+
+
+async def run(args) -> List[str]:
+    problems = await check_processor(args.users, args.per_user, args.limit)
+    problems += await check_application(args.users)
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--per-user", type=int, default=5, help="апдейтов на пользователя в первой части")
+    parser.add_argument("--limit", type=int, default=8, help="max_concurrent_updates в первой части")
+    parser.add_argument("--no-lock", action="store_true", help="отключить очередь пользователя (самопроверка)")
+    args = parser.parse_args()
+
+    if args.no_lock:
+        async def unordered(self, update, coroutine):
+            async with self._slots:
+                await coroutine
+
+        PerUserUpdateProcessor.do_process_update = unordered
+
+    workdir = tempfile.mkdtemp(prefix="update_order_")
+    os.chdir(workdir)
+    try:
+        problems = asyncio.run(run(args))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    for problem in problems[:20]:
+        print("❌", problem)
+    print(f"Проблем: {len(problems)}" if problems else "✅ Апдейты пользователя идут по очереди, пользователи — параллельно.")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""Soak-тест памяти: сотни тысяч разных пользователей через основные сценарии на фейковых сервисах.
+
+Поверх ReplayHarness из bench_replay: пользователи идут непрерывным потоком (--concurrency
+одновременно), каждый проходит --flows один раз и больше не возвращается — ровно тот профиль,
+на котором в долгоживущем процессе копятся STATE, chat_history и прочие словари по user_id.
+
+    python tools/soak.py --users 200000
+    python tools/soak.py --users 20000 --sample-every 2000 --max-growth-mb 5 --output soak.json
+
+Каждые --sample-every пользователей (после gc.collect()) снимаются RSS, топ аллокаций
+tracemalloc относительно первого замера после прогрева и число объектов по типам. Рост
+считается наклоном прямой по замерам после --warmup, в МБ на 10k пользователей; при росте
+больше --max-growth-mb скрипт возвращает 1. С tracemalloc порог проверяется по отслеживаемой
+памяти: сам tracemalloc раздувает RSS, поэтому чистый RSS — с --no-tracemalloc. Аллокации
+самого стенда (tools/) из топов исключены.
+
+users.json по умолчанию чистится от уже прошедших пользователей: файловая база
+перечитывается на каждый вызов, и без чистки время прогона растёт квадратично. Память
+процесса это не меняет; --keep-db оставляет базу как есть.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS_DIR)
+
+from bench_replay import ROOT, ReplayHarness, load_flows  # noqa: E402
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+MB = 1024 * 1024
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / MB
+    except OSError:
+        # не Linux: берём пиковый RSS (на macOS ru_maxrss в байтах, на Linux — в КБ)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / MB if sys.platform == "darwin" else peak / 1024
+
+
+def type_counts() -> Counter:
+    return Counter(type(obj).__qualname__ for obj in gc.get_objects())
+
+
+def _slope(points: List[tuple]) -> Optional[float]:
+    """Наклон прямой наименьших квадратов через (x, y)."""
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, os.path.join(TOOLS_DIR, "*")),
+    ))
+
+
+class Sampler:
+    def __init__(self, top: int, with_tracemalloc: bool):
+        self.top = top
+        self.with_tracemalloc = with_tracemalloc
+        self.samples: List[Dict] = []
+        self._baseline_snapshot = None
+        self._baseline_types: Optional[Counter] = None
+
+    def take(self, users_done: int, after_warmup: bool) -> Dict:
+        from ai_marketer import state
+
+        gc.collect()
+        types = type_counts()
+        sample = {
+            "users": users_done,
+            "at": round(time.monotonic(), 1),
+            "rss_mb": round(rss_mb(), 1),
+            "gc_objects": sum(types.values()),
+            "state_users": len(state.STATE),
+        }
+        if self.with_tracemalloc:
+            current, _peak = tracemalloc.get_traced_memory()
+            sample["traced_mb"] = round(current / MB, 1)
+        if after_warmup and self._baseline_types is None:
+            # первый замер после прогрева — точка отсчёта для топов
+            self._baseline_types = types
+            if self.with_tracemalloc:
+                self._baseline_snapshot = _snapshot()
+        elif self._baseline_types is not None:
+            sample["type_growth"] = [
+                {"type": name, "count": types[name], "delta": delta}
+                for name, delta in (types - self._baseline_types).most_common(self.top)
+            ]
+            if self._baseline_snapshot is not None:
+                snapshot = _snapshot()
+                sample["top_allocations"] = [
+                    {
+                        "where": str(stat.traceback[0]),
+                        "size_mb": round(stat.size / MB, 2),
+                        "delta_mb": round(stat.size_diff / MB, 2),
+                        "count_delta": stat.count_diff,
+                    }
+                    for stat in snapshot.compare_to(self._baseline_snapshot, "lineno")[: self.top]
+                ]
+        self.samples.append(sample)
+        return sample
+
+
+def prune_db(keep: set):
+    """Оставляет в users.json только пользователей, которые ещё в работе."""
+    from ai_marketer import user_db
+
+    data = user_db._load_db()
+    user_db._save_db({key: value for key, value in data.items() if int(key) in keep})
+
+
+async def run(args) -> Dict:
+    harness = ReplayHarness(
+        load_flows(args.flows.split(",")),
+        telegram_latency=args.telegram_latency / 1000,
+        openai_latency=args.openai_latency / 1000,
+        chunks=args.chunks,
+        chunk_delay=0,
+        sales_rows=args.sales_rows,
+    )
+    if args.tracemalloc:
+        tracemalloc.start(args.traceback_depth)
+    await harness.start()
+    sampler = Sampler(args.top, args.tracemalloc)
+    sampler.take(0, after_warmup=args.warmup == 0)
+
+    next_user = iter(range(args.base_user, args.base_user + args.users))
+    in_flight: set = set()
+    done = 0
+    updates = 0
+    next_sample = args.sample_every
+    started = time.perf_counter()
+
+    async def worker():
+        nonlocal done, updates, next_sample
+        for user_id in next_user:
+            in_flight.add(user_id)
+            harness.activate_users([user_id])
+            await harness.run_user(user_id)
+            in_flight.discard(user_id)
+            done += 1
+            if not args.keep_db and done % args.prune_every == 0:
+                prune_db(in_flight)
+            if done >= next_sample:
+                next_sample += args.sample_every
+                # тайминги стенду не нужны, а копить их — та же утечка, только в самом стенде
+                updates += sum(len(v) for v in harness.handler_times.values())
+                harness.handler_times.clear()
+                harness.step_times.clear()
+                sample = sampler.take(done, after_warmup=done >= args.warmup)
+                print(
+                    f"[soak] users={done} rss={sample['rss_mb']}MB objects={sample['gc_objects']} "
+                    f"state={sample['state_users']} errors={len(harness.errors)}",
+                    file=sys.stderr,
+                )
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall = time.perf_counter() - started
+    await harness.stop()
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    measured = [s for s in sampler.samples if s["users"] >= args.warmup]
+    rss_slope = _slope([(s["users"], s["rss_mb"]) for s in measured])
+    traced_slope = _slope([(s["users"], s["traced_mb"]) for s in measured if "traced_mb" in s])
+    growth = {
+        "rss_mb_per_10k": round(rss_slope * 10_000, 3) if rss_slope is not None else None,
+        "traced_mb_per_10k": round(traced_slope * 10_000, 3) if traced_slope is not None else None,
+    }
+    gate = "traced_mb_per_10k" if args.tracemalloc else "rss_mb_per_10k"
+    failed = []
+    if growth[gate] is not None and growth[gate] > args.max_growth_mb:
+        failed.append(f"{gate}: {growth[gate]} > {args.max_growth_mb}")
+    return {
+        "config": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "flows": list(harness.flows),
+            "warmup": args.warmup,
+            "sample_every": args.sample_every,
+            "max_growth_mb_per_10k": args.max_growth_mb,
+            "tracemalloc": args.tracemalloc,
+        },
+        "users_done": done,
+        "updates": updates + sum(len(v) for v in harness.handler_times.values()),
+        "errors": len(harness.errors),
+        "error_examples": harness.errors[:5],
+        "wall_seconds": round(wall, 1),
+        "growth": growth,
+        "failed": failed,
+        "samples": sampler.samples,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--base-user", type=int, default=30_000_000)
+    parser.add_argument("--concurrency", type=int, default=50, help="пользователей одновременно")
+    parser.add_argument("--flows", default="diagnostic,chat,payment,strategy")
+    parser.add_argument("--sample-every", type=int, default=10_000)
+    parser.add_argument("--warmup", type=int, default=10_000, help="пользователей до начала отсчёта роста")
+    parser.add_argument("--max-growth-mb", type=float, default=2.0, help="допустимый рост, МБ на 10k пользователей")
+    parser.add_argument("--top", type=int, default=15, help="строк в топах аллокаций и типов")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false")
+    parser.add_argument("--traceback-depth", type=int, default=1)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="мс на вызов Bot API")
+    parser.add_argument("--openai-latency", type=float, default=0.0, help="мс до ответа OpenAI")
+    parser.add_argument("--chunks", type=int, default=3)
+    parser.add_argument("--sales-rows", type=int, default=500)
+    parser.add_argument("--prune-every", type=int, default=100)
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument("--output", help="куда сохранить JSON-отчёт")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="soak_")
+    os.chdir(workdir)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        os.chdir(ROOT)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
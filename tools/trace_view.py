@@ -0,0 +1,125 @@
+"""Просмотр трасс из traces.jsonl (JSONL или OTLP/JSON).
+
+Примеры:
+    python tools/trace_view.py --user 123456        # последние трассы пользователя
+    python tools/trace_view.py --slowest 10         # самые долгие апдейты
+    python tools/trace_view.py 4f9c1e               # дерево и критический путь трассы
+"""
+
+import argparse
+import json
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+
+def _otlp_attrs(items: List[Dict]) -> Dict:
+    attrs = {}
+    for item in items or []:
+        value = item.get("value", {})
+        attrs[item.get("key")] = next(iter(value.values()), None) if value else None
+    return attrs
+
+
+def load_spans(path: str) -> List[Dict]:
+    spans: List[Dict] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "resourceSpans" not in record:
+                spans.append(record)
+                continue
+            for resource in record["resourceSpans"]:
+                for scope in resource.get("scopeSpans", []):
+                    for sp in scope.get("spans", []):
+                        start, end = int(sp["startTimeUnixNano"]), int(sp["endTimeUnixNano"])
+                        spans.append({
+                            "trace_id": sp["traceId"],
+                            "span_id": sp["spanId"],
+                            "parent_id": sp.get("parentSpanId"),
+                            "name": sp["name"],
+                            "start_ns": start,
+                            "end_ns": end,
+                            "duration_ms": (end - start) / 1e6,
+                            "attrs": _otlp_attrs(sp.get("attributes")),
+                            "error": sp.get("status", {}).get("message"),
+                        })
+    return spans
+
+
+def critical_path(root: Dict, children: Dict[str, List[Dict]]) -> List[Dict]:
+    """На каждом уровне идём в потомка, который закончился последним — он держал родителя."""
+    path = [root]
+    node = root
+    while children.get(node["span_id"]):
+        node = max(children[node["span_id"]], key=lambda sp: sp["end_ns"])
+        path.append(node)
+    return path
+
+
+def print_tree(node: Dict, children: Dict[str, List[Dict]], on_path: set, t0: int, depth: int = 0):
+    mark = "*" if node["span_id"] in on_path else " "
+    offset = (node["start_ns"] - t0) / 1e6
+    attrs = {k: v for k, v in (node.get("attrs") or {}).items() if v is not None}
+    error = f"  !! {node['error']}" if node.get("error") else ""
+    print(f"{mark} {'  ' * depth}{node['name']:<32} +{offset:9.1f} ms  {node['duration_ms']:9.1f} ms  {attrs}{error}")
+    for child in sorted(children.get(node["span_id"], []), key=lambda sp: sp["start_ns"]):
+        print_tree(child, children, on_path, t0, depth + 1)
+
+
+def show_trace(spans: List[Dict], trace_prefix: str) -> int:
+    trace_spans = [sp for sp in spans if sp["trace_id"].startswith(trace_prefix)]
+    if not trace_spans:
+        print(f"Трасса {trace_prefix} не найдена", file=sys.stderr)
+        return 1
+    children: Dict[str, List[Dict]] = defaultdict(list)
+    roots = []
+    for sp in trace_spans:
+        if sp.get("parent_id"):
+            children[sp["parent_id"]].append(sp)
+        else:
+            roots.append(sp)
+    for root in roots:
+        path = critical_path(root, children)
+        print(f"trace {root['trace_id']}  {root['name']}  {root['duration_ms']:.1f} ms")
+        print_tree(root, children, {sp["span_id"] for sp in path}, root["start_ns"])
+        print("\nКритический путь:")
+        for sp in path:
+            own = sp["duration_ms"] - sum(c["duration_ms"] for c in children.get(sp["span_id"], []))
+            print(f"  {sp['name']:<32} {sp['duration_ms']:9.1f} ms  (собственное время ~{max(own, 0):.1f} ms)")
+    return 0
+
+
+def list_roots(spans: List[Dict], *, user_id: str = None, slowest: int = 0):
+    roots = [sp for sp in spans if not sp.get("parent_id")]
+    if user_id:
+        roots = [sp for sp in roots if str((sp.get("attrs") or {}).get("user_id")) == user_id]
+    if slowest:
+        roots = sorted(roots, key=lambda sp: sp["duration_ms"], reverse=True)[:slowest]
+    else:
+        roots = sorted(roots, key=lambda sp: sp["start_ns"])[-20:]
+    for sp in roots:
+        attrs = sp.get("attrs") or {}
+        print(f"{sp['trace_id']}  {sp['name']:<14} {sp['duration_ms']:9.1f} ms  user={attrs.get('user_id')} update={attrs.get('update_id')}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_id", nargs="?", help="id трассы (достаточно префикса)")
+    parser.add_argument("--file", default="traces.jsonl")
+    parser.add_argument("--user", help="показать трассы пользователя")
+    parser.add_argument("--slowest", type=int, default=0, help="показать N самых долгих трасс")
+    args = parser.parse_args()
+
+    spans = load_spans(args.file)
+    if args.trace_id:
+        return show_trace(spans, args.trace_id)
+    list_roots(spans, user_id=args.user, slowest=args.slowest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
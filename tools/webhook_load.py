@@ -0,0 +1,129 @@
+"""Нагрузочный тест webhook-эндпоинта записанными апдейтами.
+
+Размножает апдейты из fixtures на N пользователей (новые update_id, user_id, chat_id),
+шлёт их POST-запросами с заданной параллельностью и ждёт, пока очередь бота опустеет.
+
+    BOT_MODE=webhook WEBHOOK_SECRET=load python main.py          # в соседнем терминале
+    python tools/webhook_load.py --secret load --users 200 --concurrency 32
+
+Печатает JSON: приём (req/s, p50/p99 ответа) и полную обработку (updates/s до пустой очереди).
+Для сравнения с polling: в polling апдейты приходят пачками getUpdates последовательно,
+поэтому пропускная способность ограничена одним long-poll запросом за раз.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+import aiohttp
+
+
+def load_fixtures(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _retarget(update: Dict, update_id: int, user_id: int) -> Dict:
+    update = copy.deepcopy(update)
+    update["update_id"] = update_id
+    for key in ("message", "callback_query"):
+        payload = update.get(key)
+        if not payload:
+            continue
+        payload["from"]["id"] = user_id
+        message = payload if key == "message" else payload.get("message", {})
+        if "chat" in message:
+            message["chat"]["id"] = user_id
+    return update
+
+
+def build_updates(fixtures: List[Dict], users: int, base_user: int) -> List[Dict]:
+    updates = []
+    update_id = 1
+    # Пользователи идут «вперемешку»: шаг сценария i для всех, затем шаг i+1.
+    for fixture in fixtures:
+        for idx in range(users):
+            updates.append(_retarget(fixture, update_id, base_user + idx))
+            update_id += 1
+    return updates
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct), len(values) - 1)]
+
+
+async def run(args) -> Dict:
+    updates = build_updates(load_fixtures(args.fixtures), args.users, args.base_user)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+    latencies: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                update = queue.get_nowait()
+                started = time.perf_counter()
+                try:
+                    async with session.post(args.url, json=update) as resp:
+                        if resp.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        ingest_s = time.perf_counter() - started
+
+        health_url = args.url.rsplit("/", 1)[0] + "/healthz"
+        drained_s = None
+        deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < deadline:
+            async with session.get(health_url) as resp:
+                if (await resp.json()).get("update_queue", 0) == 0:
+                    drained_s = time.perf_counter() - started
+                    break
+            await asyncio.sleep(0.05)
+
+    return {
+        "updates": len(updates),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "ingest_seconds": round(ingest_s, 3),
+        "ingest_rps": round(len(updates) / ingest_s, 1) if ingest_s else None,
+        "ack_p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "ack_p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "drained_seconds": round(drained_s, 3) if drained_s else None,
+        "processed_ups": round(len(updates) / drained_s, 1) if drained_s else None,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram")
+    parser.add_argument("--secret", required=True, help="WEBHOOK_SECRET бота")
+    parser.add_argument("--fixtures", default="tools/fixtures/updates.jsonl")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--base-user", type=int, default=10_000_000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())